@@ -2,12 +2,22 @@ import os
 import sys
 import json
 import re
+import math
+import time
+import threading
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
 import cv2
 import pygame
 import tkinter as tk
 from tkinter import messagebox, filedialog, simpledialog, Toplevel, StringVar, BooleanVar, OptionMenu, Entry, Button, Label, Checkbutton, Frame, LabelFrame, Scrollbar, Canvas
 from PIL import Image, ImageTk, ImageFont, ImageDraw
+import numpy as np
+import geometriaBox
 import copy
+import bisect
+import hashlib
 
 # --- REGEX GLOBALI PRE-COMPILATE ---
 # RE_OCR_STARTS: Serve per identificare velocemente le classi OCR senza ricompilare ogni volta
@@ -51,6 +61,64 @@ SAVE_MODE_NO_SAVE = "UNSAFE"
 SAVE_MODE_SMART = "SMART"
 
 
+# --- PREFETCH IMMAGINI ---
+# PREFETCH_AHEAD: immagini decodificate in anticipo nella direzione di navigazione
+# PREFETCH_BEHIND: immagini tenute pronte nella direzione opposta (tornare indietro di uno)
+PREFETCH_AHEAD = 3
+PREFETCH_BEHIND = 1
+PREFETCH_WORKERS = 2
+
+# --- RENDERING VIEWPORT ---
+# Durante zoom/pan si ricampiona con filtro veloce; a interazione ferma da
+# RENDER_REFINE_DELAY_MS si ridisegna la stessa regione con LANCZOS.
+RENDER_REFINE_DELAY_MS = 150
+
+# --- PIRAMIDE MULTI-RISOLUZIONE ---
+# Livelli ridotti (1/2, 1/4, 1/8) costruiti una volta nel worker di prefetch;
+# il render ricampiona dal livello più piccolo ancora >= della scala richiesta.
+PYRAMID_FACTORS = (2, 4, 8)
+PYRAMID_MIN_SIDE = 64
+
+# --- INDICE ANNOTAZIONI ---
+# File SQLite nella cartella immagini con classi/save_count di ogni JSON,
+# aggiornato per differenza di stat (mtime/size) invece di rileggere tutti i JSON.
+ANNOTATION_INDEX_FILENAME = ".annotaimmagini_index.sqlite"
+ANNOTATION_INDEX_VERSION = 1
+
+# Debug: con ANNOTA_CACHE_CHECK=1 dopo ogni salvataggio la cache in memoria delle
+# classi viene confrontata con i JSON su disco (lento: rilegge tutta la cartella).
+CACHE_CHECK = os.environ.get("ANNOTA_CACHE_CHECK", "") == "1"
+
+# --- SCRITTURA JSON IN BACKGROUND ---
+# I salvataggi vanno in coda a un thread dedicato (niente blocchi su cartelle di rete).
+# Ogni scrittura in sospeso è registrata nel journal locale dell'utente
+# (%LOCALAPPDATA%/annotaimmagini/journalSalvataggi, su Linux/macOS ~/.local/state/...)
+# e rieseguita all'avvio successivo se il programma si è chiuso prima di completarla.
+# Ogni istanza ha il suo journal (sottocartella con file di lock): all'avvio si
+# riprendono solo i journal il cui lock è libero, cioè di istanze non più in esecuzione.
+# Se la cartella non si può creare si lavora senza journal.
+JSON_JOURNAL_DIRNAME = "journalSalvataggi"
+JSON_JOURNAL_LOCK = ".lock"
+JSON_WRITER_POLL_MS = 250
+
+# --- UNDO / REDO ---
+# La storia salva solo i box cambiati (patch), non copie complete della lista.
+# Spostamenti/resize consecutivi dello stesso box entro UNDO_COALESCE_S secondi
+# diventano un'unica voce. Oltre UNDO_MEMORY_BUDGET (stima in byte, tutte le
+# immagini insieme) si scarta la storia delle immagini usate meno di recente.
+UNDO_COALESCE_S = 1.5
+UNDO_COALESCE_ACTIONS = ("Move box", "Resize box")
+UNDO_MEMORY_BUDGET = 16 * 1024 * 1024
+
+# --- SOVRAPPOSIZIONI ---
+# Classi escluse dal controllo e frazione di box cambiati oltre la quale
+# l'indice spaziale si ricostruisce da zero invece di aggiornarsi box per box.
+OVERLAP_IGNORED_CLASSES = ('ocr',)
+OVERLAP_REBUILD_FRACTION = 0.25
+OVERLAP_MAX_CELLS = 64  # box più grandi non entrano nella griglia, si confrontano con tutti
+OVERLAP_VECTOR_MIN = 32  # da quanti candidati l'IoU si calcola in blocco con geometriaBox.iou_matrix
+
+
 # Aggiunge il supporto per il ri-campionamento di PIL
 try:
     # Per PIL 10.0.0 e successive
@@ -331,6 +399,836 @@ class CreateToolTip(object):
             self.tw.destroy()
         self.tw = None
 
+# ====================================================================
+# PREFETCH E DECODIFICA IN BACKGROUND
+# ====================================================================
+
+def _decode_image_rgb(image_path):
+    """Legge l'immagine dal disco e la converte in PIL RGB (eseguibile fuori dal thread Tk)."""
+    img_cv2 = cv2.imread(image_path)
+    if img_cv2 is None:
+        raise FileNotFoundError("Immagine non valida o non trovata")
+    img_rgb = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(img_rgb)
+
+
+class ImagePyramid(object):
+    """Immagine a piena risoluzione più i livelli ridotti definiti da PYRAMID_FACTORS."""
+    def __init__(self, base, factors=PYRAMID_FACTORS):
+        self.base = base
+        self.levels = [(1, base)]
+
+        current = base
+        current_factor = 1
+        for factor in sorted(factors):
+            step = factor // current_factor
+            if min(current.size) // step < PYRAMID_MIN_SIDE:
+                break
+            # reduce() fa la media a blocchi: molto più economica di un LANCZOS dal pieno
+            current = current.reduce(step)
+            current_factor = factor
+            self.levels.append((factor, current))
+
+    def level_for_scale(self, scale):
+        """Restituisce (fattore, immagine) del livello più piccolo con risoluzione >= scale."""
+        best = self.levels[0]
+        for factor, img in self.levels:
+            if factor * scale <= 1.0:
+                best = (factor, img)
+        return best
+
+
+def _decode_image_pyramid(image_path):
+    """Decodifica + piramide: tutto il lavoro pesante resta nel worker di prefetch."""
+    return ImagePyramid(_decode_image_rgb(image_path))
+
+
+class ImagePrefetcher(object):
+    """
+    Anello LRU di immagini già decodificate (con la loro piramide), alimentato
+    da un pool di worker. Il thread Tk chiede solo get(); schedule() prepara le
+    prossime immagini nella direzione di navigazione ed espelle le altre, così la
+    memoria resta limitata alla finestra di prefetch. Nessuna chiamata Tk nei worker.
+    """
+    def __init__(self, ahead=PREFETCH_AHEAD, behind=PREFETCH_BEHIND, workers=PREFETCH_WORKERS,
+                 decoder=_decode_image_pyramid):
+        self.ahead = ahead
+        self.behind = behind
+        self.capacity = ahead + behind + 1
+        self.decoder = decoder
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._ring = OrderedDict()  # path -> Future con l'immagine decodificata
+
+        # Contatori esposti nella status bar
+        self.hits = 0
+        self.misses = 0
+        self.decode_count = 0
+        self.decode_ms_total = 0.0
+        self.last_decode_ms = 0.0
+
+    def _timed_decode(self, path):
+        t0 = time.perf_counter()
+        img = self.decoder(path)
+        elapsed = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            self.decode_count += 1
+            self.decode_ms_total += elapsed
+            self.last_decode_ms = elapsed
+        return img
+
+    def get(self, path):
+        """Restituisce la piramide decodificata: dall'anello se presente, altrimenti la decodifica subito."""
+        with self._lock:
+            fut = self._ring.get(path)
+            if fut is not None and fut.done() and fut.exception() is not None:
+                # Decodifica fallita in background: riprova in modo sincrono (e mostra l'errore)
+                del self._ring[path]
+                fut = None
+            if fut is not None:
+                self._ring.move_to_end(path)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if fut is not None:
+            # Se il worker sta ancora decodificando aspettiamo solo il tempo residuo
+            return fut.result()
+
+        img = self._timed_decode(path)
+        done = Future()
+        done.set_result(img)
+        with self._lock:
+            self._ring[path] = done
+            self._trim()
+        return img
+
+    def schedule(self, paths):
+        """
+        Mantiene nell'anello solo i path indicati (ordinati per priorità) e
+        avvia la decodifica di quelli mancanti.
+        """
+        wanted = list(dict.fromkeys(paths))[:self.capacity]
+        with self._lock:
+            for path in list(self._ring):
+                if path not in wanted:
+                    self._ring.pop(path).cancel()
+            for path in wanted:
+                if path not in self._ring:
+                    self._ring[path] = self._executor.submit(self._timed_decode, path)
+
+    def discard(self, path):
+        """Rimuove un'immagine dall'anello (es. file eliminato)."""
+        with self._lock:
+            fut = self._ring.pop(path, None)
+            if fut is not None:
+                fut.cancel()
+
+    def clear(self):
+        with self._lock:
+            for fut in self._ring.values():
+                fut.cancel()
+            self._ring.clear()
+
+    def _trim(self):
+        while len(self._ring) > self.capacity:
+            _, fut = self._ring.popitem(last=False)
+            fut.cancel()
+
+    def stats_text(self):
+        with self._lock:
+            total = self.hits + self.misses
+            avg = (self.decode_ms_total / self.decode_count) if self.decode_count else 0.0
+            return (f"Prefetch hit {self.hits}/{total} (miss {self.misses}) | "
+                    f"decode {self.last_decode_ms:.0f} ms (media {avg:.0f} ms)")
+
+# ====================================================================
+# SCRITTURA JSON ASINCRONA CON JOURNAL
+# ====================================================================
+
+def _write_json_atomic(json_path, data):
+    """Scrittura sicura: file temporaneo + fsync + os.replace (l'originale resta integro in caso di errore)."""
+    temp_path = json_path + ".tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+            f.flush() # Forza la scrittura su disco
+            os.fsync(f.fileno()) # Assicurati che il sistema operativo scriva fisicamente
+        os.replace(temp_path, json_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            try: os.remove(temp_path)
+            except OSError: pass
+        raise
+
+
+def _default_journal_root():
+    """Cartella per-utente scrivibile che contiene i journal delle istanze."""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_STATE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".local", "state")
+    return os.path.join(base, "annotaimmagini", JSON_JOURNAL_DIRNAME)
+
+
+def _try_lock_file(f):
+    """Lock esclusivo non bloccante sul file aperto f (vale finché il processo lo tiene aperto)."""
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)   # tutte le istanze bloccano lo stesso byte
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _fsync_dir(path):
+    """Rende persistenti le voci della cartella (rename/creazioni). Su Windows non serve/non è possibile."""
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AsyncJsonWriter(object):
+    """
+    Thread unico che scrive i JSON di annotazione. submit() è immediato per il
+    thread Tk: mette il contenuto in coda (un solo slot per file, così salvataggi
+    ravvicinati sulla stessa immagine si fondono nell'ultimo) e lo annota nel journal
+    locale. Il journal viene cancellato solo quando la scrittura definitiva è riuscita.
+    Le scritture completate/fallite si ritirano con pop_results() dal thread Tk.
+    journal_root: cartella dei journal (None = nessun journal); questa istanza usa una
+    sua sottocartella, bloccata con un file di lock finché il processo è vivo.
+    """
+    def __init__(self, journal_root=None):
+        self.journal_root = journal_root
+        self.journal_dir = None
+        self._lock_file = None
+        if journal_root is not None:
+            self._open_journal(journal_root)
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # json_path -> (seq, tag, data)
+        self._in_flight = None          # (json_path, seq, tag, data) in scrittura
+        self._results = []              # (tag, json_path, data, errore o None)
+        self._seq = 0
+        self._closed = False
+
+        # Contatori esposti nella status bar
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.last_write_ms = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="json-writer", daemon=True)
+        self._thread.start()
+
+    def _open_journal(self, journal_root):
+        journal_dir = os.path.join(journal_root, f"sessione-{os.getpid()}-{int(time.time() * 1000)}")
+        try:
+            os.makedirs(journal_dir)
+            lock_file = open(os.path.join(journal_dir, JSON_JOURNAL_LOCK), "a+")
+            if not _try_lock_file(lock_file):
+                lock_file.close()
+                raise OSError(f"lock del journal non ottenuto in {journal_dir}")
+        except OSError as e:
+            print(f"Journal salvataggi non disponibile ({journal_root}): {e}. Proseguo senza journal.")
+            return
+        self.journal_dir = journal_dir
+        self._lock_file = lock_file
+
+    def _close_journal(self):
+        if self._lock_file is None:
+            return
+        self._lock_file.close()   # rilascia il lock
+        self._lock_file = None
+        # Journal vuoto (tutto scritto): la cartella non serve più
+        try:
+            if os.listdir(self.journal_dir) == [JSON_JOURNAL_LOCK]:
+                os.remove(os.path.join(self.journal_dir, JSON_JOURNAL_LOCK))
+                os.rmdir(self.journal_dir)
+        except OSError:
+            pass
+
+    def _journal_path(self, json_path):
+        key = os.path.normcase(os.path.abspath(json_path))
+        return os.path.join(self.journal_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _write_journal(self, json_path, seq, data):
+        if self.journal_dir is None:
+            return
+        entry = {"path": os.path.abspath(json_path), "seq": seq, "data": data}
+        jp = self._journal_path(json_path)
+        with open(jp + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(jp + ".tmp", jp)
+        _fsync_dir(self.journal_dir)
+
+    def _remove_journal(self, json_path):
+        if self.journal_dir is None:
+            return
+        try:
+            os.remove(self._journal_path(json_path))
+        except OSError:
+            pass
+
+    def submit(self, json_path, data, tag=None):
+        """Accoda la scrittura di data in json_path (sostituisce un'eventuale scrittura in sospeso dello stesso file)."""
+        data = copy.deepcopy(data)  # il chiamante può continuare a modificare i suoi box
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+            if json_path in self._pending:
+                self.coalesced += 1
+            self._pending[json_path] = (seq, tag, data)
+            try:
+                self._write_journal(json_path, seq, data)
+            except Exception as e:
+                print(f"Journal salvataggi non scrivibile ({self.journal_dir}): {e}")
+            self._cond.notify()
+
+    def pending_data(self, json_path):
+        """Contenuto non ancora su disco per json_path (ultimo accodato o in scrittura), altrimenti None."""
+        with self._cond:
+            if json_path in self._pending:
+                data = self._pending[json_path][2]
+            elif self._in_flight is not None and self._in_flight[0] == json_path:
+                data = self._in_flight[3]
+            else:
+                return None
+        return copy.deepcopy(data)
+
+    def cancel(self, json_path):
+        """Annulla le scritture di json_path (es. prima di cancellare il file); attende quella già in corso."""
+        with self._cond:
+            self._pending.pop(json_path, None)
+            while self._in_flight is not None and self._in_flight[0] == json_path:
+                self._cond.wait()
+            self._remove_journal(json_path)
+
+    def backlog(self):
+        with self._cond:
+            return len(self._pending) + (1 if self._in_flight is not None else 0)
+
+    def flush(self, timeout=None):
+        """Attende che la coda sia vuota. True se tutto è stato scritto entro timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._in_flight is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        done = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        # Con scritture non completate il journal resta e verrà ripreso al prossimo avvio
+        self._close_journal()
+        return done
+
+    def pop_results(self):
+        with self._cond:
+            results, self._results = self._results, []
+            return results
+
+    def replay_journal(self):
+        """
+        Riaccoda le scritture rimaste nei journal di istanze terminate (lock libero).
+        Le voci passano nel journal di questa istanza prima di togliere quelle vecchie.
+        I journal di istanze ancora aperte non vengono toccati. Restituisce quante voci.
+        """
+        if self.journal_dir is None:
+            return 0
+        replayed = 0
+        for session in sorted(os.listdir(self.journal_root)):
+            session_dir = os.path.join(self.journal_root, session)
+            if session_dir == self.journal_dir or not os.path.isdir(session_dir):
+                continue
+            try:
+                lock_file = open(os.path.join(session_dir, JSON_JOURNAL_LOCK), "a+")
+            except OSError:
+                continue
+            try:
+                if not _try_lock_file(lock_file):
+                    continue   # istanza ancora in esecuzione: il journal è suo
+                replayed += self._adopt_session(session_dir)
+            finally:
+                lock_file.close()
+            try:
+                os.remove(os.path.join(session_dir, JSON_JOURNAL_LOCK))
+                os.rmdir(session_dir)
+            except OSError:
+                pass
+        return replayed
+
+    def _adopt_session(self, session_dir):
+        entries = []
+        for name in os.listdir(session_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(session_dir, name), "r", encoding="utf-8") as f:
+                    entries.append((name, json.load(f)))
+            except Exception as e:
+                print(f"Voce di journal illeggibile {name}: {e}")
+        entries.sort(key=lambda item: item[1].get("seq", 0))
+        for name, entry in entries:
+            self.submit(entry["path"], entry["data"])
+            os.remove(os.path.join(session_dir, name))
+        return len(entries)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                json_path, (seq, tag, data) = self._pending.popitem(last=False)
+                self._in_flight = (json_path, seq, tag, data)
+
+            t0 = time.perf_counter()
+            error = None
+            try:
+                _write_json_atomic(json_path, data)
+            except Exception as e:
+                error = e
+            elapsed = (time.perf_counter() - t0) * 1000.0
+
+            with self._cond:
+                self._in_flight = None
+                self.last_write_ms = elapsed
+                if error is None:
+                    self.written += 1
+                    # Il journal si toglie solo se nel frattempo non è arrivato un salvataggio più nuovo
+                    if json_path not in self._pending:
+                        self._remove_journal(json_path)
+                else:
+                    # Il journal resta: la scrittura verrà ritentata al prossimo avvio
+                    self.failed += 1
+                self._results.append((tag, json_path, data, error))
+                self._cond.notify_all()
+
+    def stats_text(self):
+        with self._cond:
+            backlog = len(self._pending) + (1 if self._in_flight is not None else 0)
+            text = f"Salvataggi: coda {backlog} | ultimo {self.last_write_ms:.0f} ms | scritti {self.written}"
+            if self.coalesced:
+                text += f" (uniti {self.coalesced})"
+            if self.failed:
+                text += f" | ERRORI {self.failed}"
+            return text
+
+# ====================================================================
+# UNDO / REDO A PATCH
+# ====================================================================
+# Gli stati si congelano in tuple immutabili: ("d", ((chiave, valore), ...)) per
+# i dict e ("l", (...)) per le liste. Confrontabili in O(n) e senza deepcopy.
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return ("d", tuple((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return ("l", tuple(_freeze(v) for v in value))
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, tuple):
+        if value[0] == "d":
+            return {k: _thaw(v) for k, v in value[1]}
+        return [_thaw(v) for v in value[1]]
+    return value
+
+
+def _diff_boxes(before, after):
+    """
+    Patch minima tra due tuple di box congelati: (start, vecchi, nuovi) dove vecchi/nuovi
+    sostituiscono before[start:start+len(vecchi)]. None se identiche.
+    Prefisso e suffisso comuni non vengono memorizzati.
+    """
+    if before == after:
+        return None
+    n_before, n_after = len(before), len(after)
+    start = 0
+    limit = min(n_before, n_after)
+    while start < limit and before[start] == after[start]:
+        start += 1
+    end_b, end_a = n_before, n_after
+    while end_b > start and end_a > start and before[end_b - 1] == after[end_a - 1]:
+        end_b -= 1
+        end_a -= 1
+    return (start, before[start:end_b], after[start:end_a])
+
+
+def _apply_patch(state, patch, reverse=False):
+    """Applica una patch di _diff_boxes a uno stato congelato (reverse=True per annullarla)."""
+    start, old, new = patch
+    if reverse:
+        old, new = new, old
+    return state[:start] + new + state[start + len(old):]
+
+
+def _estimate_size(frozen):
+    """Stima grossolana in byte di un valore congelato (per il budget di memoria della storia)."""
+    if isinstance(frozen, tuple):
+        return 56 + 8 * len(frozen) + sum(_estimate_size(v) for v in frozen)
+    if isinstance(frozen, str):
+        return 50 + len(frozen)
+    return 28
+
+
+# ====================================================================
+# SOVRAPPOSIZIONI TRA BOX (INDICE SPAZIALE A GRIGLIA)
+# ====================================================================
+
+def _overlap_signature(box):
+    """Chiave del box per il controllo sovrapposizioni: tuple delle coordinate, None se escluso."""
+    coords = box.get('coords') if isinstance(box, dict) else None
+    if not isinstance(coords, list) or len(coords) != 4:
+        return None
+    if box.get('class', '').lower() in OVERLAP_IGNORED_CLASSES:
+        return None
+    return tuple(coords)
+
+
+def compute_overlaps_pairwise(bboxes, iou_threshold=0.8):
+    """
+    Controllo di riferimento O(n²) su tutte le coppie (il ciclo storico di _compute_overlaps).
+    Restituisce (set_indices, red_flag, orange_flag).
+    """
+    overlapped = set()
+    red_alert = False
+    orange_alert = False
+
+    sigs = [_overlap_signature(b) for b in bboxes]
+    n = len(bboxes)
+    for i in range(n):
+        if sigs[i] is None:
+            continue
+        c1 = bboxes[i]['coords']
+        for j in range(i + 1, n):
+            if sigs[j] is None:
+                continue
+            c2 = bboxes[j]['coords']
+
+            # Coordinate uguali (esatto)
+            if c1 == c2:
+                overlapped.add(i)
+                overlapped.add(j)
+                red_alert = True
+                continue
+
+            if geometriaBox.iou(c1, c2) >= iou_threshold:
+                overlapped.add(i)
+                overlapped.add(j)
+                orange_alert = True
+
+    return overlapped, red_alert, orange_alert
+
+
+class OverlapIndex(object):
+    """
+    Stessi risultati di compute_overlaps_pairwise senza confrontare tutte le coppie:
+      - duplicati esatti (rosso): box raggruppati per tupla di coordinate (dizionario)
+      - IoU >= soglia (arancio): solo coppie che condividono una cella della griglia.
+        Con soglia > 0 l'IoU è positivo solo se i due box si intersecano davvero e
+        hanno x2 > x1, y2 > y1 (con coordinate invertite l'intersezione è vuota),
+        quindi box invertiti/degeneri non entrano nella griglia.
+    update() confronta le firme dei box con la chiamata precedente e, se è cambiato
+    solo qualche box (es. drag), ricalcola le coppie di quei box soltanto.
+    """
+    def __init__(self):
+        self._sigs = None
+        self._threshold = None
+
+    def update(self, bboxes, iou_threshold=0.8):
+        """Restituisce (set_indices, red_flag, orange_flag) per la lista di box attuale."""
+        if iou_threshold <= 0:
+            # Ogni coppia supera la soglia: la griglia non aiuta
+            self._sigs = None
+            return compute_overlaps_pairwise(bboxes, iou_threshold)
+
+        sigs = [_overlap_signature(b) for b in bboxes]
+        if self._sigs is None or len(sigs) != len(self._sigs) or iou_threshold != self._threshold:
+            self._rebuild(sigs, iou_threshold)
+        else:
+            changed = [i for i, (old, new) in enumerate(zip(self._sigs, sigs)) if old != new]
+            if len(changed) > max(1, len(sigs) * OVERLAP_REBUILD_FRACTION):
+                self._rebuild(sigs, iou_threshold)
+            else:
+                for i in changed:
+                    self._remove(i)
+                    self._sigs[i] = sigs[i]
+                    self._insert(i)
+        return self.result()
+
+    def result(self):
+        overlapped = {i for i, adj in self._orange_adj.items() if adj}
+        for key in self._dup_keys:
+            overlapped.update(self._groups[key])
+        return overlapped, bool(self._dup_keys), self._orange_count > 0
+
+    # --- costruzione ---
+
+    def _rebuild(self, sigs, iou_threshold):
+        self._sigs = list(sigs)
+        self._threshold = iou_threshold
+        self._groups = {}         # tupla coordinate -> set indici
+        self._dup_keys = set()    # chiavi con almeno due box (duplicati esatti)
+        self._grid = {}           # (cx, cy) -> set indici
+        self._cells = {}          # indice -> celle occupate
+        self._large = set()       # box che coprirebbero troppe celle: confrontati con tutti
+        self._orange_adj = {}     # indice -> indici con IoU >= soglia
+        self._orange_count = 0
+
+        # Cella ~ lato mediano dei box validi: pochi box per cella, pochi box su più celle
+        sides = sorted(max(c[2] - c[0], c[3] - c[1]) for c in sigs if c is not None and self._in_grid(c))
+        self._cell = max(float(sides[len(sides) // 2]), 1.0) if sides else 1.0
+
+        for i in range(len(sigs)):
+            self._insert(i)
+
+    @staticmethod
+    def _in_grid(c):
+        return c[2] > c[0] and c[3] > c[1]
+
+    def _cells_for(self, c):
+        cell = self._cell
+        x0, x1 = int(math.floor(c[0] / cell)), int(math.floor(c[2] / cell))
+        y0, y1 = int(math.floor(c[1] / cell)), int(math.floor(c[3] / cell))
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > OVERLAP_MAX_CELLS:
+            return None
+        return [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+
+    def _insert(self, i):
+        c = self._sigs[i]
+        if c is None:
+            return
+
+        group = self._groups.setdefault(c, set())
+        group.add(i)
+        if len(group) > 1:
+            self._dup_keys.add(c)
+
+        if not self._in_grid(c):
+            return
+        cells = self._cells_for(c)
+        if cells is None:
+            # Box enorme: confronto con tutti i box in griglia
+            candidates = set(self._cells) | self._large
+            self._large.add(i)
+        else:
+            self._cells[i] = cells
+            candidates = set(self._large)
+            for key in cells:
+                bucket = self._grid.setdefault(key, set())
+                candidates.update(bucket)
+                bucket.add(i)
+
+        # I duplicati esatti contano come rosso, non arancio
+        candidates = [j for j in candidates if self._sigs[j] != c]
+        if len(candidates) >= OVERLAP_VECTOR_MIN:
+            ious = geometriaBox.iou_matrix([c], [self._sigs[j] for j in candidates])[0]
+            hits = [candidates[k] for k in np.flatnonzero(ious >= self._threshold)]
+        else:
+            hits = [j for j in candidates if geometriaBox.iou(c, self._sigs[j]) >= self._threshold]
+
+        for j in hits:
+            self._orange_adj.setdefault(i, set()).add(j)
+            self._orange_adj.setdefault(j, set()).add(i)
+            self._orange_count += 1
+
+    def _remove(self, i):
+        c = self._sigs[i]
+        if c is None:
+            return
+
+        group = self._groups[c]
+        group.discard(i)
+        if len(group) < 2:
+            self._dup_keys.discard(c)
+        if not group:
+            del self._groups[c]
+
+        self._large.discard(i)
+        for key in self._cells.pop(i, ()):
+            bucket = self._grid[key]
+            bucket.discard(i)
+            if not bucket:
+                del self._grid[key]
+
+        for j in self._orange_adj.pop(i, ()):
+            self._orange_adj[j].discard(i)
+            self._orange_count -= 1
+
+# ====================================================================
+# INDICE PERSISTENTE DELLE ANNOTAZIONI (SQLite)
+# ====================================================================
+
+def _summarize_sidecar(data):
+    """Estrae da un JSON di annotazione i campi indicizzati: (classi minuscole, n. box, save_count)."""
+    classes = set()
+    box_count = 0
+    for box in data.get("boxes", []):
+        c = box.get("class", "")
+        if c:
+            classes.add(str(c).lower())
+        if isinstance(box.get("coords"), list) and len(box["coords"]) == 4:
+            box_count += 1
+    return classes, box_count, data.get("save_count", 0)
+
+
+class AnnotationIndex(object):
+    """
+    Indice su disco (SQLite, un file nella cartella immagini) dei JSON di annotazione.
+    Per ogni immagine con JSON memorizza mtime/size del file, save_count, numero di
+    box e classi presenti. refresh() confronta solo gli stat della cartella e rilegge
+    i JSON cambiati; update() aggiorna una riga subito dopo un salvataggio.
+    Un'immagine senza riga = nessun JSON (vergine).
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        path = os.path.join(folder, ANNOTATION_INDEX_FILENAME)
+        try:
+            self.db = self._open(path)
+        except sqlite3.Error as e:
+            # Cartella in sola lettura o file rovinato: indice solo in memoria (vale per la sessione)
+            print(f"Indice annotazioni non utilizzabile ({path}): {e}. Uso un indice in memoria.")
+            self.db = self._open(":memory:")
+        self.last_refresh_parsed = 0
+
+    @staticmethod
+    def _open(path):
+        db = sqlite3.connect(path)
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version != ANNOTATION_INDEX_VERSION:
+            db.executescript("""
+                DROP TABLE IF EXISTS sidecar;
+                DROP TABLE IF EXISTS box_class;
+                CREATE TABLE sidecar (
+                    image TEXT PRIMARY KEY,
+                    json_mtime_ns INTEGER NOT NULL,
+                    json_size INTEGER NOT NULL,
+                    save_count INTEGER NOT NULL,
+                    box_count INTEGER NOT NULL
+                );
+                CREATE TABLE box_class (
+                    image TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    PRIMARY KEY (image, class)
+                );
+                CREATE INDEX box_class_by_class ON box_class(class);
+            """)
+            db.execute(f"PRAGMA user_version = {ANNOTATION_INDEX_VERSION}")
+            db.commit()
+        return db
+
+    def close(self):
+        try:
+            self.db.close()
+        except sqlite3.Error:
+            pass
+
+    def _json_name(self, image_name):
+        return os.path.splitext(image_name)[0] + ".json"
+
+    def _write_row(self, image_name, st, classes, box_count, save_count):
+        self.db.execute("INSERT OR REPLACE INTO sidecar VALUES (?, ?, ?, ?, ?)",
+                        (image_name, st.st_mtime_ns, st.st_size, save_count, box_count))
+        self.db.execute("DELETE FROM box_class WHERE image = ?", (image_name,))
+        self.db.executemany("INSERT INTO box_class VALUES (?, ?)",
+                            [(image_name, c) for c in classes])
+
+    def _delete_rows(self, image_names):
+        rows = [(n,) for n in image_names]
+        self.db.executemany("DELETE FROM sidecar WHERE image = ?", rows)
+        self.db.executemany("DELETE FROM box_class WHERE image = ?", rows)
+
+    def refresh(self, image_names):
+        """Allinea l'indice ai JSON presenti su disco per le immagini indicate (solo quelli cambiati vengono riletti)."""
+        json_stats = {}
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.name.lower().endswith(".json") and entry.is_file():
+                    json_stats[entry.name] = entry.stat()
+
+        known = {row[0]: (row[1], row[2]) for row in
+                 self.db.execute("SELECT image, json_mtime_ns, json_size FROM sidecar")}
+
+        wanted = set(image_names)
+        stale = [n for n in known if n not in wanted]
+        parsed = 0
+        for image_name in image_names:
+            st = json_stats.get(self._json_name(image_name))
+            if st is None:
+                if image_name in known:
+                    stale.append(image_name)
+                continue
+            if known.get(image_name) == (st.st_mtime_ns, st.st_size):
+                continue
+            try:
+                with open(os.path.join(self.folder, self._json_name(image_name)), "r", encoding="utf-8") as f:
+                    summary = _summarize_sidecar(json.load(f))
+            except Exception:
+                # JSON illeggibile: nessuna classe e da rifare (save_count 0), come prima
+                summary = (set(), 0, 0)
+            self._write_row(image_name, st, *summary)
+            parsed += 1
+
+        self._delete_rows(stale)
+        self.db.commit()
+        self.last_refresh_parsed = parsed
+        return parsed
+
+    def update(self, image_name, data):
+        """Aggiorna la riga di un'immagine appena salvata (stat preso dopo la scrittura).
+           Restituisce (classi, n. box, save_count) del JSON scritto."""
+        summary = _summarize_sidecar(data)
+        try:
+            st = os.stat(os.path.join(self.folder, self._json_name(image_name)))
+        except OSError:
+            return summary
+        self._write_row(image_name, st, *summary)
+        self.db.commit()
+        return summary
+
+    def remove(self, image_name):
+        self._delete_rows([image_name])
+        self.db.commit()
+
+    def all_classes(self):
+        """Dizionario immagine -> set di classi, per le immagini che hanno un JSON."""
+        result = {}
+        for image_name, cls in self.db.execute("SELECT image, class FROM box_class"):
+            result.setdefault(image_name, set()).add(cls)
+        return result
+
+    def classes_for(self, image_name):
+        return {row[0] for row in self.db.execute("SELECT class FROM box_class WHERE image = ?", (image_name,))}
+
+    def images_with_class(self, target_class):
+        return {row[0] for row in self.db.execute("SELECT image FROM box_class WHERE class = ?",
+                                                   (target_class.lower(),))}
+
+    def save_counts(self):
+        """Dizionario immagine -> save_count, per le immagini che hanno un JSON."""
+        return dict(self.db.execute("SELECT image, save_count FROM sidecar"))
+
+    def save_count(self, image_name):
+        row = self.db.execute("SELECT save_count FROM sidecar WHERE image = ?", (image_name,)).fetchone()
+        return row[0] if row else 0
+
 # ====================================================================
 
 class BoundingBoxEditor:
@@ -340,61 +1238,157 @@ class BoundingBoxEditor:
     # ----------------------------------------------------------------------
     
         
-    def _get_history(self):
+    def _get_history(self, img_id=None):
         # Sostituisci self.current_image_path con self.filename
-        img_id = self.filename  
+        if img_id is None:
+            img_id = self.filename
 
         if img_id not in self.history:
             self.history[img_id] = {
                 "undo": [],
-                "redo": []
+                "redo": [],
+                "tip": None,    # stato congelato dei box dopo l'ultima voce registrata
+                "bytes": 0,
             }
+        else:
+            self.history.move_to_end(img_id)  # LRU: immagine usata di recente
 
         return self.history[img_id]
 
     def _push_undo_state(self, action="Modifica"):
-        
+        """
+        Apre una voce di storia. Lo stato "dopo" non è ancora noto: la patch viene
+        calcolata in _finalize_undo_entry (alla prossima azione, a undo/redo o al
+        cambio immagine); se nel frattempo non è cambiato nulla la voce sparisce.
+        """
+        self._finalize_undo_entry()
 
         hist = self._get_history()
+        if hist["tip"] is None:
+            hist["tip"] = tuple(_freeze(b) for b in self.bboxes)
 
-        state = {
-            "bboxes": copy.deepcopy(self.bboxes),
-            "ocr": copy.deepcopy(getattr(self, "loaded_ocr_boxes", [])),
-            "current_box": self.current_box,
-            "action": action
-        }
-
-        hist["undo"].append(state)
-        hist["redo"].clear()
-
-        if len(hist["undo"]) > self.max_undo:
-            hist["undo"].pop(0)
+        self._undo_pending = (self.filename, {
+            "action": action,
+            "ocr_before": _freeze(getattr(self, "loaded_ocr_boxes", [])),
+            "current_before": self.current_box,
+            "t": time.monotonic(),
+        })
         
         if not self.is_loading_image:
             self.is_dirty = True
 
-
-        
-    def undo_last_action(self, event=None):
-        hist = self._get_history()
-
-        if not hist["undo"]:
-            self.status_label.config(text="Nessuna operazione da annullare", fg="orange")
+    def _finalize_undo_entry(self):
+        """Chiude la voce aperta: patch tra l'ultimo stato registrato e quello attuale."""
+        pending = getattr(self, "_undo_pending", None)
+        if pending is None:
             return
-
-        
-        current_state = {
-            "bboxes": copy.deepcopy(self.bboxes),
-            "ocr": copy.deepcopy(getattr(self, "loaded_ocr_boxes", [])),
-            "current_box": self.current_box
+        self._undo_pending = None
+        img_id, entry = pending
+        if img_id != getattr(self, "filename", None):
+            return
+        hist = self._get_history(img_id)
+
+        after = tuple(_freeze(b) for b in self.bboxes)
+        patch = _diff_boxes(hist["tip"], after)
+        ocr_after = _freeze(getattr(self, "loaded_ocr_boxes", []))
+        ocr = (entry["ocr_before"], ocr_after) if ocr_after != entry["ocr_before"] else None
+        if patch is None and ocr is None:
+            return  # es. click di selezione senza spostamento
+
+        entry = {
+            "action": entry["action"],
+            "patch": patch,
+            "ocr": ocr,
+            "current_before": entry["current_before"],
+            "current_after": self.current_box,
+            "t": entry["t"],
         }
+        if not self._coalesce_undo_entry(hist, entry):
+            hist["undo"].append(entry)
+            if len(hist["undo"]) > self.max_undo:
+                hist["undo"].pop(0)
+        hist["redo"].clear()
+        hist["tip"] = after
+        self._account_history(img_id)
 
-        hist["redo"].append(current_state)
-        state = hist["undo"].pop()
+    def _rebase_history(self):
+        """
+        Immagine ricaricata da disco con una storia già presente (es. modifiche non salvate
+        in una visita precedente): le patch sono relative all'ultimo stato registrato, quindi
+        la differenza diventa una voce a sé e lo stato di riferimento torna allineato.
+        """
+        hist = self.history.get(self.filename)
+        if hist is None or hist["tip"] is None:
+            return
+        loaded = tuple(_freeze(b) for b in self.bboxes)
+        patch = _diff_boxes(hist["tip"], loaded)
+        if patch is None:
+            return
+        hist["undo"].append({
+            "action": "Ricaricamento da disco",
+            "patch": patch,
+            "ocr": None,
+            "current_before": -1,
+            "current_after": -1,
+            "t": time.monotonic(),
+        })
+        if len(hist["undo"]) > self.max_undo:
+            hist["undo"].pop(0)
+        hist["redo"].clear()
+        hist["tip"] = loaded
+        self._account_history(self.filename)
 
-        self.bboxes = state["bboxes"]
-        self.loaded_ocr_boxes = state["ocr"]
-        self.current_box = state["current_box"]
+    def _coalesce_undo_entry(self, hist, entry):
+        """Fonde spostamenti/resize ravvicinati dello stesso box nella voce precedente."""
+        if not hist["undo"] or entry["action"] not in UNDO_COALESCE_ACTIONS:
+            return False
+        prev = hist["undo"][-1]
+        if prev["action"] != entry["action"] or prev["ocr"] is not None or entry["ocr"] is not None:
+            return False
+        if prev["patch"] is None or entry["patch"] is None:
+            return False
+        p_start, p_old, p_new = prev["patch"]
+        e_start, e_old, e_new = entry["patch"]
+        if not (p_start == e_start and len(p_old) == len(p_new) == len(e_old) == len(e_new) == 1):
+            return False
+        if entry["t"] - prev["t"] > UNDO_COALESCE_S:
+            return False
+        prev["patch"] = (p_start, p_old, e_new)
+        prev["current_after"] = entry["current_after"]
+        prev["t"] = entry["t"]
+        return True
+
+    def _entry_size(self, entry):
+        size = 200
+        if entry["patch"] is not None:
+            size += _estimate_size(entry["patch"][1]) + _estimate_size(entry["patch"][2])
+        if entry["ocr"] is not None:
+            size += _estimate_size(entry["ocr"][0]) + _estimate_size(entry["ocr"][1])
+        return size
+
+    def _account_history(self, img_id):
+        """Aggiorna la stima di memoria dell'immagine e scarta le storie meno recenti oltre il budget."""
+        hist = self.history[img_id]
+        hist["bytes"] = (_estimate_size(hist["tip"]) +
+                         sum(self._entry_size(e) for e in hist["undo"]) +
+                         sum(self._entry_size(e) for e in hist["redo"]))
+        total = sum(h["bytes"] for h in self.history.values())
+        while total > UNDO_MEMORY_BUDGET and len(self.history) > 1:
+            cold_id = next(iter(self.history))
+            if cold_id == img_id:
+                break
+            total -= self.history.pop(cold_id)["bytes"]
+
+    def _apply_history_entry(self, hist, entry, reverse):
+        """Applica (o annulla) una voce allo stato corrente e aggiorna l'interfaccia."""
+        if entry["patch"] is not None:
+            hist["tip"] = _apply_patch(hist["tip"], entry["patch"], reverse=reverse)
+            self.bboxes = [_thaw(b) for b in hist["tip"]]
+        if entry["ocr"] is not None:
+            self.loaded_ocr_boxes = _thaw(entry["ocr"][0] if reverse else entry["ocr"][1])
+        self.current_box = entry["current_before"] if reverse else entry["current_after"]
+        if self.current_box >= len(self.bboxes):
+            self.current_box = -1
 
         self._draw_bboxes()
         self._update_current_box_info()
@@ -406,49 +1400,37 @@ class BoundingBoxEditor:
         # ✅ AGGIUNGI QUESTA RIGA
         self.is_dirty = True
 
-        action = state.get("action", "Modifica")
+    def undo_last_action(self, event=None):
+        self._finalize_undo_entry()
+        hist = self._get_history()
+
+        if not hist["undo"]:
+            self.status_label.config(text="Nessuna operazione da annullare", fg="orange")
+            return
+
+        entry = hist["undo"].pop()
+        hist["redo"].append(entry)
+        self._apply_history_entry(hist, entry, reverse=True)
+
         self.status_label.config(
-            text=f"Undo: {action}",
+            text=f"Undo: {entry['action']}",
             fg="yellow"
         )
 
-
-
     def redo_last_action(self, event=None):
+        self._finalize_undo_entry()
         hist = self._get_history()
 
         if not hist["redo"]:
             self.status_label.config(text="Nessuna operazione da ripristinare", fg="orange")
             return
 
-        
-        current_state = {
-            "bboxes": copy.deepcopy(self.bboxes),
-            "ocr": copy.deepcopy(getattr(self, "loaded_ocr_boxes", [])),
-            "current_box": self.current_box
-        }
-
-        hist["undo"].append(current_state)
-        state = hist["redo"].pop()
-
-        self.bboxes = state["bboxes"]
-        self.loaded_ocr_boxes = state["ocr"]
-        self.current_box = state["current_box"]
-
-        self._draw_bboxes()
-        self._update_current_box_info()
-        self._update_plate_entry_from_selection()
-        
-              
-        # ✅ AGGIUNGI QUESTA RIGA
-        self._update_filename_color()
-        
-        # ✅ AGGIUNGI QUESTA RIGA
-        self.is_dirty = True
+        entry = hist["redo"].pop()
+        hist["undo"].append(entry)
+        self._apply_history_entry(hist, entry, reverse=False)
 
-        action = state.get("action", "Modifica")
         self.status_label.config(
-            text=f"Redo: {action}",
+            text=f"Redo: {entry['action']}",
             fg="lightgreen"
         )
         
@@ -626,11 +1608,8 @@ class BoundingBoxEditor:
             # Filtro Attivo
             # NUOVO CODICE VELOCE
             if not self.cache_valid: self._rebuild_metadata_cache()
-            target = self.root._class_filter.lower()
-            self.images = [
-                img for img in self._all_images
-                if target in self.metadata_cache.get(img, set())
-            ]
+            matches = self._get_annotation_index().images_with_class(self.root._class_filter)
+            self.images = [img for img in self._all_images if img in matches]
             msg_text = f"Filtro: {new_filter} (Trovate: {len(self.images)})"
             msg_color = 'cyan'
         else:
@@ -997,18 +1976,40 @@ class BoundingBoxEditor:
         
     
 
+    def _remember_save_count(self, image_filename, save_count):
+        """Memorizza save_count dell'immagine insieme all'mtime del suo JSON (None se assente)."""
+        try:
+            mtime_ns = os.stat(self._json_path(image_filename)).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        self._save_count_state = (image_filename, mtime_ns, save_count)
+
     def _get_current_save_count(self):
         """Restituisce il conteggio dei salvataggi (0 se il JSON non esiste o la chiave manca)."""
         # USA self.filename CHE DEVE ESSERE SETTATO CORRETTAMENTE PRIMA DI CHIAMARE
         json_path = self._json_path(self.filename) 
-        if not os.path.exists(json_path):
+        # Salvataggio ancora in coda: vale quello, non il file su disco
+        pending = self.json_writer.pending_data(json_path)
+        if pending is not None:
+            return pending.get("save_count", 0)
+        try:
+            mtime_ns = os.stat(json_path).st_mtime_ns
+        except OSError:
             return 0
+
+        # Valore già noto (caricamento o ultimo salvataggio) e file non toccato da fuori: niente parse
+        state = getattr(self, '_save_count_state', None)
+        if state is not None and state[0] == self.filename and state[1] == mtime_ns:
+            return state[2]
+
         try:
             with open(json_path, "r", encoding="utf-8") as f:
                 data = json.load(f)
-                return data.get("save_count", 0) # Ritorna 0 se la chiave non esiste
+                save_count = data.get("save_count", 0) # 0 se la chiave non esiste
         except Exception:
-            return 0 # In caso di errore di lettura/JSON malformato
+            save_count = 0 # In caso di errore di lettura/JSON malformato
+        self._save_count_state = (self.filename, mtime_ns, save_count)
+        return save_count
 
     
     def _load_boxes_from_json(self, image_filename):
@@ -1025,7 +2026,11 @@ class BoundingBoxEditor:
         if hasattr(self, 'validate_plate_var') and self.validate_plate_var:
              self.validate_plate_var.set(False)
 
-        if not os.path.exists(json_path):
+        # Se il salvataggio di questa immagine è ancora in coda, il dato buono è quello
+        data = self.json_writer.pending_data(json_path)
+
+        if data is None and not os.path.exists(json_path):
+            self._save_count_state = (image_filename, None, 0)
             # Nulla da caricare, disabilita entry
             if hasattr(self, 'plate_entry'):
                 self.plate_entry.config(state='disabled')
@@ -1034,11 +2039,13 @@ class BoundingBoxEditor:
             return boxes
 
         try:
-            with open(json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            if data is None:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
         except json.JSONDecodeError as e:
             # ERRORE CRITICO: Il file esiste ma è rotto. Avvisiamo l'utente!
             print(f"CORRUZIONE JSON {json_path}: {e}")
+            self._remember_save_count(image_filename, 0)
             messagebox.showerror(
                 "Errore Dati", 
                 f"Il file di annotazione per questa immagine è corrotto!\n\nFile: {os.path.basename(json_path)}\nErrore: {e}\n\nVerranno mostrati 0 box, ma FAI ATTENZIONE a non sovrascrivere se volevi recuperare i dati."
@@ -1049,6 +2056,9 @@ class BoundingBoxEditor:
             print(f"Errore lettura JSON {json_path}: {e}")
             return boxes
 
+        # save_count resta in memoria: _get_current_save_count non rilegge il file finché l'mtime non cambia
+        self._remember_save_count(image_filename, data.get("save_count", 0))
+
         # Legge tutte le entry boxes
         for box in data.get("boxes", []):
             cls = str(box.get("class", "") or "")
@@ -1157,28 +2167,19 @@ class BoundingBoxEditor:
             current_save_count = 0
         data["save_count"] = current_save_count + 1
 
-        # 6. Scrivi su file in modo ATOMICO (Safe Save)
-        # Scriviamo prima su un file temporaneo per evitare corruzione in caso di crash
-        temp_path = json_path + ".tmp"
-        try:
-            with open(temp_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4)
-                f.flush() # Forza la scrittura su disco
-                os.fsync(f.fileno()) # Assicurati che il sistema operativo scriva fisicamente
-            
-            # Se siamo arrivati qui, il file temp è sano. Sostituiamo l'originale.
-            os.replace(temp_path, json_path)
-            
-            self.cache_valid = False 
-            return True
-        except Exception as e:
-            # Se qualcosa va storto, il file originale è salvo. Cancelliamo il temp se esiste.
-            if os.path.exists(temp_path):
-                try: os.remove(temp_path)
-                except: pass
-            
-            messagebox.showerror("Errore di Salvataggio", f"Impossibile salvare il JSON {json_path}: {e}")
-            return False
+        # 6. Accoda la scrittura ATOMICA (temp + fsync + replace) al thread di scrittura:
+        # la navigazione non aspetta il disco. Gli errori arrivano in _poll_json_writer.
+        self.json_writer.submit(json_path, data, tag=(self.folder, self.filename))
+
+        # Write-through: sappiamo già quale immagine è cambiata e con quali classi
+        # (l'indice su disco si aggiorna a scrittura completata, con lo stat definitivo)
+        self.metadata_cache[self.filename] = _summarize_sidecar(data)[0]
+        self._discard_virgin(self.filename)  # dopo un salvataggio save_count >= 1
+        if CACHE_CHECK:
+            self.json_writer.flush()
+            self._poll_json_writer(reschedule=False)
+            self._check_metadata_cache()
+        return True
 
 
     # ----------------------------------------------------------------------
@@ -1200,7 +2201,9 @@ class BoundingBoxEditor:
 
         # --- SMART ---
         if self.save_mode == SAVE_MODE_SMART:
-            if not self.is_dirty:
+            # Stato già in coda di scrittura: l'esito arriva in _poll_json_writer
+            # (in caso di errore l'immagine viene segnata di nuovo da salvare)
+            if not self.is_dirty or self._save_in_flight():
                 return True
             # se dirty → comportamento SAFE
 
@@ -1228,24 +2231,48 @@ class BoundingBoxEditor:
             self.canvas.focus_set()
             # NON return → il salvataggio DEVE avvenire
         if self._save_boxes_to_json():
-            # Mostra il nuovo save count nello status bar
-            save_count = self._get_current_save_count()
-            self.status_label.config(
-                text=f"Annotazioni salvate (Salvataggio n.{save_count}) per {self.filename}",
-                fg='green'
-            )
-            
-            # ✅ QUESTA RIGA È FONDAMENTALE
-            self._saved_snapshot = self._make_snapshot()
-            
-            self._update_filename_color()  # Aggiorna il colore del nome file a verde
+            # Scrittura accodata: l'immagine resta "modificata" finché _poll_json_writer
+            # non conferma che il JSON è su disco (vedi _confirm_pending_save)
+            self._pending_save = (self._json_path(self.filename), self._make_snapshot())
+            self.status_label.config(text=f"Salvataggio in corso per {self.filename}...", fg='yellow')
             self._update_current_box_info()  # Aggiorna le info del box
-            # --- RESET DIRTY DOPO SALVATAGGIO ---
-            self.is_dirty = False
-            return True  # Salvataggio riuscito
+            return True  # Salvataggio accodato
         else:
             return False  # Errore nel salvataggio
 
+    def _save_in_flight(self):
+        """True se lo stato attuale dell'immagine è già in coda di scrittura (accodato, non ancora confermato)."""
+        return self._pending_save is not None and self._pending_save[1] == self._make_snapshot()
+
+    def _confirm_pending_save(self, json_path, data, error):
+        """Esito (dal thread di scrittura) di un salvataggio: aggiorna dirty, snapshot e status bar."""
+        if error is not None:
+            self._failed_saves.add(json_path)
+        elif self.json_writer.pending_data(json_path) is None:
+            self._failed_saves.discard(json_path)
+
+        pending = self._pending_save
+        if pending is None or pending[0] != json_path:
+            return
+        if error is not None:
+            # Scrittura fallita: l'immagine torna da salvare
+            self._pending_save = None
+            self.is_dirty = True
+            self._update_filename_color()
+            return
+        if self.json_writer.pending_data(json_path) is not None:
+            return  # è già in coda un salvataggio più recente: si aspetta quello
+
+        self._pending_save = None
+        self._saved_snapshot = pending[1]
+        # Modifiche fatte mentre il salvataggio era in corso: l'immagine resta da salvare
+        self.is_dirty = self._make_snapshot() != pending[1]
+        self.status_label.config(
+            text=f"Annotazioni salvate (Salvataggio n.{data.get('save_count', 0)}) per {self.filename}",
+            fg='green'
+        )
+        self._update_filename_color()  # Aggiorna il colore del nome file a verde
+
 
     def _get_display_filename(self, filename, max_len=35):
         """Tronca il nome file se troppo lungo per la visualizzazione, mantenendo l'estensione."""
@@ -1310,6 +2337,7 @@ class BoundingBoxEditor:
             "• Ctrl+z/Z: UNDO fino a 50 livelli\n"
             "• Ctrl+y/Y: REDO (ripristino dopo Ctrl+z/Z)\n"
             "• Spazio: Passa al prossimo box della classe filtrata\n"
+            "• V: Salta alla prossima immagine vergine (mai salvata)\n"
             "• H: Mostra questa guida\n"
             "• K: Info, Autore e Changelog\n\n"
             
@@ -1441,6 +2469,17 @@ class BoundingBoxEditor:
         self.root = root
         self.folder = folder
         self.clipboard_box = None  # Memoria per il "Copia"
+
+        # Scrittore JSON in background: prima di leggere qualsiasi annotazione
+        # completa le scritture rimaste nel journal da una sessione interrotta
+        self.json_writer = AsyncJsonWriter(_default_journal_root())
+        replayed = self.json_writer.replay_journal()
+        if replayed:
+            self.json_writer.flush()
+            print(f"Journal: {replayed} salvataggi in sospeso rieseguiti.")
+            for _, json_path, _, error in self.json_writer.pop_results():
+                if error is not None:
+                    print(f"Journal: impossibile scrivere {json_path}: {error}")
         # ======================================================
         # FILTRO DI CLASSE – STATO PERSISTENTE
         # ======================================================
@@ -1464,6 +2503,10 @@ class BoundingBoxEditor:
         
         # Snapshot dell'ultimo stato salvato / caricato
         self._saved_snapshot = None
+        # Salvataggio accodato e non ancora confermato: (json_path, snapshot)
+        self._pending_save = None
+        # JSON la cui ultima scrittura è fallita (l'immagine va risalvata)
+        self._failed_saves = set()
 
         
         self.is_loading_image = False
@@ -1499,6 +2542,13 @@ class BoundingBoxEditor:
         # (necessario perché image_has_class_fast può essere chiamata subito dopo)
         self.metadata_cache = {}
         self.cache_valid = False
+        self.annotation_index = None  # AnnotationIndex della cartella, aperto al primo uso
+        # Nomi delle immagini "vergini" (senza JSON o save_count 0), ordinati come _all_images:
+        # self.images ne è una sottosequenza ordinata, quindi le ricerche sono bisect.
+        self._virgin_names = []
+        # Vergini presenti in self.images (filtro attivo), con le liste da cui sono state ricavate
+        self._visible_virgins = []
+        self._visible_virgins_src = None
 
         # ======================================================
         # APPLICAZIONE FILTRO DI CLASSE (PERSISTENTE)
@@ -1519,6 +2569,8 @@ class BoundingBoxEditor:
         
         self.bboxes = []
         self.current_box = -1
+        self._box_items = {}  # indice box -> item canvas persistenti (vedi _sync_box_items)
+        self.overlap_index = OverlapIndex()
         
         # Variabili di interazione
         self.dragging = False
@@ -1538,14 +2590,21 @@ class BoundingBoxEditor:
         self.pan_x = 0
         self.pan_y = 0
         self.original_img = None
-        
+        self.image_pyramid = None
+        self._refine_after_id = None  # after() del raffinamento LANCZOS in sospeso
+
+        # Prefetch: decodifica in background delle immagini vicine (+1 avanti, -1 indietro)
+        self.prefetcher = ImagePrefetcher()
+        self._nav_direction = 1
+
         # ======================================================
         # UNDO / REDO STACK
         # ======================================================
         #self.undo_stack = []
         #self.redo_stack = []
-        self.history = {}
+        self.history = OrderedDict()  # filename -> storia a patch (LRU, vedi UNDO_MEMORY_BUDGET)
         self.max_undo = 50  # limite sicurezza
+        self._undo_pending = None
 
         
         # Classi disponibili
@@ -1600,6 +2659,8 @@ class BoundingBoxEditor:
     
         self.load_image()
         self.root.after(100, self.canvas.focus_set)
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.root.after(JSON_WRITER_POLL_MS, self._poll_json_writer)
         
         messagebox.showinfo(
             "Istruzioni Focus",
@@ -1641,7 +2702,17 @@ class BoundingBoxEditor:
         self.current_box_info_label = tk.Label(status_frame, text="", anchor=tk.E, bg=self.BG_DARK, 
                                                fg='#3498DB', font=('Arial', 12, 'bold'), padx=5)
         self.current_box_info_label.pack(side=tk.RIGHT)
-        
+
+        # Label per i contatori del prefetch (hit/miss e tempi di decodifica)
+        self.prefetch_info_label = tk.Label(status_frame, text="", anchor=tk.E, bg=self.BG_DARK,
+                                            fg='#95A5A6', font=('Arial', 8), padx=5)
+        self.prefetch_info_label.pack(side=tk.RIGHT)
+
+        # Label per la coda dei salvataggi (backlog e latenza dell'ultima scrittura)
+        self.save_info_label = tk.Label(status_frame, text="", anchor=tk.E, bg=self.BG_DARK,
+                                        fg='#95A5A6', font=('Arial', 8), padx=5)
+        self.save_info_label.pack(side=tk.RIGHT)
+
         # 2. --- Controlli Immagine (Navigazione) ---
         img_controls = tk.LabelFrame(control_frame, text="Navigazione Immagini", padx=5, pady=5, bg=self.BG_LIGHT, fg=self.FG_WHITE, font=('Arial', 10, 'bold'))
         img_controls.pack(fill=tk.X, pady=5, padx=5)
@@ -2071,24 +3142,7 @@ class BoundingBoxEditor:
 
     def _calculate_iou(self, boxA_coords, boxB_coords):
         """Calcola l'Intersection over Union (IoU) tra due bounding box."""
-        xA = max(boxA_coords[0], boxB_coords[0])
-        yA = max(boxA_coords[1], boxB_coords[1])
-        xB = min(boxA_coords[2], boxB_coords[2])
-        yB = min(boxA_coords[3], boxB_coords[3])
-
-        inter_width = max(0, xB - xA)
-        inter_height = max(0, yB - yA)
-        inter_Area = inter_width * inter_height
-
-        boxA_Area = (boxA_coords[2] - boxA_coords[0]) * (boxA_coords[3] - boxA_coords[1])
-        boxB_Area = (boxB_coords[2] - boxB_coords[0]) * (boxB_coords[3] - boxB_coords[1])
-
-        union_Area = float(boxA_Area + boxB_Area - inter_Area)
-
-        if union_Area <= 0:
-            return 0.0
-
-        return inter_Area / union_Area
+        return geometriaBox.iou(boxA_coords, boxB_coords)
 
     def _update_current_box_info(self):
         """
@@ -2112,48 +3166,11 @@ class BoundingBoxEditor:
 
     def _compute_overlaps(self, iou_threshold=0.8):
         """
-        Calcola gli indici dei box che partecipano a sovrapposizioni tra classi diverse.
+        Calcola gli indici dei box che partecipano a sovrapposizioni (duplicati esatti o IoU >= soglia).
         Restituisce (set_indices, red_flag, orange_flag).
+        L'indice spaziale ricalcola solo i box cambiati dall'ultima chiamata.
         """
-        overlapped = set()
-        red_alert = False
-        orange_alert = False
-
-        IGNORED_CLASSES = ['ocr']
-
-        n = len(self.bboxes)
-        for i in range(n):
-            bi = self.bboxes[i]
-            if 'coords' not in bi or not isinstance(bi['coords'], list) or len(bi['coords']) != 4:
-                continue
-            ci = bi.get('class', '').lower()
-            if ci in IGNORED_CLASSES:
-                continue
-            for j in range(i + 1, n):
-                bj = self.bboxes[j]
-                if 'coords' not in bj or not isinstance(bj['coords'], list) or len(bj['coords']) != 4:
-                    continue
-                cj = bj.get('class', '').lower()
-                if cj in IGNORED_CLASSES:
-                    continue
-
-                c1 = bi['coords']
-                c2 = bj['coords']
-
-                # Coordinate uguali (esatto)
-                if c1 == c2:
-                    overlapped.add(i)
-                    overlapped.add(j)
-                    red_alert = True
-                    continue
-
-                iou = self._calculate_iou(c1, c2)
-                if iou >= iou_threshold:
-                    overlapped.add(i)
-                    overlapped.add(j)
-                    orange_alert = True
-
-        return overlapped, red_alert, orange_alert
+        return self.overlap_index.update(self.bboxes, iou_threshold)
 
 
     def _update_box_stats(self):
@@ -2222,7 +3239,10 @@ class BoundingBoxEditor:
 
         save_count = self._get_current_save_count()
         
-        if save_count == 0:
+        if self._json_path(self.filename) in getattr(self, '_failed_saves', ()):
+            # ROSSO: l'ultimo salvataggio non è arrivato su disco
+            self.image_label.config(fg='red')
+        elif save_count == 0:
             # GIALLO: Vergine (mai salvato)
             self.image_label.config(fg='gold') 
         else:
@@ -2334,31 +3354,108 @@ class BoundingBoxEditor:
         self._update_current_box_info()
         
     # --- GESTIONE CACHE E FILTRI (INCOLLA QUESTO BLOCCO) ---
+    def _get_annotation_index(self):
+        """Indice SQLite della cartella corrente (aperto/creato al primo uso)."""
+        if self.annotation_index is None or self.annotation_index.folder != self.folder:
+            if self.annotation_index is not None:
+                self.annotation_index.close()
+            self.annotation_index = AnnotationIndex(self.folder)
+        return self.annotation_index
+
     def _rebuild_metadata_cache(self):
-        """Legge tutti i JSON una volta sola per velocizzare i filtri."""
+        """Allinea l'indice su disco (rilegge solo i JSON cambiati) e ne carica le classi in memoria."""
         # Se non ci sono immagini, esci
         if not hasattr(self, '_all_images') or not self._all_images: return
 
-        self.metadata_cache = {}
-        # Scorre tutti i file immagine trovati
+        index = self._get_annotation_index()
+        parsed = index.refresh(self._all_images)
+        classes = index.all_classes()
+        self.metadata_cache = {img_name: classes.get(img_name, set()) for img_name in self._all_images}
+        save_counts = index.save_counts()
+        self._virgin_names = [img_name for img_name in self._all_images if save_counts.get(img_name, 0) == 0]
+
+        self.cache_valid = True
+        print(f"Cache rigenerata: {len(self.metadata_cache)} file indicizzati ({parsed} JSON riletti).")
+
+    def _poll_json_writer(self, reschedule=True):
+        """Ritira gli esiti delle scritture in background (thread Tk) e aggiorna la status bar."""
+        for tag, json_path, data, error in self.json_writer.pop_results():
+            if tag is not None and tag[0] == self.folder:
+                self._confirm_pending_save(json_path, data, error)
+            if error is not None:
+                self.status_label.config(text=f"ERRORE salvataggio {os.path.basename(json_path)}", fg='red')
+                messagebox.showerror("Errore di Salvataggio",
+                                     f"Impossibile salvare il JSON {json_path}: {error}\n\n"
+                                     f"L'immagine resta da salvare (nome in rosso); il salvataggio resta "
+                                     f"anche nel journal e verrà ritentato al prossimo avvio.")
+                continue
+            if tag is None:
+                continue
+            folder, image_name = tag
+            if folder == self.folder:
+                # Stat definitivo: il prossimo refresh dell'indice non rilegge questo JSON
+                self._get_annotation_index().update(image_name, data)
+                if image_name == getattr(self, 'filename', None) and \
+                        self.json_writer.pending_data(json_path) is None:
+                    self._remember_save_count(image_name, data.get("save_count", 0))
+
+        self.save_info_label.config(text=self.json_writer.stats_text())
+        if reschedule:
+            self.root.after(JSON_WRITER_POLL_MS, self._poll_json_writer)
+
+    def _on_close(self):
+        """Chiusura finestra: attende che i salvataggi in coda siano scritti."""
+        if self.json_writer.backlog():
+            self.status_label.config(text="Attendo il completamento dei salvataggi...", fg='yellow')
+            self.root.config(cursor="watch")
+            self.root.update_idletasks()
+        self.json_writer.close()
+        self._poll_json_writer(reschedule=False)
+        self.root.destroy()
+
+    def _check_metadata_cache(self):
+        """DEBUG (ANNOTA_CACHE_CHECK=1): confronta la cache in memoria con i JSON su disco e stampa le differenze."""
+        if not self.cache_valid:
+            return True
+        mismatches = []
         for img_name in self._all_images:
             json_path = self._json_path(img_name)
-            classes_found = set()
-            
+            on_disk = set()
             if os.path.exists(json_path):
                 try:
                     with open(json_path, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        for box in data.get("boxes", []):
-                            c = box.get("class", "")
-                            if c: classes_found.add(str(c).lower())
+                        on_disk = _summarize_sidecar(json.load(f))[0]
                 except Exception:
-                    pass 
-            
-            self.metadata_cache[img_name] = classes_found
-        
-        self.cache_valid = True
-        print(f"Cache rigenerata: {len(self.metadata_cache)} file indicizzati.")
+                    pass
+            cached = self.metadata_cache.get(img_name, set())
+            if cached != on_disk:
+                mismatches.append((img_name, cached, on_disk))
+
+        # Con filtro attivo ogni immagine della lista deve avere la classe (tranne la corrente,
+        # che esce dalla lista solo quando la si lascia)
+        target = self.root._class_filter
+        if target:
+            current = self.images[self.index] if 0 <= self.index < len(self.images) else None
+            for img_name in self.images:
+                if img_name != current and target.lower() not in self.metadata_cache.get(img_name, set()):
+                    mismatches.append((img_name, "in lista filtrata", f"senza '{target}'"))
+
+        for img_name, cached, on_disk in mismatches:
+            print(f"CACHE INCOERENTE {img_name}: memoria={cached} disco={on_disk}")
+        if not mismatches:
+            print(f"Cache coerente ({len(self.metadata_cache)} immagini).")
+        return not mismatches
+
+    def _drop_current_if_filtered_out(self):
+        """Con filtro attivo, toglie da self.images l'immagine corrente se non ha più la classe.
+           Restituisce True se rimossa (self.index punta allora all'immagine successiva)."""
+        target = self.root._class_filter
+        if not target or not (0 <= self.index < len(self.images)):
+            return False
+        if self.image_has_class_fast(self.images[self.index], target):
+            return False
+        del self.images[self.index]
+        return True
 
     def image_has_class_fast(self, img_name, target_class):
         """Verifica se l'immagine ha la classe usando la memoria RAM (Veloce)."""
@@ -2380,6 +3477,8 @@ class BoundingBoxEditor:
         if not self.images:
             return
             
+        # La voce di undo aperta appartiene all'immagine che stiamo lasciando
+        self._finalize_undo_entry()
         self.is_loading_image = True
     
         self.filename = self.images[self.index]
@@ -2389,19 +3488,19 @@ class BoundingBoxEditor:
         self.image_label.config(text=f"IMG {self.index + 1}/{len(self.images)}: {display_filename}")
         
         try:
-            img_cv2 = cv2.imread(self.image_path)
-            if img_cv2 is None:
-                raise FileNotFoundError("Immagine non valida o non trovata")
-
-            img_rgb = cv2.cvtColor(img_cv2, cv2.COLOR_BGR2RGB)
-            self.original_img = Image.fromarray(img_rgb)
+            # Se il prefetch l'ha già decodificata è solo uno scambio di riferimento
+            self.image_pyramid = self.prefetcher.get(self.image_path)
+            self.original_img = self.image_pyramid.base
             self.img_width, self.img_height = self.original_img.size
 
         except Exception as e:
             messagebox.showerror("Errore di Caricamento", f"Errore caricando l'immagine {self.filename}: {e}")
             return
-            
+
+        self._schedule_prefetch()
+
         self.canvas.delete("all")
+        self._box_items = {}
         # reset stato OCR/selection temporaneo
         self.loaded_ocr_boxes = []
         self._unbind_plate_entry()  # rimuove eventuali binding residui della sidebar
@@ -2410,6 +3509,7 @@ class BoundingBoxEditor:
 
         self.bboxes = self._load_boxes_from_json(self.filename)
         self.current_box = -1
+        self._rebase_history()
         self._fit_image_to_canvas()
         self._update_box_stats()
         self._update_filename_color() # Aggiorna il colore in base al JSON
@@ -2418,7 +3518,9 @@ class BoundingBoxEditor:
         self._update_current_box_info() 
         
         # --- RESET DIRTY STATE (nuova immagine caricata) ---
-        self.is_dirty = False
+        # (un'immagine il cui ultimo salvataggio è fallito resta da salvare)
+        self._pending_save = None
+        self.is_dirty = self._json_path(self.filename) in self._failed_saves
         self.is_loading_image = False
 
         # ----------------------------------------------------------------------
@@ -2426,6 +3528,16 @@ class BoundingBoxEditor:
         # ----------------------------------------------------------------------
         self._set_navigation_lock(False)
         self._update_plate_entry_from_selection()
+        self.prefetch_info_label.config(text=self.prefetcher.stats_text())
+
+    def _schedule_prefetch(self):
+        """Chiede al prefetcher le immagini vicine a self.index (rispetta il filtro: usa self.images)."""
+        step = self._nav_direction
+        order = [self.index]
+        order += [self.index + step * k for k in range(1, self.prefetcher.ahead + 1)]
+        order += [self.index - step * k for k in range(1, self.prefetcher.behind + 1)]
+        paths = [os.path.join(self.folder, self.images[i]) for i in order if 0 <= i < len(self.images)]
+        self.prefetcher.schedule(paths)
 
 
     def _fit_image_to_canvas(self):
@@ -2447,37 +3559,87 @@ class BoundingBoxEditor:
 
         self._update_canvas_image()
 
-    def _update_canvas_image(self):
-        """Aggiorna l'immagine sulla tela in base a scale e pan."""
+    def _update_canvas_image(self, fast=False):
+        """Aggiorna l'immagine sulla tela in base a scale e pan.
+           fast=True durante zoom/pan: filtro veloce e raffinamento differito."""
         if self.original_img is None:
             return
 
-        new_w = int(self.img_width * self.scale)
-        new_h = int(self.img_height * self.scale)
-        resized_img = self.original_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
+        self._render_viewport(fast)
+        self._draw_bboxes()
+
+        if fast:
+            self._refine_after_id = self.root.after(RENDER_REFINE_DELAY_MS, self._refine_canvas_image)
+
+    def _render_viewport(self, fast=False):
+        """
+        Ricampiona SOLO la porzione di immagine visibile sulla tela: il costo
+        dipende dalla dimensione del canvas e non dal livello di zoom.
+        """
+        # Qualsiasi render annulla il raffinamento in sospeso (verrà rischedulato se serve)
+        if getattr(self, '_refine_after_id', None):
+            self.root.after_cancel(self._refine_after_id)
+            self._refine_after_id = None
+
         canvas_w = self.canvas.winfo_width()
         canvas_h = self.canvas.winfo_height()
-        
-        final_img = Image.new('RGB', (canvas_w, canvas_h), color = 'black')
-        insert_x = int(self.pan_x * self.scale)
-        insert_y = int(self.pan_y * self.scale)
-        
-        final_img.paste(resized_img, (insert_x, insert_y))
 
-        self.tk_img = ImageTk.PhotoImage(final_img)
-        self.canvas.delete("img_display")
-        self.canvas.create_image(0, 0, image=self.tk_img, anchor=tk.NW, tags="img_display")
-        
-        self._draw_bboxes()
+        # Rettangolo di destinazione (pixel interi del canvas) coperto dall'immagine
+        dst_x0 = max(0, math.floor(self.pan_x * self.scale))
+        dst_y0 = max(0, math.floor(self.pan_y * self.scale))
+        dst_x1 = min(canvas_w, math.ceil((self.img_width + self.pan_x) * self.scale))
+        dst_y1 = min(canvas_h, math.ceil((self.img_height + self.pan_y) * self.scale))
 
-    def draw_box(self, box, selected=False, overlapped=False):
-        """Disegna un singolo bounding box con etichetta e maniglie se selezionato.
-           Se overlapped==True il bordo è 3x più spesso dello spessore normale."""
-        
+        if dst_x1 <= dst_x0 or dst_y1 <= dst_y0:
+            # Immagine completamente fuori dalla vista
+            self.canvas.delete("img_display")
+            self.tk_img = None
+            return
+
+        # Livello della piramide appena più grande della scala richiesta
+        _, level_img = self.image_pyramid.level_for_scale(self.scale)
+        lx = level_img.width / self.img_width
+        ly = level_img.height / self.img_height
+
+        # Stessa regione in coordinate del livello (float: PIL campiona il box esatto)
+        src_box = (
+            max(0.0, dst_x0 / self.scale - self.pan_x) * lx,
+            max(0.0, dst_y0 / self.scale - self.pan_y) * ly,
+            min(float(self.img_width), dst_x1 / self.scale - self.pan_x) * lx,
+            min(float(self.img_height), dst_y1 / self.scale - self.pan_y) * ly,
+        )
+        resample = Image.Resampling.NEAREST if fast else Image.Resampling.LANCZOS
+        region = level_img.resize((dst_x1 - dst_x0, dst_y1 - dst_y0), resample, box=src_box)
+
+        # Il canvas ha già sfondo nero: niente immagine piena a tutta tela, si riusa l'item
+        self.tk_img = ImageTk.PhotoImage(region)
+        items = self.canvas.find_withtag("img_display")
+        if items:
+            self.canvas.coords(items[0], dst_x0, dst_y0)
+            self.canvas.itemconfig(items[0], image=self.tk_img)
+        else:
+            self.canvas.create_image(dst_x0, dst_y0, image=self.tk_img, anchor=tk.NW, tags="img_display")
+        self.canvas.tag_lower("img_display")
+
+    def _refine_canvas_image(self):
+        """Passata ad alta qualità dopo che zoom/pan si sono fermati (i box non cambiano)."""
+        self._refine_after_id = None
+        if self.original_img is not None:
+            self._render_viewport(fast=False)
+
+    # ----------------------------------------------------------------------
+    # *** DISEGNO BOX: ITEM DEL CANVAS PERSISTENTI (per indice del box) ***
+    # ----------------------------------------------------------------------
+    # Ogni box visibile ha i suoi item (rettangolo, sfondo etichetta, testo,
+    # maniglie) in self._box_items[indice]. Durante drag/resize si aggiornano
+    # solo coords/itemconfig del box toccato; gli item vengono ricreati solo
+    # quando il box compare/sparisce o cambia classe.
+
+    def _box_geometry(self, box, selected=False, overlapped=False):
+        """Calcola posizione e stile (coordinate canvas) di un box. None se non va disegnato."""
         # Ignora i box OCR che non hanno coordinate valide
         if box.get('class') == 'OCR' and (len(box.get('coords', [])) < 4 or all(c == 0 for c in box['coords'])):
-            return
+            return None
 
         x1_img, y1_img, x2_img, y2_img = box['coords']
         x1_img, x2_img = min(x1_img, x2_img), max(x1_img, x2_img)
@@ -2490,7 +3652,6 @@ class BoundingBoxEditor:
 
         color = "yellow" if selected else CLASS_COLORS.get(box['class'].lower(), 'red')
 
-
         # Determina lo spessore: se overlapped -> 3x spessore normale (normale=2)
         normal_width = 2
         selected_width = 3
@@ -2499,67 +3660,158 @@ class BoundingBoxEditor:
         else:
             width = selected_width if selected else normal_width
 
-        # Disegna il Rettangolo
-        self.canvas.create_rectangle(x1, y1, x2, y2, 
-                                     outline=color, 
-                                     width=width, 
-                                     tags="bbox")
-
         text = box.get('class', 'unknown')
         font_size = max(8, int(10 * self.scale))
-        font = ('Arial', font_size, 'bold')
 
         # Posizionamento Etichetta
         text_w = len(text) * font_size * 0.6
         text_h = font_size + 4
         text_x = x1 + 2
-        text_y = max(y1 - text_h - 2, 5) 
-        
+        text_y = max(y1 - text_h - 2, 5)
+
         # Sposta l'etichetta sotto se non c'è spazio sopra
         if y1 < 20 or text_y < 5:
-             text_y = y1 + 5
-             
-        # Rettangolo di sfondo per l'etichetta
-        self.canvas.create_rectangle(
-            text_x - 2, text_y - 2,
-            text_x + text_w + 5, text_y + text_h + 2,
-            fill=color, outline='black', width=1, tags=("label_bg",)
-        )
-        # Testo dell'etichetta
-        self.canvas.create_text(
-            text_x, text_y, text=text, anchor=tk.NW, fill='white', font=font, tags=("label",)
-        )
-        
+            text_y = y1 + 5
+
         # Maniglie di Ridimensionamento (solo se selezionato)
+        handles = []
         if selected:
             s = 6
-            for hx, hy in [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]:
-                self.canvas.create_oval(hx - s, hy - s, hx + s, hy + s, 
-                                        fill=color, outline="white", width=1, tags="handle")
+            handles = [(hx - s, hy - s, hx + s, hy + s) for hx, hy in [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]]
+
+        return {
+            'rect': (x1, y1, x2, y2),
+            'color': color,
+            'width': width,
+            'text': text,
+            'font': ('Arial', font_size, 'bold'),
+            'label_bg': (text_x - 2, text_y - 2, text_x + text_w + 5, text_y + text_h + 2),
+            'label_pos': (text_x, text_y),
+            'handles': handles,
+        }
+
+    def _create_handle_items(self, geom):
+        return [self.canvas.create_oval(*h, fill=geom['color'], outline="white", width=1, tags="handle")
+                for h in geom['handles']]
+
+    def _create_box_items(self, geom):
+        """Crea gli item canvas di un box e restituisce la voce per self._box_items."""
+        rect = self.canvas.create_rectangle(*geom['rect'],
+                                            outline=geom['color'],
+                                            width=geom['width'],
+                                            tags="bbox")
+        # Rettangolo di sfondo per l'etichetta
+        label_bg = self.canvas.create_rectangle(*geom['label_bg'],
+                                                fill=geom['color'], outline='black', width=1, tags=("label_bg",))
+        # Testo dell'etichetta
+        label = self.canvas.create_text(*geom['label_pos'], text=geom['text'], anchor=tk.NW,
+                                        fill='white', font=geom['font'], tags=("label",))
+        return {
+            'geom': geom,
+            'rect': rect,
+            'label_bg': label_bg,
+            'label': label,
+            'handles': self._create_handle_items(geom),
+        }
+
+    def _remove_box_items(self, index):
+        entry = self._box_items.pop(index, None)
+        if entry:
+            self.canvas.delete(entry['rect'], entry['label_bg'], entry['label'], *entry['handles'])
+
+    def _sync_box_items(self, index, box, selected=False, overlapped=False):
+        """Porta gli item del box 'index' allo stato attuale con il minimo di chiamate al canvas."""
+        geom = self._box_geometry(box, selected, overlapped)
+        entry = self._box_items.get(index)
+
+        if geom is None:
+            self._remove_box_items(index)
+            return
+
+        # Box nuovo o classe cambiata: si ricrea
+        if entry is None or entry['geom']['text'] != geom['text']:
+            self._remove_box_items(index)
+            self._box_items[index] = self._create_box_items(geom)
+            return
+
+        old = entry['geom']
+        if old == geom:
+            return
+
+        canvas = self.canvas
+        if old['rect'] != geom['rect']:
+            canvas.coords(entry['rect'], *geom['rect'])
+        if old['color'] != geom['color'] or old['width'] != geom['width']:
+            canvas.itemconfig(entry['rect'], outline=geom['color'], width=geom['width'])
+        if old['label_bg'] != geom['label_bg']:
+            canvas.coords(entry['label_bg'], *geom['label_bg'])
+        if old['color'] != geom['color']:
+            canvas.itemconfig(entry['label_bg'], fill=geom['color'])
+        if old['label_pos'] != geom['label_pos']:
+            canvas.coords(entry['label'], *geom['label_pos'])
+        if old['font'] != geom['font']:
+            canvas.itemconfig(entry['label'], font=geom['font'])
+
+        if old['handles'] != geom['handles'] or old['color'] != geom['color']:
+            if len(entry['handles']) == len(geom['handles']):
+                for item, h in zip(entry['handles'], geom['handles']):
+                    canvas.coords(item, *h)
+                    if old['color'] != geom['color']:
+                        canvas.itemconfig(item, fill=geom['color'])
+            else:
+                # Selezione cambiata: maniglie create/rimosse
+                if entry['handles']:
+                    canvas.delete(*entry['handles'])
+                entry['handles'] = self._create_handle_items(geom)
+
+        entry['geom'] = geom
+
+    def _raise_box_items(self, index):
+        entry = self._box_items.get(index)
+        if entry:
+            for item in (entry['rect'], entry['label_bg'], entry['label'], *entry['handles']):
+                self.canvas.tag_raise(item)
 
-    
     def _draw_bboxes(self):
         """Disegna i bounding box sulla tela, in base allo stato della checkbox ALL.
-           Applica bordo spesso solo ai box presenti in self.overlapped_indices."""
-        self.canvas.delete("bbox", "label", "handle", "label_bg")
+           Applica bordo spesso solo ai box presenti in self.overlapped_indices.
+           Gli item esistenti vengono aggiornati, non cancellati e ricreati."""
         show_all = self.show_all_boxes_var.get()
 
         # Assicurati che overlapped_indices sia calcolato
         if not hasattr(self, 'overlapped_indices'):
             self.overlapped_indices, _, _ = self._compute_overlaps()
 
+        has_selection = self.current_box != -1 and self.current_box < len(self.bboxes)
+
+        # indice -> selezionato
+        wanted = {}
         if show_all:
-            for i, box in enumerate(self.bboxes):
-                if i != self.current_box:
-                    is_overlapped = (i in self.overlapped_indices)
-                    self.draw_box(box, selected=False, overlapped=is_overlapped)
-        else:
-            if self.current_box == -1 or self.current_box >= len(self.bboxes):
-                return
+            for i in range(len(self.bboxes)):
+                wanted[i] = (i == self.current_box)
+        elif has_selection:
+            wanted[self.current_box] = True
 
-        if self.current_box != -1 and self.current_box < len(self.bboxes):
-            is_overlapped = (self.current_box in self.overlapped_indices)
-            self.draw_box(self.bboxes[self.current_box], selected=True, overlapped=is_overlapped)
+        for i in list(self._box_items):
+            if i not in wanted:
+                self._remove_box_items(i)
+
+        for i, selected in wanted.items():
+            self._sync_box_items(i, self.bboxes[i], selected=selected, overlapped=(i in self.overlapped_indices))
+
+        # Il box selezionato resta sopra agli altri
+        if has_selection:
+            self._raise_box_items(self.current_box)
+
+    def _redraw_box(self, index):
+        """Aggiorna solo gli item del box 'index' (usato durante drag/resize)."""
+        if index < 0 or index >= len(self.bboxes):
+            return
+        selected = (index == self.current_box)
+        if not selected and not self.show_all_boxes_var.get():
+            return
+        self._sync_box_items(index, self.bboxes[index], selected=selected,
+                             overlapped=(index in self.overlapped_indices))
 
     def create_new_box_mode(self, event=None):  
         """Attiva la modalità di creazione di un nuovo bounding box."""
@@ -2730,8 +3982,7 @@ class BoundingBoxEditor:
                 print("ERRORE: immagine non trovata")
                 return
 
-            name_only = os.path.splitext(self.filename)[0]
-            json_path = os.path.join(self.folder, name_only + ".json")
+            json_path = self._json_path(self.filename)
 
             # --------------------------------------------------
             # 2. LEGGI JSON (BOX + OCR)
@@ -2739,10 +3990,13 @@ class BoundingBoxEditor:
             boxes_for_draw = []
             footer_strings = []
 
-            if os.path.exists(json_path):
+            # Salvataggio ancora in coda (es. Ctrl+S subito prima): vale quello, non il file su disco
+            data = self.json_writer.pending_data(json_path)
+            if data is None and os.path.exists(json_path):
                 with open(json_path, "r", encoding="utf-8") as f:
                     data = json.load(f)
 
+            if data is not None:
                 for item in data.get("boxes", []):
 
                     # --- BOX GEOMETRICI ---
@@ -2769,21 +4023,24 @@ class BoundingBoxEditor:
             # --------------------------------------------------
             # 4. DISEGNO BOUNDING BOX
             # --------------------------------------------------
+            # Scarta i box con coordinate mancanti o non numeriche: uno solo farebbe
+            # fallire la conversione in blocco e quindi l'intero snapshot
+            valid_boxes = []
             for b in boxes_for_draw:
+                coords = b["coords"]
+                if len(coords) != 4 or not all(isinstance(c, (int, float)) and math.isfinite(c) for c in coords):
+                    print("BOX MALFORMATO:", b)
+                    continue
+                valid_boxes.append(b)
+
+            # Normalizzazione (x1<x2, y1<y2) e ritaglio ai bordi dell'immagine in blocco
+            draw_coords = geometriaBox.clip_boxes(geometriaBox.normalize_boxes(valid_boxes), *img.size)
+
+            for b, (x1, y1, x2, y2) in zip(valid_boxes, draw_coords.tolist()):
                 cls = str(b.get("class", "object"))
                 raw_color = CLASS_COLORS.get(cls.lower(), "white")
                 color = PIL_SAFE_COLORS.get(raw_color, (255, 255, 255))
 
-
-                try:
-                    x1, y1, x2, y2 = b["coords"]
-                except Exception as e:
-                    print("BOX MALFORMATO:", b, e)
-                    continue
-
-                x1, x2 = min(x1, x2), max(x1, x2)
-                y1, y2 = min(y1, y2), max(y1, y2)
-
                 draw.rectangle([x1, y1, x2, y2], outline=color, width=3)
                 draw.text((x1 + 4, y1 + 4), cls, fill=color)
 
@@ -3001,7 +4258,7 @@ class BoundingBoxEditor:
                 elif self.resize_handle == 'sw':
                     x1, y2 = x_img, y_img
 
-                # Aggiorna le coordinate (mantenendo l'ordine x1, y1, x2, y2 che sarà normalizzato in draw_box)
+                # Aggiorna le coordinate (mantenendo l'ordine x1, y1, x2, y2 che sarà normalizzato in _box_geometry)
                 box['coords'] = [x1, y1, x2, y2]
             
             # 2. Spostamento
@@ -3033,7 +4290,8 @@ class BoundingBoxEditor:
                 # Aggiorna il punto di start per i movimenti successivi
                 self.drag_start_x_img, self.drag_start_y_img = x_img, y_img
                 
-            self._draw_bboxes()
+            # Solo il box trascinato: gli altri item restano invariati
+            self._redraw_box(self.current_box)
             self._update_current_box_info() 
         
         # Aggiorna il cursore se non sto trascinando/ridimensionando
@@ -3113,7 +4371,7 @@ class BoundingBoxEditor:
         new_scale = self.scale * zoom_factor
         if 0.1 <= new_scale <= 10.0:
             self.scale = new_scale
-            self._update_canvas_image()
+            self._update_canvas_image(fast=True)
 
     def _pan_start(self, event):
         """Inizia la traslazione (pan) dell'immagine."""
@@ -3138,7 +4396,7 @@ class BoundingBoxEditor:
             self.pan_x = self.pan_start_x + (dx_canvas / self.scale)
             self.pan_y = self.pan_start_y + (dy_canvas / self.scale)
             
-            self._update_canvas_image()
+            self._update_canvas_image(fast=True)
 
     def _pan_end(self, event):
         """Termina la traslazione (pan) dell'immagine."""
@@ -3207,6 +4465,7 @@ class BoundingBoxEditor:
         
         # --- NUOVI BINDING HELP/ABOUT ---
         self.root.bind("<h>", self.show_help)
+        self.root.bind("<v>", self.next_virgin_image)
         #self.root.bind("<H>", self.show_help)
         self.root.bind("<k>", self.show_about)
         #self.root.bind("<K>", self.show_about)
@@ -3244,14 +4503,18 @@ class BoundingBoxEditor:
 
         if response:
             try:
-                # 1. Elimina il JSON
+                # 1. Elimina il JSON (annullando eventuali salvataggi ancora in coda)
                 json_path = self._json_path(self.filename)
+                self.json_writer.cancel(json_path)
                 if os.path.exists(json_path):
                     os.remove(json_path)
                     self.status_label.config(text=f"JSON eliminato: {os.path.basename(json_path)}", fg='red')
+                self._get_annotation_index().remove(self.filename)
+                self._discard_virgin(self.filename)
 
                 # 2. Elimina l'Immagine
                 image_path = self.image_path
+                self.prefetcher.discard(image_path)
                 os.remove(image_path)
                 self.status_label.config(text=f"Immagine eliminata: {self.filename}", fg='red')
                 
@@ -3273,24 +4536,71 @@ class BoundingBoxEditor:
         
         self.deleting_image = False # Sblocca
         
+    def _discard_virgin(self, filename):
+        """Toglie un'immagine dall'insieme delle vergini (salvata o eliminata)."""
+        for names in (self._virgin_names, self._visible_virgins):
+            pos = bisect.bisect_left(names, filename)
+            if pos < len(names) and names[pos] == filename:
+                del names[pos]
+
+    def _image_position(self, filename):
+        """Indice di filename in self.images (ordinata) oppure -1."""
+        pos = bisect.bisect_left(self.images, filename)
+        if pos < len(self.images) and self.images[pos] == filename:
+            return pos
+        return -1
+
+    def _visible_virgin_list(self):
+        """Vergini presenti in self.images, ordinate. Si ricalcola solo se cambiano le vergini o self.images (filtro, cartella, eliminazioni)."""
+        cached = self._visible_virgins_src
+        if (cached is None or cached[0] is not self.images or cached[1] != len(self.images)
+                or cached[2] is not self._virgin_names):
+            self._visible_virgins = [name for name in self._virgin_names if self._image_position(name) != -1]
+            self._visible_virgins_src = (self.images, len(self.images), self._virgin_names)
+        return self._visible_virgins
+
+    def _find_virgin_from(self, start_name=None):
+        """Indice in self.images della prima vergine dopo start_name (dall'inizio se None), con giro. -1 se nessuna."""
+        if not self.cache_valid:
+            self._rebuild_metadata_cache()
+        virgins = self._visible_virgin_list()
+        if not virgins:
+            return -1
+        start = 0 if start_name is None else bisect.bisect_right(virgins, start_name)
+        return self._image_position(virgins[start % len(virgins)])
+
     def find_first_virgin_index(self):
         """Trova l'indice della prima immagine che non ha un file JSON o ha save_count == 0."""
-        for i, filename in enumerate(self.images):
-            json_path = self._json_path(filename)
-            if not os.path.exists(json_path):
-                return i # JSON non esiste (vergine)
-            
-            # Se esiste, controlla il save_count
-            try:
-                with open(json_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    if data.get("save_count", 0) == 0:
-                        return i # save_count è zero (vergine)
-            except Exception:
-                # JSON malformato, consideralo da rifare
-                return i
-                
-        return 0 # Se tutte sono state salvate, ritorna la prima
+        # Nell'indice: nessuna riga = JSON assente, JSON malformato = save_count 0
+        pos = self._find_virgin_from(None)
+        return pos if pos != -1 else 0 # Se tutte sono state salvate, ritorna la prima
+
+    def next_virgin_image(self, event=None):
+        """Salta alla prossima immagine vergine dopo la corrente (tasto V)."""
+        # --- FIX: Ignora se l'utente sta scrivendo nel box ---
+        if self.root.focus_get() == self.plate_entry:
+            return
+        # -----------------------------------------------------
+        if self.is_navigating or not self.images:
+            return
+
+        current_name = self.images[self.index] if 0 <= self.index < len(self.images) else None
+        pos = self._find_virgin_from(current_name)
+        if pos == -1 or pos == self.index:
+            self.status_label.config(text="Nessun'altra immagine vergine.", fg='yellow')
+            return
+
+        self._set_navigation_lock(True)
+        if not self._ask_save_confirmation():
+            self._set_navigation_lock(False)
+            return
+
+        target_name = self.images[pos]
+        self._drop_current_if_filtered_out()
+        self._nav_direction = 1 if target_name > (current_name or "") else -1
+        self.index = self._image_position(target_name)
+        self.load_image()
+        self.status_label.config(text=f"Prossima vergine: {target_name} ({len(self._virgin_names)} da fare)", fg='gold')
         
     # ----------------------------------------------------------------------
     # *** NUOVI METODI: LOGICA DI NAVIGAZIONE SCHEDULATA ***
@@ -3299,7 +4609,10 @@ class BoundingBoxEditor:
     def _proceed_to_next_image(self):
         """Logica per passare all'immagine successiva."""
         if self.index < len(self.images) - 1:
-            self.index += 1
+            # Se l'immagine lasciata è uscita dal filtro, la successiva scala già su self.index
+            if not self._drop_current_if_filtered_out():
+                self.index += 1
+            self._nav_direction = 1
             self.load_image()
         elif self.index == len(self.images) - 1:
              self.status_label.config(text="Ultima immagine raggiunta.", fg='yellow')
@@ -3308,7 +4621,9 @@ class BoundingBoxEditor:
     def _proceed_to_prev_image(self):
         """Logica per passare all'immagine precedente."""
         if self.index > 0:
+            self._drop_current_if_filtered_out()
             self.index -= 1
+            self._nav_direction = -1
             self.load_image()
         elif self.index == 0:
              self.status_label.config(text="Prima immagine raggiunta.", fg='yellow')
@@ -3389,6 +4704,13 @@ class BoundingBoxEditor:
                 if f.lower().endswith(('.jpg', '.jpeg', '.png'))
             ])
 
+            # Le immagini già decodificate appartengono alla cartella precedente
+            self.prefetcher.clear()
+            # L'indice della nuova cartella verrà aperto al primo uso
+            if self.annotation_index is not None:
+                self.annotation_index.close()
+                self.annotation_index = None
+
             # Invalida la cache dei metadata: la cartella è cambiata,
             # ricostruiremo la cache quando serve (image_has_class_fast la rigenera).
             self.cache_valid = False
@@ -3410,6 +4732,7 @@ class BoundingBoxEditor:
                 messagebox.showinfo("Nessuna Immagine", msg)
                 # Pulisci la visualizzazione
                 self.canvas.delete("all")
+                self._box_items = {}
                 return
             
             # 3. Posizionamento e caricamento
@@ -3466,6 +4789,9 @@ def main():
 
     root.mainloop()
 
+    # Finestra chiusa da altri percorsi (es. tutte le immagini eliminate): niente salvataggi persi
+    app.json_writer.close()
+
 
 
 if __name__ == "__main__":
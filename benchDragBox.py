@@ -0,0 +1,104 @@
+# benchDragBox.py - MICRO-BENCHMARK DISEGNO BOX DURANTE IL DRAG
+#
+# Trascina un box attraverso un frame con N box (default 200) e misura il
+# tempo per frame di:
+#   - PRIMA: cancella e ricrea tutti gli item del canvas a ogni movimento
+#            (comportamento storico di _draw_bboxes)
+#   - DOPO : aggiorna solo gli item del box trascinato (_redraw_box)
+#
+# Uso: python benchDragBox.py [--boxes 200] [--frames 300]
+# Richiede un display (Tk) e le dipendenze dell'annotatore.
+
+import argparse
+import random
+import statistics
+import time
+import tkinter as tk
+
+from annotaimmagini_OCR_JSON_v63 import BoundingBoxEditor, DEFAULT_CLASSES
+
+
+def crea_editor(root, n_boxes, canvas_w, canvas_h):
+    """Editor minimale: solo lo stato usato dal disegno dei box (niente immagini, niente dialog)."""
+    editor = BoundingBoxEditor.__new__(BoundingBoxEditor)
+    editor.root = root
+    editor.canvas = tk.Canvas(root, width=canvas_w, height=canvas_h, bg='black', highlightthickness=0)
+    editor.canvas.pack()
+    editor.scale = 0.5
+    editor.pan_x = 0
+    editor.pan_y = 0
+    editor.img_width = int(canvas_w / editor.scale)
+    editor.img_height = int(canvas_h / editor.scale)
+    editor.show_all_boxes_var = tk.BooleanVar(root, value=True)
+    editor.overlapped_indices = set()
+    editor._box_items = {}
+
+    rnd = random.Random(42)
+    editor.bboxes = []
+    for _ in range(n_boxes):
+        w = rnd.randint(40, 300)
+        h = rnd.randint(40, 300)
+        x1 = rnd.randint(0, editor.img_width - w)
+        y1 = rnd.randint(0, editor.img_height - h)
+        editor.bboxes.append({'class': rnd.choice(DEFAULT_CLASSES), 'coords': [x1, y1, x1 + w, y1 + h]})
+    editor.current_box = 0
+    return editor
+
+
+def trascina(editor, frames, step_frame):
+    """Sposta il box 0 in diagonale per 'frames' passi; restituisce i tempi per frame in ms."""
+    times = []
+    box = editor.bboxes[0]
+    for i in range(frames):
+        dx = 4 if (i // 100) % 2 == 0 else -4
+        x1, y1, x2, y2 = box['coords']
+        box['coords'] = [x1 + dx, y1 + dx, x2 + dx, y2 + dx]
+
+        t0 = time.perf_counter()
+        step_frame(editor)
+        editor.root.update_idletasks()  # include il ridisegno effettivo di Tk
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return times
+
+
+def frame_prima(editor):
+    # Comportamento storico: via tutti gli item e ridisegno completo
+    editor.canvas.delete("bbox", "label", "handle", "label_bg")
+    editor._box_items = {}
+    editor._draw_bboxes()
+
+
+def frame_dopo(editor):
+    editor._redraw_box(editor.current_box)
+
+
+def riassunto(nome, times):
+    ordinati = sorted(times)
+    p95 = ordinati[int(len(ordinati) * 0.95) - 1]
+    print(f"{nome:<6} media {statistics.mean(times):7.3f} ms | mediana {statistics.median(times):7.3f} ms | p95 {p95:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del drag di un box con molti box a schermo")
+    parser.add_argument("--boxes", type=int, default=200)
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    editor = crea_editor(root, args.boxes, 1600, 900)
+    editor._draw_bboxes()
+    root.update()
+
+    prima = trascina(editor, args.frames, frame_prima)
+    editor._draw_bboxes()
+    dopo = trascina(editor, args.frames, frame_dopo)
+    root.destroy()
+
+    print(f"Drag di 1 box su {args.frames} frame con {args.boxes} box a schermo")
+    riassunto("PRIMA", prima)
+    riassunto("DOPO", dopo)
+    print(f"Speedup (media): x{statistics.mean(prima) / max(statistics.mean(dopo), 1e-9):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# benchGeometria.py - BENCHMARK GEOMETRIA BOX: FUNZIONI SCALARI vs NUMPY
+#
+# Per N box casuali confronta il tempo per calcolare tutte le coppie con:
+#   - IoU            : geometriaBox.iou (scalare, coppia per coppia) vs geometriaBox.iou_matrix
+#   - centri vicini  : is_center_close di postanalisiMotoCompleto vs geometriaBox.centers_close_matrix
+#   - contenimento   : doppio ciclo Python vs geometriaBox.contains_matrix
+# e verifica che i risultati coincidano.
+#
+# Uso: python benchGeometria.py [--ripetizioni 3]
+
+import argparse
+import random
+import statistics
+import time
+
+import numpy as np
+
+import geometriaBox
+from postanalisiMotoCompleto import is_center_close
+
+DIMENSIONI = (10, 50, 100, 250, 500, 1000)
+CENTER_FACTOR = 0.25
+
+
+def box_casuali(n, rnd, width=1920, height=1080):
+    boxes = []
+    for _ in range(n):
+        w = rnd.randint(10, 300)
+        h = rnd.randint(10, 300)
+        x1 = rnd.randint(0, width - w)
+        y1 = rnd.randint(0, height - h)
+        boxes.append([x1, y1, x1 + w, y1 + h])
+    return boxes
+
+
+def cronometra(fn, ripetizioni):
+    times = []
+    result = None
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(times), result
+
+
+def iou_scalare(boxes):
+    return [[geometriaBox.iou(a, b) for b in boxes] for a in boxes]
+
+
+def centri_scalare(boxes):
+    return [[is_center_close(a, b, CENTER_FACTOR) for b in boxes] for a in boxes]
+
+
+def contiene_scalare(boxes):
+    return [[a[0] <= b[0] and a[1] <= b[1] and a[2] >= b[2] and a[3] >= b[3] for b in boxes] for a in boxes]
+
+
+def riga(nome, n, t_scalare, t_numpy):
+    print(f"{nome:<14} {n:>6} | {t_scalare:>12.3f} | {t_numpy:>10.3f} | {t_scalare / max(t_numpy, 1e-9):>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark geometria box: scalare vs NumPy")
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    print(f"{'misura':<14} {'N':>6} | {'scalare ms':>12} | {'numpy ms':>10} | {'speedup':>8}")
+    print("-" * 62)
+    for n in DIMENSIONI:
+        boxes = box_casuali(n, rnd)
+        arr = geometriaBox.as_boxes(boxes)
+
+        t_s, atteso = cronometra(lambda: iou_scalare(boxes), args.ripetizioni)
+        t_v, ottenuto = cronometra(lambda: geometriaBox.iou_matrix(arr), args.ripetizioni)
+        assert np.array_equal(ottenuto, np.array(atteso)), f"IoU diversa per N={n}"
+        riga("IoU", n, t_s, t_v)
+
+        t_s, atteso = cronometra(lambda: centri_scalare(boxes), args.ripetizioni)
+        t_v, ottenuto = cronometra(
+            lambda: geometriaBox.centers_close_matrix(arr, max_distance_factor=CENTER_FACTOR), args.ripetizioni)
+        assert np.array_equal(ottenuto, np.array(atteso)), f"Centri vicini diversi per N={n}"
+        riga("centri vicini", n, t_s, t_v)
+
+        t_s, atteso = cronometra(lambda: contiene_scalare(boxes), args.ripetizioni)
+        t_v, ottenuto = cronometra(lambda: geometriaBox.contains_matrix(arr, arr), args.ripetizioni)
+        assert np.array_equal(ottenuto, np.array(atteso)), f"Contenimento diverso per N={n}"
+        riga("contenimento", n, t_s, t_v)
+
+
+if __name__ == "__main__":
+    main()
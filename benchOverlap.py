@@ -0,0 +1,88 @@
+# benchOverlap.py - BENCHMARK CONTROLLO SOVRAPPOSIZIONI TRA BOX
+#
+# Confronta, per n = 10 ... 2000 box:
+#   - PAIRWISE : ciclo O(n²) storico di _compute_overlaps (compute_overlaps_pairwise)
+#   - GRIGLIA  : OverlapIndex ricostruito da zero (caricamento immagine)
+#   - DRAG     : OverlapIndex aggiornato dopo lo spostamento di un solo box
+# e verifica che i tre diano lo stesso (set, rosso, arancio).
+#
+# Uso: python benchOverlap.py [--ripetizioni 5]
+
+import argparse
+import random
+import statistics
+import time
+
+from annotaimmagini_OCR_JSON_v63 import OverlapIndex, compute_overlaps_pairwise
+
+DIMENSIONI = (10, 50, 100, 250, 500, 1000, 2000)
+
+
+def scena_densa(n, rnd, width=1920, height=1080):
+    """Scena tipo stazione: tanti box piccoli/medi, qualche duplicato e qualche quasi-duplicato."""
+    boxes = []
+    for _ in range(n):
+        r = rnd.random()
+        if boxes and r < 0.02:
+            # Duplicato esatto (rosso)
+            src = rnd.choice(boxes)
+            boxes.append({'class': 'person', 'coords': list(src['coords'])})
+            continue
+        if boxes and r < 0.06:
+            # Quasi-duplicato (IoU alto, arancio)
+            x1, y1, x2, y2 = rnd.choice(boxes)['coords']
+            boxes.append({'class': 'backpack', 'coords': [x1 + 1, y1 + 1, x2 + 1, y2]})
+            continue
+        w = rnd.randint(20, 160)
+        h = rnd.randint(40, 260)
+        x1 = rnd.randint(0, width - w)
+        y1 = rnd.randint(0, height - h)
+        boxes.append({'class': rnd.choice(['person', 'handbag', 'backpack', 'suitcase']),
+                      'coords': [x1, y1, x1 + w, y1 + h]})
+    return boxes
+
+
+def cronometra(fn, ripetizioni):
+    times = []
+    result = None
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark overlap: ciclo O(n²) vs indice a griglia")
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    args = parser.parse_args()
+
+    rnd = random.Random(1234)
+    print(f"{'n':>6} | {'pairwise ms':>12} | {'griglia ms':>11} | {'drag ms':>9} | {'x griglia':>9} | {'x drag':>8}")
+    print("-" * 72)
+    for n in DIMENSIONI:
+        boxes = scena_densa(n, rnd)
+
+        t_pair, atteso = cronometra(lambda: compute_overlaps_pairwise(boxes), args.ripetizioni)
+        t_full, ottenuto = cronometra(lambda: OverlapIndex().update(boxes), args.ripetizioni)
+        assert ottenuto == atteso, f"n={n}: risultato diverso dal ciclo pairwise"
+
+        # Drag: un box si sposta di qualche pixel a ogni frame
+        index = OverlapIndex()
+        index.update(boxes)
+        drag_times = []
+        for step in range(max(args.ripetizioni, 20)):
+            box = boxes[step % len(boxes)]
+            box['coords'] = [c + 3 for c in box['coords']]
+            t0 = time.perf_counter()
+            ottenuto = index.update(boxes)
+            drag_times.append((time.perf_counter() - t0) * 1000.0)
+        assert ottenuto == compute_overlaps_pairwise(boxes), f"n={n}: aggiornamento incrementale errato"
+        t_drag = statistics.median(drag_times)
+
+        print(f"{n:>6} | {t_pair:>12.3f} | {t_full:>11.3f} | {t_drag:>9.3f} | "
+              f"{t_pair / max(t_full, 1e-9):>8.1f}x | {t_pair / max(t_drag, 1e-9):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
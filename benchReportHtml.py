@@ -0,0 +1,127 @@
+# benchReportHtml.py - BENCHMARK LETTURA DEI REPORT HTML (BEAUTIFULSOUP vs STREAMING)
+#
+# Genera un report sintetico con la stessa struttura degli export linecrossing/calipso
+# (una tabella, N righe, immagini JPEG finte incorporate in base64) e misura, per ogni
+# metodo di lettura, righe/secondo e picco di memoria (RSS massimo del processo figlio:
+# ogni misura gira in un processo separato, così i picchi non si sommano).
+#   bs4       : BeautifulSoup(f, "html.parser") + find_all, come gli estrattori storici
+#   streaming : estrazioneReport.iter_report_rows
+# Il metodo bs4 viene saltato se BeautifulSoup non è installato.
+#
+# Uso: python benchReportHtml.py [--rows 2000] [--image-kb 200] [--colonne 11]
+#                                [--file report.html] [--methods bs4 streaming]
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+METHODS = ('bs4', 'streaming')
+
+
+def genera_report(path, rows, image_kb, colonne):
+    """Scrive un report sintetico: l'immagine sta nell'ultima colonna, source e timestamp nelle prime due."""
+    payload = base64.b64encode(b'\xff\xd8\xff\xe0' + os.urandom(image_kb * 1024)).decode('ascii')
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<html><body><table>\n<tr>" + "".join(f"<th>Col {c}</th>" for c in range(1, colonne + 1)) + "</tr>\n")
+        for r in range(rows):
+            celle = [f"<td>CAM_{r % 7}</td>", f"<td>2025/11/05 {(r // 3600) % 24:02d}:{(r // 60) % 60:02d}:{r % 60:02d}</td>"]
+            celle += [f"<td>valore {c}</td>" for c in range(3, colonne)]
+            celle.append(f'<td><img src="data:image/jpeg;base64,{payload}"/></td>')
+            f.write("<tr>" + "".join(celle) + "</tr>\n")
+        f.write("</table></body></html>\n")
+
+
+def _conta_bs4(path):
+    from bs4 import BeautifulSoup
+    with open(path, "r", encoding="utf-8") as f:
+        soup = BeautifulSoup(f, "html.parser")
+    righe, immagini = 0, 0
+    for tabella in soup.find_all("table"):
+        for riga in tabella.find_all("tr"):
+            righe += 1
+            for cella in riga.find_all(["td", "th"]):
+                immagini += len(cella.find_all("img"))
+    return righe, immagini
+
+
+def _conta_streaming(path):
+    from estrazioneReport import iter_report_rows
+    righe, immagini = 0, 0
+    for _, _, celle in iter_report_rows(path):
+        righe += 1
+        immagini += sum(len(cella['imgs']) for cella in celle)
+    return righe, immagini
+
+
+def _figlio(method, path):
+    """Eseguito nel processo figlio: stampa il risultato come JSON."""
+    t0 = time.perf_counter()
+    righe, immagini = _conta_bs4(path) if method == 'bs4' else _conta_streaming(path)
+    secondi = time.perf_counter() - t0
+    try:
+        import resource
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak_kb //= 1024      # su macOS ru_maxrss è in byte
+    except ImportError:
+        peak_kb = None            # Windows: niente resource
+    print(json.dumps({'righe': righe, 'immagini': immagini, 'secondi': secondi, 'peak_kb': peak_kb}))
+
+
+def misura(method, path):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", method, path],
+                         capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else f"uscita {out.returncode}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della lettura dei report HTML")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--image-kb", type=int, default=200, help="dimensione di ogni immagine incorporata")
+    parser.add_argument("--colonne", type=int, default=11)
+    parser.add_argument("--file", default=None, help="usa questo report invece di generarne uno")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--child", nargs=2, metavar=("METODO", "FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _figlio(*args.child)
+        return
+
+    tmp_dir = None
+    path = args.file
+    if path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp_dir.name, "report.html")
+        print(f"Genero un report di {args.rows} righe con immagini da {args.image_kb} KB...")
+        genera_report(path, args.rows, args.image_kb, args.colonne)
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    print(f"Report: {path} ({size_mb:.1f} MB)\n")
+
+    print(f"{'metodo':<10} | {'righe':>7} | {'immagini':>8} | {'secondi':>8} | {'righe/s':>9} | {'MB/s':>7} | {'picco RSS MB':>12}")
+    print("-" * 80)
+    try:
+        for method in args.methods:
+            try:
+                r = misura(method, path)
+            except RuntimeError as e:
+                print(f"{method:<10} | saltato: {e}")
+                continue
+            secondi = r['secondi'] or 1e-9
+            picco = f"{r['peak_kb'] / 1024:.1f}" if r['peak_kb'] is not None else "n/d"
+            print(f"{method:<10} | {r['righe']:>7} | {r['immagini']:>8} | {secondi:>8.2f} | "
+                  f"{r['righe'] / secondi:>9.0f} | {size_mb / secondi:>7.1f} | {picco:>12}")
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
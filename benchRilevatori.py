@@ -0,0 +1,106 @@
+# benchRilevatori.py - BENCHMARK BACKEND DI RILEVAMENTO (PYTORCH vs ONNX RUNTIME)
+#
+# Su una cartella di frame misura, per ogni backend di rilevatori.py:
+#   - avvio   : import delle librerie + caricamento del modello
+#   - warmup  : primo batch (allocazioni, ottimizzazione del grafo)
+#   - regime  : immagini/secondo sui batch successivi
+# e confronta i box con quelli del primo backend della lista (stessa classe, IoU >= 0.9),
+# riportando anche il massimo scostamento in pixel delle coordinate.
+#
+# Uso: python benchRilevatori.py CARTELLA [--backends torch onnx] [--batch-size 16]
+#                                [--limit 200] [--intra-threads 8] [--inter-threads 1]
+
+import argparse
+import os
+import time
+
+from PIL import Image, ImageOps
+
+import geometriaBox
+from rilevatori import BACKENDS, create_detector
+
+MATCH_IOU = 0.9
+
+
+def carica_immagini(folder, limit):
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        with Image.open(os.path.join(folder, name)) as image:
+            images.append(ImageOps.exif_transpose(image).convert('RGB'))
+        if len(images) >= limit:
+            break
+    return images
+
+
+def misura(backend, model_path, images, batch_size, intra_threads, inter_threads):
+    t0 = time.perf_counter()
+    detector = create_detector(backend, model_path, intra_threads, inter_threads)
+    avvio = time.perf_counter() - t0
+
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    t0 = time.perf_counter()
+    detections = detector.detect(batches[0])
+    warmup = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for batch in batches[1:]:
+        detections.extend(detector.detect(batch))
+    regime = time.perf_counter() - t0
+    n_regime = len(images) - len(batches[0])
+    img_s = n_regime / regime if regime > 0 else 0.0
+    return {'avvio': avvio, 'warmup': warmup, 'img_s': img_s, 'detections': detections}
+
+
+def confronta(riferimento, altro):
+    """(box del riferimento ritrovati, totale box del riferimento, scostamento massimo in px)."""
+    trovati, totale, scostamento = 0, 0, 0
+    for ref_boxes, boxes in zip(riferimento, altro):
+        totale += len(ref_boxes)
+        liberi = list(boxes)
+        for ref in ref_boxes:
+            candidati = [b for b in liberi if b['class'] == ref['class']]
+            if not candidati:
+                continue
+            ious = geometriaBox.iou_matrix([ref['coords']], [b['coords'] for b in candidati])[0]
+            best = int(ious.argmax())
+            if ious[best] >= MATCH_IOU:
+                trovati += 1
+                scostamento = max(scostamento, max(abs(a - b) for a, b in zip(ref['coords'], candidati[best]['coords'])))
+                liberi.remove(candidati[best])
+    return trovati, totale, scostamento
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei backend di rilevamento su una cartella di frame")
+    parser.add_argument("cartella")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=['torch', 'onnx'])
+    parser.add_argument("--model", default='yolov8n.pt')
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--limit", type=int, default=200, help="numero massimo di immagini")
+    parser.add_argument("--intra-threads", type=int, default=None)
+    parser.add_argument("--inter-threads", type=int, default=None)
+    args = parser.parse_args()
+
+    images = carica_immagini(args.cartella, args.limit)
+    if len(images) <= args.batch_size:
+        parser.error(f"servono più di {args.batch_size} immagini (trovate {len(images)})")
+    print(f"{len(images)} immagini, batch {args.batch_size}, modello {args.model}\n")
+
+    risultati = {}
+    for backend in args.backends:
+        risultati[backend] = misura(backend, args.model, images, args.batch_size,
+                                    args.intra_threads, args.inter_threads)
+
+    riferimento = args.backends[0]
+    print(f"{'backend':<9} | {'avvio s':>8} | {'warmup s':>9} | {'img/s':>8} | {'box uguali a ' + riferimento:>22} | {'max Δ px':>8}")
+    print("-" * 80)
+    for backend, r in risultati.items():
+        trovati, totale, scostamento = confronta(risultati[riferimento]['detections'], r['detections'])
+        uguali = f"{trovati}/{totale}" + (f" ({100.0 * trovati / totale:.1f}%)" if totale else "")
+        print(f"{backend:<9} | {r['avvio']:>8.2f} | {r['warmup']:>9.2f} | {r['img_s']:>8.1f} | {uguali:>22} | {scostamento:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# benchScaricamento.py - BENCHMARK DOWNLOAD DELLE IMMAGINI REMOTE DEI REPORT
+#
+# Avvia un server HTTP locale che fa le veci del server delle istantanee (latenza
+# artificiale, una parte delle richieste risponde 503 al primo tentativo) e scarica
+# N immagini in due modi:
+#   seriale    : requests.get per immagine, connessione nuova ogni volta (estrattori storici)
+#   concorrente: estrazioneReport.ImageDownloader (sessione condivisa, limite per host, retry)
+# Riporta immagini/secondo, tentativi ripetuti e verifica che i file scaricati siano identici.
+#
+# Uso: python benchScaricamento.py [--images 200] [--latency-ms 50] [--image-kb 100]
+#                                  [--flaky 0.1] [--workers 16] [--per-host 4]
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from estrazioneReport import ImageDownloader, download_succeeded
+
+
+def avvia_server(latency, image_kb, flaky):
+    """Server locale: /img/<n>.jpg restituisce byte deterministici; il 'flaky' delle immagini fallisce una volta."""
+    gia_fallite = set()
+    lock = threading.Lock()
+    corpo = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            nome = os.path.basename(self.path)
+            if not nome.endswith('.jpg'):
+                self.send_error(404)
+                return
+            n = int(nome[:-4])
+            with lock:
+                fallisci = n < flaky and n not in gia_fallite
+                if fallisci:
+                    gia_fallite.add(n)
+            if fallisci:
+                self.send_error(503)
+                return
+            if n not in corpo:
+                corpo[n] = bytes([n % 256]) * (image_kb * 1024)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(corpo[n])))
+            self.end_headers()
+            self.wfile.write(corpo[n])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, gia_fallite
+
+
+def scarica_seriale(urls, cartella):
+    salvate = 0
+    for i, url in enumerate(urls):
+        for _ in range(2):     # un solo nuovo tentativo, per confrontare a parità di 503
+            r = requests.get(url, timeout=10)
+            if r.status_code != 503:
+                break
+        r.raise_for_status()
+        with open(os.path.join(cartella, f"{i}.jpg"), "wb") as out:
+            out.write(r.content)
+        salvate += 1
+    return salvate
+
+
+def scarica_concorrente(urls, cartella, workers, per_host):
+    downloader = ImageDownloader(workers=workers, per_host=per_host, backoff=0.05)
+    try:
+        futuri = [downloader.submit(url, os.path.join(cartella, f"{i}.jpg")) for i, url in enumerate(urls)]
+        wait(futuri)
+    finally:
+        downloader.close()
+    return sum(download_succeeded(f) for f in futuri), downloader.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del download delle immagini remote")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--image-kb", type=int, default=100)
+    parser.add_argument("--flaky", type=float, default=0.1, help="frazione di immagini che rispondono 503 al primo tentativo")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--per-host", type=int, default=4)
+    args = parser.parse_args()
+
+    n_flaky = int(args.images * args.flaky)
+    print(f"{args.images} immagini da {args.image_kb} KB, latenza {args.latency_ms:.0f} ms, {n_flaky} con un 503 iniziale\n")
+    print(f"{'metodo':<12} | {'salvate':>7} | {'secondi':>8} | {'img/s':>8} | {'tentativi ripetuti':>18}")
+    print("-" * 66)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        risultati = {}
+        for metodo in ('seriale', 'concorrente'):
+            server, gia_fallite = avvia_server(args.latency_ms / 1000.0, args.image_kb, n_flaky)
+            base = f"http://127.0.0.1:{server.server_address[1]}/img/"
+            urls = [f"{base}{i}.jpg" for i in range(args.images)]
+            cartella = os.path.join(tmp, metodo)
+            os.makedirs(cartella)
+            t0 = time.perf_counter()
+            if metodo == 'seriale':
+                salvate, ripetuti = scarica_seriale(urls, cartella), len(gia_fallite)
+            else:
+                salvate, stats = scarica_concorrente(urls, cartella, args.workers, args.per_host)
+                ripetuti = stats['retries']
+            secondi = time.perf_counter() - t0
+            server.shutdown()
+            server.server_close()
+            risultati[metodo] = cartella
+            print(f"{metodo:<12} | {salvate:>7} | {secondi:>8.2f} | {salvate / secondi:>8.1f} | {ripetuti:>18}")
+
+        diversi = 0
+        for nome in os.listdir(risultati['seriale']):
+            with open(os.path.join(risultati['seriale'], nome), "rb") as a, \
+                 open(os.path.join(risultati['concorrente'], nome), "rb") as b:
+                diversi += a.read() != b.read()
+        print(f"\nFile diversi tra i due metodi: {diversi}")
+
+
+if __name__ == "__main__":
+    main()
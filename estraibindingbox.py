@@ -1,12 +1,19 @@
 # estraibindingbox.py - VERSIONE DEFINITIVA CON METADATI IN FILE .JSON
 
+import io
 import os
-import shutil
+import time
+import sqlite3
+import hashlib
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image, ImageOps 
-from ultralytics import YOLO
+from rilevatori import create_detector, DEFAULT_BACKEND
 import json # Importato per la gestione del JSON
+from materializza import Materializer, DEFAULT_MODE as MATERIALIZE_MODE
 
 # Mappa le classi rilevate da YOLO alle cartelle di destinazione.
 VEHICLE_CLASS_MAP = {
@@ -20,6 +27,18 @@ VEHICLE_CLASS_MAP = {
     'car': 'Car', 
 }
 
+# Pipeline di rilevamento: i worker decodificano (EXIF + RGB) mentre YOLO
+# elabora il batch precedente. Su macchine solo-CPU conviene alzare i worker
+# finché l'attesa di decodifica riportata a fine elaborazione non va a zero.
+MODEL_PATH = 'yolov8n.pt'
+BATCH_SIZE = 16
+DECODE_WORKERS = max(2, min(8, (os.cpu_count() or 4) // 2))
+
+# Manifest di elaborazione (SQLite nella cartella di output): permette di riprendere
+# una run interrotta e di rielaborare solo le immagini nuove o cambiate.
+MANIFEST_FILENAME = ".estraibindingbox_manifest.sqlite"
+MANIFEST_VERSION = 1
+
 # ----------------------------
 # Gestione Metadati (Sidecar .json)
 # ----------------------------
@@ -47,109 +66,400 @@ def save_metadata(image_path, boxes, plate_box=None):
         
     return metadata_path
 
-def process_images_in_folder():
+# ----------------------------
+# Manifest di elaborazione (ripresa delle run)
+# ----------------------------
+
+class ProcessingManifest(object):
     """
-    Analizza, salva i BB in file .json affiancati e smista le immagini.
+    Registro SQLite delle immagini già elaborate: per ogni file sorgente (percorso relativo
+    alla cartella di input) memorizza size, mtime, sha256 del contenuto, rilevamenti e
+    destinazione. Le chiavi (size, mtime) e gli hash sono tenuti anche in memoria, così il
+    controllo "già fatto?" è O(1) e non tocca il database. Se cambiano modello o mappa
+    classi il manifest viene azzerato (i rilevamenti salvati non sarebbero più validi).
     """
-    root = tk.Tk()
-    root.withdraw()
+    def __init__(self, folder, config):
+        self.path = os.path.join(folder, MANIFEST_FILENAME)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        config_text = json.dumps(config, sort_keys=True)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != MANIFEST_VERSION or self._stored_config() != config_text:
+            if version:
+                print(f"Manifest {self.path}: modello/mappa classi cambiati, si riparte da zero.")
+            self._reset(config_text)
 
-    main_folder_path = filedialog.askdirectory(title="Seleziona la cartella principale con le immagini")
-    
-    if not main_folder_path:
-        print("Nessuna cartella selezionata. Uscita.")
-        return None, {}
+        self.known = {}
+        self.hashes = set()
+        for path, size, mtime_ns, sha256, destination in self.db.execute(
+                "SELECT path, size, mtime_ns, sha256, destination FROM files"):
+            self.known[path] = (size, mtime_ns, destination)
+            self.hashes.add(sha256)
 
-    try:
-        model = YOLO('yolov8n.pt') 
-    except Exception as e:
-        print(f"Errore nel caricamento del modello YOLO: {e}")
-        return main_folder_path, {}
+    def _stored_config(self):
+        try:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
 
-    vehicle_folders = {}
-    for class_folder_name in set(VEHICLE_CLASS_MAP.values()):
-        folder_path = os.path.join(main_folder_path, class_folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-        vehicle_folders[class_folder_name.lower()] = folder_path
+    def _reset(self, config_text):
+        self.db.executescript("""
+            DROP TABLE IF EXISTS files;
+            DROP TABLE IF EXISTS meta;
+            CREATE TABLE files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                detections TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                processed_at REAL NOT NULL
+            );
+            CREATE INDEX files_by_hash ON files(sha256);
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self.db.execute("INSERT INTO meta VALUES ('config', ?)", (config_text,))
+        self.db.execute(f"PRAGMA user_version = {MANIFEST_VERSION}")
+        self.db.commit()
 
-    no_vehicles_folder = os.path.join(main_folder_path, 'no_vehicles')
-    os.makedirs(no_vehicles_folder, exist_ok=True)
-    vehicle_folders['no_vehicles'] = no_vehicles_folder
-    
-    total_images = 0
-    processed_images = 0
+    def is_done(self, rel_path, st, check_destination=True):
+        """True se il file è già stato elaborato, non è cambiato e la sua copia esiste ancora
+        (check_destination=False per la materializzazione virtual, che non crea file)."""
+        row = self.known.get(rel_path)
+        return (row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns
+                and (not check_destination or os.path.lexists(row[2])))
+
+    def detections_for_hash(self, sha256):
+        """Rilevamenti già calcolati per un contenuto identico (file toccato, rinominato o duplicato)."""
+        row = self.db.execute("SELECT detections FROM files WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def record(self, rel_path, st, sha256, boxes, destination):
+        detections = [{'class': b['class'], 'coords': [int(c) for c in b['coords']]} for b in boxes]
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (rel_path, st.st_size, st.st_mtime_ns, sha256, json.dumps(detections),
+                         destination, time.time()))
+        self.known[rel_path] = (st.st_size, st.st_mtime_ns, destination)
+        self.hashes.add(sha256)
+
+    def commit(self):
+        self.db.commit()
 
-    print(f"Inizio analisi nella cartella: {main_folder_path}")
+    def close(self):
+        try:
+            self.db.commit()
+            self.db.close()
+        except sqlite3.Error:
+            pass
 
+# ----------------------------
+# Pipeline decodifica -> inferenza a batch
+# ----------------------------
+
+def _decode_image(image_path, known_hashes=None):
+    """
+    Legge il file una sola volta, ne calcola lo sha256 e, se il contenuto non è già
+    nel manifest, lo decodifica (orientamento EXIF + RGB). Eseguita nei worker.
+    Restituisce (immagine o None se il contenuto è già noto, sha256, secondi).
+    """
+    t0 = time.perf_counter()
+    with open(image_path, 'rb') as f:
+        raw = f.read()
+    sha256 = hashlib.sha256(raw).hexdigest()
+    if known_hashes is not None and sha256 in known_hashes:
+        return None, sha256, time.perf_counter() - t0
+    with Image.open(io.BytesIO(raw)) as image:
+        image = ImageOps.exif_transpose(image)
+        # convert() forza la decodifica qui, nel worker, e non nel thread dell'inferenza
+        image = image.convert('RGB')
+    return image, sha256, time.perf_counter() - t0
+
+
+def _iter_image_paths(main_folder_path, skip_folders):
+    """Percorre la cartella (come prima) saltando le cartelle di destinazione e il loro contenuto."""
+    skip_set = {os.path.normpath(d) for d in skip_folders}
     for subdir, dirs, files in os.walk(main_folder_path):
-        if any(subdir.endswith(d) for d in vehicle_folders.values()):
+        if any(subdir.endswith(d) for d in skip_folders):
             continue
-            
+        dirs[:] = [d for d in dirs if os.path.normpath(os.path.join(subdir, d)) not in skip_set]
         for filename in files:
             if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                total_images += 1
-                original_image_path = os.path.join(subdir, filename)
-                
+                yield subdir, filename
+
+
+def _feed_decoders(paths, executor, out_queue, main_folder_path, manifest=None, check_destination=True):
+    """
+    Thread produttore: sottomette le decodifiche in ordine; la coda limitata frena la lettura dal disco.
+    I file già elaborati e invariati secondo il manifest passano in coda senza decodifica (future None).
+    """
+    known_hashes = manifest.hashes if manifest is not None else None
+    try:
+        for subdir, filename in paths:
+            image_path = os.path.join(subdir, filename)
+            rel_path = os.path.relpath(image_path, main_folder_path)
+            try:
+                st = os.stat(image_path)
+            except OSError:
+                continue
+            if manifest is not None and manifest.is_done(rel_path, st, check_destination):
+                out_queue.put((subdir, filename, rel_path, st, None))
+                continue
+            future = executor.submit(_decode_image, image_path, known_hashes)
+            out_queue.put((subdir, filename, rel_path, st, future))
+    finally:
+        out_queue.put(None)  # fine lavoro
+
+
+def _filter_boxes(boxes, class_map):
+    """Tiene solo i BB delle classi mappate su una cartella."""
+    return [box for box in boxes if box['class'] in class_map]
+
+
+def target_folder_name(boxes, class_map):
+    """Cartella di destinazione: la prima classe della mappa presente tra i BB (None se nessuna)."""
+    detected_classes = {b['class'] for b in boxes}
+    for yolo_class, target_name in class_map.items():
+        if yolo_class in detected_classes:
+            return target_name
+    return None
+
+
+class ClassFolderSink(object):
+    """
+    Destinazione della Fase 1 stand-alone: materializza ogni immagine (copia, link, ...
+    vedi materializza.py) nella cartella della sua classe (o in no_vehicles) sotto
+    output_root, con il .json dei BB scritto direttamente accanto. detect_and_sort chiama sink(percorso, nome_file, boxes) per ogni
+    immagine e registra nel manifest il percorso restituito.
+    """
+    config = {'output': 'cartelle_classe'}
+
+    def __init__(self, output_root, class_map, materializer=None):
+        self.class_map = class_map
+        self.materializer = materializer or Materializer()
+        self.folders = {}
+        for class_folder_name in set(class_map.values()):
+            folder_path = os.path.join(output_root, class_folder_name)
+            os.makedirs(folder_path, exist_ok=True)
+            self.folders[class_folder_name.lower()] = folder_path
+
+        no_vehicles_folder = os.path.join(output_root, 'no_vehicles')
+        os.makedirs(no_vehicles_folder, exist_ok=True)
+        self.folders['no_vehicles'] = no_vehicles_folder
+
+    def __call__(self, original_image_path, filename, boxes):
+        if not boxes:
+            # Non ci sono BB, copia l'immagine in no_vehicles e basta
+            dest_image_path = os.path.join(self.folders['no_vehicles'], filename)
+            self.materializer(original_image_path, dest_image_path)
+            print(f"    Immagine copiata in 'no_vehicles': {filename}")
+            return dest_image_path
+
+        target_name = target_folder_name(boxes, self.class_map)
+        target_folder = self.folders[target_name.lower()] if target_name else self.folders['no_vehicles']
+
+        # Mantieni il nome file originale; il .json va direttamente accanto alla copia
+        dest_image_path = os.path.join(target_folder, filename)
+        self.materializer(original_image_path, dest_image_path)
+        save_metadata(dest_image_path, boxes)
+
+        print(f"    Immagine elaborata (BB in .json): {filename}")
+        return dest_image_path
+
+    def close(self):
+        self.materializer.close()
+
+
+def _report_error(stats, original_image_path, e):
+    print(f"    Errore durante l'elaborazione di {original_image_path}: {e}")
+    stats['errors'].append(f"{original_image_path}: {e}")
+
+
+def _print_stage_stats(stats, decode_workers):
+    """Immagini/secondo per stadio, per dimensionare il pool di decodifica."""
+    def rate(count, seconds):
+        return count / seconds if seconds > 0 else 0.0
+
+    wall = stats['wall_s']
+    print("\nPrestazioni per stadio:")
+    print(f"  Decodifica : {rate(stats['decoded'], stats['decode_s']):7.1f} img/s per worker "
+          f"({decode_workers} worker, max teorico {rate(stats['decoded'], stats['decode_s']) * decode_workers:.1f} img/s)")
+    print(f"  Inferenza  : {rate(stats['inferred'], stats['infer_s']):7.1f} img/s "
+          f"({stats['batches']} batch, attesa decodifica {stats['wait_s']:.1f} s)")
+    print(f"  Smistamento: {rate(stats['inferred'], stats['sort_s']):7.1f} img/s")
+    print(f"  Totale     : {rate(stats['total_images'], wall):7.1f} img/s ({stats['total_images']} immagini in {wall:.1f} s)")
+    if stats['skipped'] or stats['reused']:
+        print(f"  Manifest   : {stats['skipped']} invariate saltate, {stats['reused']} con rilevamenti riusati (stesso contenuto)")
+
+
+def detect_and_sort(main_folder_path, output_root=None, model_path=MODEL_PATH, class_map=None,
+                    batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS, exclude_folders=(),
+                    use_manifest=True, force=False, sink=None, materialize=MATERIALIZE_MODE,
+                    backend=DEFAULT_BACKEND, intra_threads=None, inter_threads=None):
+    """
+    Motore della Fase 1 (senza interfaccia): rileva con YOLO e passa ogni immagine con i
+    suoi BB al sink; il default (ClassFolderSink) la smista nelle cartelle di classe sotto
+    output_root (default: la cartella di input) con il .json affiancato, materializzando
+    le immagini secondo materialize ('copy', 'hardlink', 'reflink', 'symlink', 'virtual'). Le immagini vengono decodificate da un pool di
+    worker in una coda limitata e passate al rilevatore (backend: 'torch', 'onnx', 'openvino',
+    vedi rilevatori.py; intra/inter_threads per i thread dell'inferenza) a gruppi di batch_size.
+    Le cartelle in exclude_folders (es. l'output della post-analisi) non vengono scansionate.
+    Con use_manifest le immagini già elaborate (manifest in output_root) vengono saltate:
+    una run interrotta riprende da dove era arrivata; force=True rielabora tutto.
+    Restituisce (sink.folders, stats). Se il modello non si carica solleva l'eccezione.
+    """
+    class_map = VEHICLE_CLASS_MAP if class_map is None else class_map
+    output_root = output_root or main_folder_path
+
+    detector = create_detector(backend, model_path, intra_threads, inter_threads)
+
+    if sink is None:
+        sink = ClassFolderSink(output_root, class_map, Materializer(materialize))
+
+    manifest = None
+    if use_manifest:
+        manifest = ProcessingManifest(output_root, {'model': model_path, 'backend': backend, 'class_map': class_map,
+                                                    'sink': sink.config})
+        if force:
+            manifest.known.clear()
+            manifest.hashes.clear()
+
+    stats = {'total_images': 0, 'processed_images': 0, 'decoded': 0, 'inferred': 0, 'batches': 0,
+             'skipped': 0, 'reused': 0, 'errors': [],
+             'decode_s': 0.0, 'infer_s': 0.0, 'sort_s': 0.0, 'wait_s': 0.0, 'wall_s': 0.0}
+
+    def sort_and_record(item, boxes):
+        destination = sink(item['path'], item['filename'], boxes)
+        if boxes:
+            stats['processed_images'] += 1
+        if manifest is not None:
+            manifest.record(item['rel_path'], item['st'], item['sha256'], boxes, destination)
+
+    print(f"Inizio analisi nella cartella: {main_folder_path} (batch {batch_size}, {decode_workers} worker di decodifica)")
+    t_start = time.perf_counter()
+
+    def run_batch(batch):
+        """Inferenza su un gruppo di immagini decodificate, poi smistamento una per una."""
+        images = [item['image'] for item in batch]
+        t0 = time.perf_counter()
+        try:
+            results = detector.detect(images)
+        except Exception as e:
+            # Batch fallito: si riprova immagine per immagine per isolare quella problematica
+            print(f"    Errore di inferenza sul batch ({e}), riprovo per singola immagine")
+            results = []
+            for item in batch:
                 try:
-                    image = Image.open(original_image_path)
-                    image = ImageOps.exif_transpose(image)
-                    
-                    results = model(image, verbose=False)
-                    boxes = []
-                    
-                    for result in results:
-                        for box in result.boxes:
-                            class_id = int(box.cls[0].item())
-                            class_name = model.names[class_id]
-                            
-                            if class_name in VEHICLE_CLASS_MAP:
-                                x1, y1, x2, y2 = [int(x.item()) for x in box.xyxy[0]]
-                                boxes.append({'class': class_name, 'coords': (x1, y1, x2, y2)})
-                    
-                    if not boxes:
-                        # Non ci sono BB, copia l'immagine in no_vehicles e basta
-                        shutil.copy2(original_image_path, os.path.join(no_vehicles_folder, filename))
-                        print(f"    Immagine copiata in 'no_vehicles': {filename}")
-                        continue
-                        
-                    processed_images += 1
-                    
-                    # Salva i metadati in un file .json temporaneo
-                    temp_metadata_path = save_metadata(original_image_path, boxes)
-                    
-                    # Determina la cartella di destinazione (usando il nome originale)
-                    target_folder = None
-                    detected_classes = [b['class'] for b in boxes]
-                    
-                    for yolo_class, target_name in VEHICLE_CLASS_MAP.items():
-                        if yolo_class in detected_classes:
-                            target_folder = vehicle_folders[target_name.lower()]
-                            break
-                            
-                    if not target_folder:
-                        target_folder = no_vehicles_folder
-                        
-                    # Mantieni il nome file originale
-                    dest_image_path = os.path.join(target_folder, filename)
-                    dest_metadata_path = os.path.splitext(dest_image_path)[0] + '.json'
-                    
-                    # Copia sia l'immagine che il file .json affiancato
-                    shutil.copy2(original_image_path, dest_image_path)
-                    shutil.copy2(temp_metadata_path, dest_metadata_path)
-                    
-                    # Rimuovi il file .json temporaneo
-                    os.remove(temp_metadata_path)
-
-                    print(f"    Immagine elaborata (BB in .json): {filename}")
+                    results.append(detector.detect([item['image']])[0])
+                except Exception as e_single:
+                    results.append(e_single)
+        stats['infer_s'] += time.perf_counter() - t0
+        stats['batches'] += 1
+
+        t0 = time.perf_counter()
+        for item, result in zip(batch, results):
+            if isinstance(result, Exception):
+                _report_error(stats, item['path'], result)
+                continue
+            stats['inferred'] += 1
+            try:
+                sort_and_record(item, _filter_boxes(result, class_map))
+            except Exception as e:
+                _report_error(stats, item['path'], e)
+        if manifest is not None:
+            # Un commit per batch: dopo un crash si rifà al più l'ultimo batch
+            manifest.commit()
+        stats['sort_s'] += time.perf_counter() - t0
+
+    decoded_queue = queue.Queue(maxsize=max(batch_size * 2, decode_workers * 2))
+    skip_folders = list(sink.folders.values()) + list(exclude_folders)
+    if os.path.normpath(output_root) != os.path.normpath(main_folder_path):
+        skip_folders.append(os.path.normpath(output_root))
+    paths = _iter_image_paths(main_folder_path, skip_folders)
+
+    try:
+        with ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="decode") as executor:
+            feeder = threading.Thread(target=_feed_decoders,
+                                      args=(paths, executor, decoded_queue, main_folder_path, manifest,
+                                        sink.materializer.writes_files), daemon=True)
+            feeder.start()
 
+            batch = []
+            while True:
+                t0 = time.perf_counter()
+                item = decoded_queue.get()
+                if item is None:
+                    break
+                subdir, filename, rel_path, st, future = item
+                stats['total_images'] += 1
+                original_image_path = os.path.join(subdir, filename)
+                if future is None:
+                    # Già elaborata in una run precedente e invariata
+                    stats['skipped'] += 1
+                    continue
+                try:
+                    image, sha256, decode_s = future.result()
                 except Exception as e:
-                    print(f"    Errore durante l'elaborazione di {original_image_path}: {e}")
-                    # Assicurati di pulire il file json temporaneo in caso di errore
-                    temp_json_path = os.path.splitext(original_image_path)[0] + '.json'
-                    if os.path.exists(temp_json_path):
-                        os.remove(temp_json_path)
+                    stats['wait_s'] += time.perf_counter() - t0
+                    _report_error(stats, original_image_path, e)
+                    continue
+                stats['wait_s'] += time.perf_counter() - t0
+                entry = {'path': original_image_path, 'filename': filename, 'rel_path': rel_path,
+                         'st': st, 'sha256': sha256, 'image': image}
+
+                if image is None:
+                    # Contenuto già visto (file toccato, rinominato o duplicato): niente inferenza
+                    try:
+                        sort_and_record(entry, manifest.detections_for_hash(sha256) or [])
+                        stats['reused'] += 1
+                    except Exception as e:
+                        _report_error(stats, original_image_path, e)
+                    continue
+                stats['decoded'] += 1
+                stats['decode_s'] += decode_s
+
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    run_batch(batch)
+                    batch = []
+
+            if batch:
+                run_batch(batch)
+            feeder.join()
+    finally:
+        sink.close()
+        if manifest is not None:
+            manifest.close()
 
-    print(f"\nElaborazione completata. Totale immagini scansionate: {total_images}. Immagini processate: {processed_images}.")
+    stats['wall_s'] = time.perf_counter() - t_start
+    stats['materialization'] = sink.materializer.stats
+
+    print(f"\nElaborazione completata. Totale immagini scansionate: {stats['total_images']}. Immagini processate: {stats['processed_images']}.")
+    _print_stage_stats(stats, decode_workers)
+    return sink.folders, stats
+
+
+def process_images_in_folder(main_folder_path=None, batch_size=BATCH_SIZE, decode_workers=DECODE_WORKERS):
+    """
+    Analizza, salva i BB in file .json affiancati e smista le immagini.
+    Senza main_folder_path chiede la cartella con la finestra di dialogo Tk.
+    """
+    if main_folder_path is None:
+        root = tk.Tk()
+        root.withdraw()
+
+        main_folder_path = filedialog.askdirectory(title="Seleziona la cartella principale con le immagini")
+    
+    if not main_folder_path:
+        print("Nessuna cartella selezionata. Uscita.")
+        return None, {}
+
+    try:
+        vehicle_folders, _ = detect_and_sort(main_folder_path, batch_size=batch_size, decode_workers=decode_workers)
+    except Exception as e:
+        print(f"Errore nel caricamento del modello di rilevamento: {e}")
+        return main_folder_path, {}
     return main_folder_path, vehicle_folders
 
 if __name__ == "__main__":
@@ -0,0 +1,857 @@
+# estrazioneReport.py - ESTRAZIONE DELLE IMMAGINI DAI REPORT HTML (LINECROSSING / CALIPSO)
+#
+# Motore unico degli estrattori: i tipi di report si descrivono con un ReportProfile
+# (colonne, formati del timestamp, filtro delta, layout dei nomi, cartella di output) e
+# extract_images() fa il resto. Gli script "estraiimmaginida report ..." sono solo
+# interfacce Tk sopra i profili di PROFILES.
+#
+# I report esportati incorporano le immagini come JPEG base64 e arrivano a diversi GB:
+# costruire il DOM con BeautifulSoup esaurisce la RAM. Qui il file viene letto a blocchi
+# e passato a html.parser.HTMLParser in modalità feed; ogni <tr> viene consegnato appena
+# chiuso e poi dimenticato, quindi in memoria c'è al più una riga (più il blocco di lettura).
+#
+# Ogni riga è (idx_tabella, idx_riga, celle) con indici da 1 come negli estrattori storici;
+# ogni cella è un dizionario {'text': testo come get_text(strip=True), 'imgs': [src, ...]}.
+#
+# Le immagini incorporate (data:<mime>;base64,...) si salvano con decode_base64_to_file:
+# il marcatore ';base64,' viene cercato per indice e il payload decodificato a blocchi
+# direttamente nel file, senza copie intere della stringa codificata né dei byte decodificati.
+# Le immagini http(s) passano da ImageDownloader (download concorrenti su una sessione
+# condivisa); DeltaFilter mantiene il filtro delta per source anche con esiti in ritardo.
+#
+# ImageStore tiene in memoria i nomi già usati per cartella (niente sondaggi exists() a
+# ogni conflitto) e deduplica per contenuto: lo sha256 dei byte decodificati/scaricati
+# viene calcolato mentre si scrive; un contenuto già salvato in questa esecuzione non
+# viene riscritto ma collegato (hardlink, con ripiego sulla copia) o saltato.
+#
+# Uso: python estrazioneReport.py REPORT.html [--profile linecrossing|linecrossing-bag|calipso]
+#                                 [--source-col 3 --timestamp-col 5 --image-col 10 --delta 30]
+#                                 [--suffix Data_01] [--output CARTELLA] [--dedup link|skip|off]
+
+import os
+import re
+import sys
+import copy
+import json
+import time
+import html
+import hashlib
+import argparse
+import contextlib
+import binascii
+import threading
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from materializza import Materializer
+
+# Blocco di lettura del file HTML (caratteri)
+READ_CHUNK_CHARS = 1 << 20
+# Inizio di un <img> fino all'apertura del valore di src (per i tag lunghi più di un blocco)
+_IMG_SRC_OPEN = re.compile(r'<img\b[^>]*?\ssrc\s*=\s*(["\'])', re.IGNORECASE)
+# Prefisso dei segnaposto con cui i src enormi attraversano HTMLParser
+_SRC_PLACEHOLDER = "\x00src:"
+
+# Blocco di decodifica base64 (caratteri codificati per scrittura, ~768 KB decodificati)
+B64_CHUNK_CHARS = 1 << 20
+BASE64_MARKER = ";base64,"
+# Caratteri che b64decode (non validante) scarta: spazi, a capo, ecc.
+_B64_JUNK = re.compile(r'[^A-Za-z0-9+/=]')
+
+# Deduplica per contenuto delle immagini estratte:
+#   link : il duplicato diventa un hardlink del primo file (un file per occorrenza, zero byte in più)
+#   skip : il duplicato non viene scritto; l'elenco dei salvataggi riporta il primo file
+#   off  : ogni occorrenza viene scritta (comportamento storico)
+DEDUP_MODES = ('link', 'skip', 'off')
+DEFAULT_DEDUP = 'link'
+# Suffisso dei file in scrittura, rinominati a contenuto completo
+PART_SUFFIX = ".part"
+
+
+class ReportRowParser(HTMLParser):
+    """
+    Parser a eventi per le tabelle dei report. Le righe complete si accumulano in
+    self.rows e vanno svuotate dal chiamante dopo ogni feed() (vedi iter_report_rows).
+    Tabelle annidate: le celle vanno alla riga più interna; le righe sono numerate
+    per tabella, nell'ordine in cui si chiudono.
+    I src troppo grandi per passare dalle regex di HTMLParser arrivano con stash_src()
+    e nel tag compare solo un segnaposto.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._table_count = 0
+        # Pila delle tabelle aperte: [idx_tabella, righe_viste, riga_corrente o None, cella_corrente o None]
+        self._tables = []
+        # Testo del nodo corrente: si spezza solo sui tag, non sui blocchi di lettura
+        self._text_node = []
+        self._stash = {}
+
+    def stash_src(self, src):
+        """Conserva src e restituisce il segnaposto da mettere nel tag al suo posto."""
+        key = f"{_SRC_PLACEHOLDER}{len(self._stash)}"
+        self._stash[key] = src
+        return key
+
+    def _flush_text(self):
+        if self._text_node:
+            stripped = ''.join(self._text_node).strip()
+            self._text_node = []
+            if stripped and self._tables and self._tables[-1][3] is not None:
+                self._tables[-1][3]['text'].append(stripped)
+
+    def _close_cell(self, table):
+        cell = table[3]
+        if cell is not None:
+            table[2].append({'text': ''.join(cell['text']), 'imgs': cell['imgs']})
+            table[3] = None
+
+    def _close_row(self, table):
+        self._close_cell(table)
+        if table[2] is not None:
+            table[1] += 1
+            self.rows.append((table[0], table[1], table[2]))
+            table[2] = None
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if tag == 'table':
+            self._table_count += 1
+            self._tables.append([self._table_count, 0, None, None])
+            return
+        if not self._tables:
+            return
+        table = self._tables[-1]
+        if tag == 'tr':
+            self._close_row(table)
+            table[2] = []
+        elif tag in ('td', 'th'):
+            if table[2] is None:
+                table[2] = []       # cella senza <tr> esplicito
+            self._close_cell(table)
+            table[3] = {'text': [], 'imgs': []}
+        elif tag == 'img' and table[3] is not None:
+            src = dict(attrs).get('src')
+            if src is not None and src.startswith(_SRC_PLACEHOLDER):
+                src = self._stash.pop(src, src)
+            table[3]['imgs'].append(src)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if not self._tables:
+            return
+        table = self._tables[-1]
+        if tag in ('td', 'th'):
+            self._close_cell(table)
+        elif tag == 'tr':
+            self._close_row(table)
+        elif tag == 'table':
+            self._close_row(table)
+            self._tables.pop()
+
+    def close(self):
+        super().close()
+        self._flush_text()
+        # Tabelle non chiuse a fine file: consegna le righe rimaste
+        while self._tables:
+            self._close_row(self._tables.pop())
+
+    def handle_data(self, data):
+        if self._tables and self._tables[-1][3] is not None:
+            self._text_node.append(data)
+
+
+def _feed_pending(parser, pending):
+    """
+    Passa al parser i blocchi di un tag lungo (pending[0] comincia con '<'). Se il tag è
+    un <img> lungo più blocchi, il valore di src viene estratto con find() e al parser
+    arriva solo un segnaposto: le regex degli attributi di HTMLParser su decine di MB
+    costano molte copie temporanee della stringa.
+    """
+    if len(pending) == 1:
+        parser.feed(pending[0])
+        return
+    joined = ''.join(pending)
+    pending.clear()
+    match = _IMG_SRC_OPEN.match(joined)
+    if match:
+        value_end = joined.find(match.group(1), match.end())
+        tag_end = joined.find('>', value_end) if value_end >= 0 else -1
+        if tag_end >= 0:
+            src = joined[match.end():value_end]
+            if '&' in src:
+                src = html.unescape(src)
+            parser.feed(f'<img src="{parser.stash_src(src)}">')
+            rest = joined[tag_end + 1:]
+            del joined
+            parser.feed(rest)
+            return
+    parser.feed(joined)
+
+
+def iter_report_rows(file_html, chunk_chars=READ_CHUNK_CHARS):
+    """Genera (idx_tabella, idx_riga, celle) per ogni <tr> del report, a memoria costante."""
+    parser = ReportRowParser()
+    # HTMLParser.feed() riparte dall'inizio di un tag non finito a ogni chiamata: con un
+    # <img src="data:..."> da decine di MB sarebbe quadratico. Il tag rimasto aperto a fine
+    # blocco si accumula qui e va al parser solo quando arriva il suo '>'; il testo prima
+    # del tag va subito. Un '<' o '>' nel testo sposta solo il momento della feed.
+    pending = []        # blocchi di un tag ancora aperto: pending[0] comincia con '<'
+    with open(file_html, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(chunk_chars)
+            if not chunk:
+                break
+            gt = chunk.rfind('>')
+            if pending:
+                if gt < 0:
+                    pending.append(chunk)
+                    continue
+                pending.append(chunk[:gt + 1])
+                _feed_pending(parser, pending)
+                pending = []
+                chunk = chunk[gt + 1:]
+                gt = -1
+            lt = chunk.rfind('<')
+            if lt > gt:
+                pending.append(chunk[lt:])
+                chunk = chunk[:lt]
+            parser.feed(chunk)
+            if parser.rows:
+                rows, parser.rows = parser.rows, []
+                yield from rows
+    if pending:
+        _feed_pending(parser, pending)
+    parser.close()
+    yield from parser.rows
+
+
+def split_data_uri(src):
+    """
+    'data:<mime>;base64,<dati>' -> (mime, indice del primo carattere dei dati);
+    None se src non è un data URI base64. Equivale a re.match(r"data:(.*?);base64,(.*)")
+    senza copiare il payload.
+    """
+    if not src.startswith("data:"):
+        return None
+    marker = src.find(BASE64_MARKER)
+    if marker < 0:
+        return None
+    return src[5:marker], marker + len(BASE64_MARKER)
+
+
+def data_uri_extension(mime_type):
+    """Estensione del file dal tipo MIME ('image/jpeg' -> '.jpeg'), come negli estrattori storici."""
+    return f'.{mime_type.split("/")[-1]}' if '/' in mime_type else '.bin'
+
+
+def _write_block(out, block, hasher):
+    if hasher is not None:
+        hasher.update(block)
+    return out.write(block)
+
+
+def decode_base64_to_file(src, start, path, chunk_chars=B64_CHUNK_CHARS, hasher=None):
+    """
+    Decodifica src[start:] (base64) a blocchi e scrive i byte in path; restituisce i byte scritti.
+    Stessa tolleranza di base64.b64decode: i caratteri fuori dall'alfabeto vengono ignorati,
+    il padding errato solleva binascii.Error. In caso di errore il file parziale viene rimosso.
+    hasher (es. hashlib.sha256()) riceve i byte decodificati man mano.
+    """
+    written = 0
+    carry = ''
+    try:
+        with open(path, "wb") as out:
+            for pos in range(start, len(src), chunk_chars):
+                chunk = src[pos:pos + chunk_chars]
+                if _B64_JUNK.search(chunk):
+                    chunk = _B64_JUNK.sub('', chunk)
+                chunk = carry + chunk
+                # Solo gruppi completi di 4 caratteri: il resto passa al blocco successivo
+                cut = len(chunk) - len(chunk) % 4
+                carry = chunk[cut:]
+                if cut:
+                    written += _write_block(out, binascii.a2b_base64(chunk[:cut]), hasher)
+            if carry:
+                written += _write_block(out, binascii.a2b_base64(carry), hasher)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return written
+
+
+# ----------------------------
+# Nomi univoci e deduplica per contenuto
+# ----------------------------
+
+class ImageStore(object):
+    """
+    Destinazioni delle immagini estratte. reserve() sceglie il nome libero senza toccare
+    il disco (i nomi già presenti in una cartella si leggono una volta sola); write_*()
+    scrivono in un file .part calcolando lo sha256 e commit() lo rende definitivo oppure,
+    se il contenuto è già stato salvato, applica la deduplica. Sicuro tra thread.
+    stats: file scritti, duplicati, byte non riscritti.
+    """
+    def __init__(self, dedup=DEFAULT_DEDUP):
+        if dedup not in DEDUP_MODES:
+            raise ValueError(f"deduplica sconosciuta: {dedup} (valide: {', '.join(DEDUP_MODES)})")
+        self.dedup = dedup
+        self._lock = threading.Lock()
+        self._names = {}        # cartella -> nomi occupati (su disco o prenotati)
+        self._next = {}         # (cartella, base, ext) -> prossimo contatore da provare
+        self._hashes = {}       # sha256 -> percorso del primo file con quel contenuto
+        self._linker = Materializer('hardlink') if dedup == 'link' else None
+        self._linker_lock = threading.Lock()
+        self.stats = {'files': 0, 'duplicates': 0, 'bytes_saved': 0}
+
+    def _folder_names(self, folder):
+        names = self._names.get(folder)
+        if names is None:
+            names = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+            self._names[folder] = names
+        return names
+
+    def reserve(self, folder, base, ext):
+        """Primo percorso libero tra base+ext, base_1+ext, base_2+ext, ... (e lo prenota)."""
+        folder = str(folder)
+        with self._lock:
+            names = self._folder_names(folder)
+            key = (folder, base, ext)
+            counter = self._next.get(key, 0)
+            name = f"{base}{ext}" if counter == 0 else f"{base}_{counter}{ext}"
+            while name in names:
+                counter += 1
+                name = f"{base}_{counter}{ext}"
+            self._next[key] = counter + 1
+            names.add(name)
+        return os.path.join(folder, name)
+
+    def release(self, path):
+        """Libera un nome prenotato e mai scritto (salvataggio fallito o saltato)."""
+        folder, name = os.path.split(str(path))
+        with self._lock:
+            self._folder_names(folder).discard(name)
+            for key in [k for k in self._next if k[0] == folder and name.startswith(k[1])]:
+                del self._next[key]
+
+    def commit(self, part, path, digest, size):
+        """Rende definitivo part in path; restituisce il percorso che contiene il contenuto."""
+        path = str(path)
+        # Il file va al suo posto PRIMA di pubblicare il digest: un duplicato concorrente
+        # che trova il digest nell'indice trova anche il file da collegare
+        os.replace(part, path)
+        with self._lock:
+            existing = self._hashes.get(digest) if self.dedup != 'off' else None
+            if existing is None:
+                self._hashes[digest] = path
+                self.stats['files'] += 1
+                return path
+            self.stats['duplicates'] += 1
+            self.stats['bytes_saved'] += size
+        if self.dedup == 'skip':
+            os.remove(path)
+            self.release(path)
+            return existing
+        # Materializer non è thread-safe (stats, ripieghi): un collegamento alla volta
+        with self._linker_lock:
+            self._linker(existing, path)
+        return path
+
+    def write_data_uri(self, src, start, path):
+        """Decodifica il payload base64 di src in path (con deduplica)."""
+        part = f"{path}{PART_SUFFIX}"
+        hasher = hashlib.sha256()
+        size = decode_base64_to_file(src, start, part, hasher=hasher)
+        return self.commit(part, path, hasher.hexdigest(), size)
+
+    def write_stream(self, chunks, path):
+        """Scrive in path i blocchi di byte di un iterabile (download, file locale) con deduplica."""
+        part = f"{path}{PART_SUFFIX}"
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(part, "wb") as out:
+                for chunk in chunks:
+                    size += _write_block(out, chunk, hasher)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        return self.commit(part, path, hasher.hexdigest(), size)
+
+    def copy_file(self, local_path, path):
+        with open(local_path, "rb") as in_f:
+            return self.write_stream(iter(lambda: in_f.read(DOWNLOAD_CHUNK_BYTES), b''), path)
+
+    def summary(self):
+        """Riga di riepilogo della deduplica."""
+        return (f"Deduplica ({self.dedup}): {self.stats['files']} file unici, {self.stats['duplicates']} duplicati, "
+                f"{self.stats['bytes_saved'] / (1024 * 1024):.1f} MB non riscritti")
+
+    def close(self):
+        if self._linker is not None:
+            with self._linker_lock:
+                self._linker.close()
+
+
+# ----------------------------
+# Download concorrente delle immagini remote
+# ----------------------------
+
+# Download simultanei in totale e per singolo host
+DOWNLOAD_WORKERS = 16
+DOWNLOAD_PER_HOST = 4
+# Download accodati oltre quelli in corso: oltre questo numero submit() aspetta
+DOWNLOAD_QUEUE_FACTOR = 4
+# Tentativi aggiuntivi per errori transitori (connessione, timeout, 429, 5xx), attesa raddoppiata ogni volta
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 0.5
+DOWNLOAD_TIMEOUT = 10
+DOWNLOAD_CHUNK_BYTES = 1 << 16
+
+
+class ImageDownloader(object):
+    """
+    Scarica le immagini http(s) in parallelo su una requests.Session condivisa (connessioni
+    riusate), con un limite di download simultanei per host, nuovi tentativi con attesa
+    crescente e scrittura a blocchi tramite ImageStore (file .part, sha256 e deduplica).
+    submit() restituisce un Future che vale il percorso salvato o solleva l'errore finale;
+    la destinazione va prenotata con store.reserve() e, se il download fallisce, viene liberata.
+    """
+    def __init__(self, store=None, workers=DOWNLOAD_WORKERS, per_host=DOWNLOAD_PER_HOST, retries=DOWNLOAD_RETRIES,
+                 backoff=DOWNLOAD_BACKOFF, timeout=DOWNLOAD_TIMEOUT, session=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        self.store = store if store is not None else ImageStore('off')
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=per_host)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers * DOWNLOAD_QUEUE_FACTOR)
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.stats = {'downloaded': 0, 'failed': 0, 'retries': 0, 'bytes': 0}
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.Semaphore(self.per_host)
+            return self._hosts[host]
+
+    def _is_transient(self, e):
+        # ChunkedEncodingError/ContentDecodingError: connessione caduta a metà corpo (lettura incompleta)
+        exceptions = self._requests.exceptions
+        if isinstance(e, (exceptions.ConnectionError, exceptions.Timeout,
+                          exceptions.ChunkedEncodingError, exceptions.ContentDecodingError)):
+            return True
+        response = getattr(e, 'response', None)
+        return response is not None and (response.status_code == 429 or response.status_code >= 500)
+
+    def _fetch(self, url, path):
+        with self.session.get(url, timeout=self.timeout, stream=True) as r:
+            r.raise_for_status()
+            saved = self.store.write_stream(r.iter_content(DOWNLOAD_CHUNK_BYTES), path)
+        return saved, os.path.getsize(saved)
+
+    def _download(self, url, path):
+        host_semaphore = self._host_semaphore(url)
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    with host_semaphore:
+                        saved, size = self._fetch(url, path)
+                    with self._lock:
+                        self.stats['downloaded'] += 1
+                        self.stats['bytes'] += size
+                    return saved
+                except (self._requests.RequestException, OSError) as e:
+                    if attempt == self.retries or not self._is_transient(e):
+                        with self._lock:
+                            self.stats['failed'] += 1
+                        self.store.release(path)
+                        print(f"Errore nel salvataggio di {url}: {e}")
+                        raise
+                    with self._lock:
+                        self.stats['retries'] += 1
+                # Attesa fuori dal semaforo: l'host resta disponibile per gli altri download
+                time.sleep(self.backoff * (2 ** attempt))
+        finally:
+            self._slots.release()
+
+    def submit(self, url, path):
+        """Accoda il download di url in path (aspetta se la coda è piena)."""
+        self._slots.acquire()
+        return self._executor.submit(self._download, url, path)
+
+    def close(self):
+        """Aspetta i download in corso e chiude le connessioni."""
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+
+def download_succeeded(future):
+    """True se il Future di ImageDownloader.submit si è concluso senza errori (aspetta la fine)."""
+    return future.exception() is None
+
+
+class DeltaFilter(object):
+    """
+    Filtro "delta minimo per source" degli estrattori con salvataggi che si concludono
+    in ritardo (download concorrenti). Il timestamp di riferimento di una source è quello
+    dell'ultima riga (in ordine di report) che ha salvato almeno un'immagine, come nel
+    ciclo seriale. Le righe con download ancora in corso restano in sospeso; si aspetta
+    il loro esito solo se cambierebbe la decisione sulla riga corrente.
+    """
+    def __init__(self, min_delta):
+        self.min_delta = min_delta
+        self.last_saved = {}
+        self._pending = {}      # source -> [(timestamp, [future, ...]), ...] in ordine di riga
+
+    def _passes(self, last_ts, current):
+        return last_ts is None or abs(current - last_ts) >= self.min_delta
+
+    def _resolve(self, source):
+        for ts, futures in self._pending.pop(source, []):
+            if any([download_succeeded(f) for f in futures]):
+                self.last_saved[source] = ts
+
+    def check(self, source, current):
+        """(salva, timestamp di confronto o None) per una riga con timestamp valido."""
+        pending = self._pending.get(source)
+        if pending:
+            candidates = [self.last_saved.get(source)] + [ts for ts, _ in pending]
+            if len({self._passes(ts, current) for ts in candidates}) > 1:
+                self._resolve(source)
+            else:
+                last_ts = candidates[-1]
+                return self._passes(last_ts, current), last_ts
+        last_ts = self.last_saved.get(source)
+        return self._passes(last_ts, current), last_ts
+
+    def record(self, source, current, saved_something, futures=()):
+        """Registra l'esito di una riga: salvataggi già conclusi e download ancora in corso."""
+        if current is None:
+            return
+        if saved_something:
+            # Riga più recente già salvata: le righe in sospeso precedenti non contano più
+            self._pending.pop(source, None)
+            self.last_saved[source] = current
+        elif futures:
+            self._pending.setdefault(source, []).append((current, list(futures)))
+
+
+# ----------------------------
+# Profili dei report e motore di estrazione
+# ----------------------------
+
+# Formati del timestamp provati in ordine
+TIMESTAMP_FORMATS = (
+    "%Y/%m/%d %H:%M:%S",        # Es. 2025/11/05 17:41:05
+    "%Y-%m-%d %H:%M:%S.%f",     # Con millisecondi
+    "%Y-%m-%d %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S",
+    "%d-%m-%Y %H:%M:%S",
+    "%m/%d/%Y %I:%M:%S %p",
+)
+
+# Layout dei nomi file: (modello, sovrascrivi)
+#   source_timestamp : {source}_{AAAAmmgg_HHMMSS o NoTS}_{n immagine}; se il nome esiste si aggiunge _1, _2, ...
+#   table_row        : tab{tabella}_row{riga}_img{n immagine}; un file esistente viene sovrascritto
+LAYOUTS = {
+    'source_timestamp': ("{source}_{timestamp}_{img}", False),
+    'table_row': ("tab{table}_row{row}_img{img}", True),
+}
+
+
+def parse_timestamp(timestamp_str, formats=TIMESTAMP_FORMATS):
+    """Prima interpretazione valida di timestamp_str tra i formati dati; None se nessuno va bene."""
+    cleaned_str = timestamp_str.strip()
+    for fmt in formats:
+        try:
+            return datetime.strptime(cleaned_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class ReportProfile(object):
+    """
+    Come leggere un tipo di report. Colonne con indici da 0 (None = assente); il filtro
+    delta (secondi, None = nessun filtro) richiede source e timestamp. output_folder è
+    relativo alla cartella dell'HTML o, con output_base='cwd', alla cartella corrente;
+    '{suffisso}' viene sostituito con il suffisso scelto dall'utente.
+    """
+    def __init__(self, name, image_col=None, source_col=None, timestamp_col=None,
+                 timestamp_formats=TIMESTAMP_FORMATS, delta_seconds=None, layout='source_timestamp',
+                 output_folder="V_{suffisso}", output_base='html'):
+        self.name = name
+        self.image_col = image_col
+        self.source_col = source_col
+        self.timestamp_col = timestamp_col
+        self.timestamp_formats = tuple(timestamp_formats)
+        self.delta_seconds = delta_seconds
+        self.layout = layout
+        self.output_folder = output_folder
+        self.output_base = output_base
+
+    def with_options(self, **options):
+        """Copia del profilo con alcuni campi cambiati (i None lasciano il valore del profilo)."""
+        profile = copy.copy(self)
+        for key, value in options.items():
+            if not hasattr(profile, key):
+                raise TypeError(f"opzione di profilo sconosciuta: {key}")
+            if value is not None:
+                setattr(profile, key, value)
+        return profile
+
+    def validate(self):
+        if self.image_col is None:
+            raise ValueError(f"profilo '{self.name}': manca la colonna immagine")
+        if self.delta_seconds is not None and (self.source_col is None or self.timestamp_col is None):
+            raise ValueError(f"profilo '{self.name}': il filtro delta richiede le colonne source e timestamp")
+        if self.layout not in LAYOUTS:
+            raise ValueError(f"profilo '{self.name}': layout sconosciuto {self.layout} (validi: {', '.join(LAYOUTS)})")
+        if self.output_base not in ('html', 'cwd'):
+            raise ValueError(f"profilo '{self.name}': output_base deve essere 'html' o 'cwd'")
+
+    def output_path(self, file_html, suffisso=""):
+        folder = self.output_folder.format(suffisso=suffisso)
+        if self.output_base == 'cwd':
+            return folder
+        return os.path.join(os.path.dirname(file_html), folder)
+
+    def columns(self):
+        return [c for c in (self.source_col, self.timestamp_col, self.image_col) if c is not None]
+
+
+# Profili dei report noti
+PROFILES = {
+    # Report veicoli linecrossing: colonne scelte dall'utente, filtro delta per source,
+    # immagini in V_<suffisso> accanto al report con nome source_timestamp
+    'linecrossing': ReportProfile('linecrossing', delta_seconds=0),
+    # Estrattore storico "bag" dei report linecrossing: 10ª colonna, ./bag
+    'linecrossing-bag': ReportProfile('linecrossing-bag', image_col=9, layout='table_row',
+                                      output_folder="bag", output_base='cwd'),
+    # Report bag Calipso: 11ª colonna, ./bag
+    'calipso': ReportProfile('calipso', image_col=10, layout='table_row',
+                             output_folder="bag", output_base='cwd'),
+}
+
+
+def extract_images(file_html, profile, output_folder, dedup=DEFAULT_DEDUP,
+                   workers=DOWNLOAD_WORKERS, per_host=DOWNLOAD_PER_HOST):
+    """
+    Estrae le immagini della colonna profile.image_col di ogni riga del report in output_folder.
+    Restituisce (percorsi salvati nell'ordine del report, statistiche). Le immagini base64 sono
+    decodificate a blocchi, quelle http(s) scaricate in parallelo, i contenuti ripetuti deduplicati.
+    """
+    profile.validate()
+    template, overwrite = LAYOUTS[profile.layout]
+    min_delta = timedelta(seconds=profile.delta_seconds) if profile.delta_seconds is not None else None
+    filtro_delta = DeltaFilter(min_delta) if min_delta is not None else None
+    max_col = max(profile.columns())
+    stats = {'rows': 0, 'filtered': 0, 'saved': 0, 'errors': 0, 'read_error': None}
+
+    os.makedirs(output_folder, exist_ok=True)
+    html_dir = os.path.dirname(file_html)
+    store = ImageStore(dedup)
+    downloader = ImageDownloader(store, workers=workers, per_host=per_host)
+    immagini_salvate = []
+
+    def destinazione(base, ext):
+        if overwrite:
+            return os.path.join(output_folder, f"{base}{ext}")
+        return store.reserve(output_folder, base, ext)
+
+    def libera(path):
+        if not overwrite:
+            store.release(path)
+
+    try:
+        for idx_tabella, idx_riga, celle in iter_report_rows(file_html):
+            if len(celle) <= max_col:
+                continue
+            stats['rows'] += 1
+
+            source_key = ""
+            if profile.source_col is not None:
+                # Chiave per il registro e per i nomi: source pulita
+                source_key = re.sub(r'[<>:"/\\|?*]', '_', celle[profile.source_col]['text'])
+
+            current_datetime = None
+            if profile.timestamp_col is not None:
+                timestamp_str = celle[profile.timestamp_col]['text']
+                current_datetime = parse_timestamp(timestamp_str, profile.timestamp_formats)
+                if current_datetime is None and filtro_delta is not None:
+                    print(f"⚠️ Avviso: Timestamp non valido '{timestamp_str}' in riga {idx_riga}. Salto il controllo delta.")
+
+            # Filtro delta per source (distanza assoluta dall'ultimo timestamp salvato)
+            if filtro_delta is not None and current_datetime:
+                passa_delta, last_ts = filtro_delta.check(source_key, current_datetime)
+                if not passa_delta:
+                    abs_time_delta = abs(current_datetime - last_ts)
+                    print(f"➖ Filtrata riga {idx_riga} ({source_key}): Delta ({abs_time_delta.total_seconds():.0f}s) < {profile.delta_seconds}s.")
+                    stats['filtered'] += 1
+                    continue
+
+            timestamp_nome_file = current_datetime.strftime("%Y%m%d_%H%M%S") if current_datetime else "NoTS"
+            saved_something = False
+            download_riga = []
+
+            for idx_img, src in enumerate(celle[profile.image_col]['imgs'], start=1):
+                if not src:
+                    continue
+                nome_file_base = template.format(source=source_key, timestamp=timestamp_nome_file, img=idx_img,
+                                                 table=idx_tabella, row=idx_riga)
+                saved_path = None
+
+                # Immagine incorporata (base64)
+                if src.startswith("data:"):
+                    data_uri = split_data_uri(src)
+                    if not data_uri:
+                        print(f"Avviso: Formato 'data:' non riconosciuto per l'immagine {idx_img} in riga {idx_riga}")
+                        continue
+                    mime_type, inizio_dati = data_uri
+                    path_salvataggio = destinazione(nome_file_base, data_uri_extension(mime_type))
+                    try:
+                        saved_path = store.write_data_uri(src, inizio_dati, path_salvataggio)
+                    except Exception as e:
+                        libera(path_salvataggio)
+                        stats['errors'] += 1
+                        print(f"Errore nella decodifica Base64 per l'immagine {idx_img} in riga {idx_riga}: {e}")
+
+                # URL remoto o percorso locale relativo al report
+                else:
+                    img_url = urljoin("file:///" + os.path.abspath(file_html), src)
+                    path_salvataggio = destinazione(nome_file_base, os.path.splitext(src)[1] or '.jpg')
+                    try:
+                        if img_url.startswith(("http", "https")):
+                            # Download in background: l'esito arriva con il Future
+                            futuro = downloader.submit(img_url, path_salvataggio)
+                            download_riga.append(futuro)
+                            immagini_salvate.append(futuro)
+                            continue
+                        elif img_url.startswith("file:///"):
+                            local_path = os.path.join(html_dir, src)
+                            if not os.path.exists(local_path):
+                                print(f"Avviso: File locale non trovato a {local_path}")
+                                libera(path_salvataggio)
+                                continue
+                            saved_path = store.copy_file(local_path, path_salvataggio)
+                        else:
+                            print(f"Avviso: Schema URL non supportato per {img_url}")
+                            libera(path_salvataggio)
+                            continue
+                    except Exception as e:
+                        libera(path_salvataggio)
+                        stats['errors'] += 1
+                        print(f"Errore nel salvataggio di {src}: {e}")
+
+                if saved_path:
+                    immagini_salvate.append(saved_path)
+                    saved_something = True
+
+            # Il timestamp si registra solo se la riga ha salvato qualcosa
+            # (con download in corso la riga resta in sospeso fino al loro esito)
+            if filtro_delta is not None:
+                filtro_delta.record(source_key, current_datetime, saved_something, download_riga)
+
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Errore durante la lettura del file HTML: {e}")
+        stats['read_error'] = str(e)
+    finally:
+        downloader.close()
+        store.close()
+
+    # Download falliti: già segnalati dal downloader, non compaiono nell'elenco
+    paths = [str(item.result()) if isinstance(item, Future) else item
+             for item in immagini_salvate
+             if not isinstance(item, Future) or download_succeeded(item)]
+    stats['saved'] = len(paths)
+    stats['errors'] += downloader.stats['failed']
+    stats['dedup'] = dict(store.stats, mode=store.dedup)
+    stats['download'] = dict(downloader.stats)
+    print(store.summary())
+    return paths, stats
+
+
+def _column(value):
+    """Colonna da riga di comando: numero da 1 -> indice da 0."""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError("le colonne si contano da 1")
+    return number - 1
+
+
+def main(argv=None):
+    """
+    Estrazione da riga di comando. Codici di uscita: 0 tutto ok, 1 report illeggibile o
+    parametri non validi, 2 estrazione completata ma con immagini non salvate.
+    """
+    parser = argparse.ArgumentParser(description="Estrazione delle immagini dai report HTML (linecrossing, calipso)")
+    parser.add_argument("report", help="file HTML del report")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default='linecrossing')
+    parser.add_argument("--source-col", type=_column, default=None, help="colonna della source (da 1)")
+    parser.add_argument("--timestamp-col", type=_column, default=None, help="colonna data/ora (da 1)")
+    parser.add_argument("--image-col", type=_column, default=None, help="colonna delle immagini (da 1)")
+    parser.add_argument("--delta", type=int, default=None, help="delta minimo in secondi tra immagini della stessa source")
+    parser.add_argument("--no-delta", action="store_true", help="disattiva il filtro delta del profilo")
+    parser.add_argument("--timestamp-format", action="append", default=None,
+                        help="formato strptime del timestamp (ripetibile; sostituisce quelli predefiniti)")
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default=None)
+    parser.add_argument("--suffix", default="", help="sostituisce {suffisso} nella cartella di output del profilo")
+    parser.add_argument("--output", default=None, help="cartella di output (default: quella del profilo)")
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default=DEFAULT_DEDUP)
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS, help="download simultanei")
+    parser.add_argument("--per-host", type=int, default=DOWNLOAD_PER_HOST, help="download simultanei per host")
+    parser.add_argument("--stats-json", default=None, help="file in cui scrivere le statistiche JSON ('-' = stdout)")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.per_host < 1:
+        parser.error("--workers e --per-host devono essere >= 1")
+
+    profile = PROFILES[args.profile].with_options(
+        source_col=args.source_col, timestamp_col=args.timestamp_col, image_col=args.image_col,
+        delta_seconds=args.delta, layout=args.layout, timestamp_formats=args.timestamp_format)
+    if args.no_delta:
+        profile.delta_seconds = None
+    try:
+        profile.validate()
+    except ValueError as e:
+        parser.error(str(e))
+    output_folder = args.output or profile.output_path(args.report, args.suffix)
+
+    # Con le statistiche JSON su stdout, i messaggi di avanzamento vanno su stderr
+    with contextlib.redirect_stdout(sys.stderr) if args.stats_json == '-' else contextlib.nullcontext():
+        print(f"Estrazione '{profile.name}' da {args.report} in {output_folder}...")
+        paths, stats = extract_images(args.report, profile, output_folder, dedup=args.dedup,
+                                      workers=args.workers, per_host=args.per_host)
+        print(f"Immagini salvate: {stats['saved']} (righe lette {stats['rows']}, filtrate {stats['filtered']}, errori {stats['errors']})")
+
+    if args.stats_json:
+        payload = json.dumps(dict(stats, profile=profile.name, output=output_folder), indent=2, ensure_ascii=False)
+        if args.stats_json == '-':
+            print(payload)
+        else:
+            with open(args.stats_json, "w", encoding="utf-8") as f:
+                f.write(payload + "\n")
+
+    if stats['read_error']:
+        return 1
+    return 2 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
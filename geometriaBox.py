@@ -0,0 +1,160 @@
+# geometriaBox.py - GEOMETRIA DEI BOUNDING BOX (NUMPY)
+#
+# Funzioni condivise da annotatore e post-analisi. I box sono righe [x1, y1, x2, y2]
+# di un array (N, 4): int32 se le coordinate sono intere, float64 altrimenti.
+# Le formule sono quelle storiche su coordinate grezze (nessuna normalizzazione
+# implicita): chi vuole x1 <= x2 e y1 <= y2 chiama prima normalize_boxes.
+
+import numpy as np
+
+
+# ----------------------------
+# Conversioni
+# ----------------------------
+
+def as_boxes(boxes):
+    """
+    Converte in array (N, 4). Accetta liste di [x1, y1, x2, y2], dict con 'coords'
+    o un array già pronto. Coordinate intere -> int32, altrimenti float64.
+    """
+    if isinstance(boxes, np.ndarray):
+        arr = boxes
+    else:
+        rows = [b['coords'] if isinstance(b, dict) else b for b in boxes]
+        if not rows:
+            return np.zeros((0, 4), dtype=np.int32)
+        arr = np.asarray(rows)
+    arr = arr.reshape(-1, 4)
+    if np.issubdtype(arr.dtype, np.integer):
+        return arr.astype(np.int32, copy=False)
+    return arr.astype(np.float64, copy=False)
+
+
+def _wide(boxes):
+    """Copia di lavoro senza rischio di overflow (aree di box int32 grandi)."""
+    boxes = as_boxes(boxes)
+    if np.issubdtype(boxes.dtype, np.integer):
+        return boxes.astype(np.int64)
+    return boxes
+
+
+def normalize_boxes(boxes):
+    """Riordina ogni box in modo che x1 <= x2 e y1 <= y2 (box disegnati 'al contrario')."""
+    boxes = as_boxes(boxes)
+    out = np.empty_like(boxes)
+    np.minimum(boxes[:, 0], boxes[:, 2], out=out[:, 0])
+    np.minimum(boxes[:, 1], boxes[:, 3], out=out[:, 1])
+    np.maximum(boxes[:, 0], boxes[:, 2], out=out[:, 2])
+    np.maximum(boxes[:, 1], boxes[:, 3], out=out[:, 3])
+    return out
+
+
+def clip_boxes(boxes, width, height):
+    """Limita le coordinate all'immagine: x in [0, width], y in [0, height]."""
+    boxes = as_boxes(boxes)
+    out = boxes.copy()
+    out[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+    out[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+    return out
+
+
+# ----------------------------
+# Misure
+# ----------------------------
+
+def box_areas(boxes):
+    """Area (x2 - x1) * (y2 - y1) su coordinate grezze: negativa se il box è invertito su un solo asse."""
+    b = _wide(boxes)
+    return (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+
+
+def box_centers(boxes):
+    """Centri (N, 2) in float64."""
+    b = _wide(boxes).astype(np.float64)
+    return np.stack([(b[:, 0] + b[:, 2]) / 2, (b[:, 1] + b[:, 3]) / 2], axis=1)
+
+
+def box_diagonals(boxes):
+    """Lunghezza della diagonale di ogni box."""
+    b = _wide(boxes).astype(np.float64)
+    return np.sqrt((b[:, 2] - b[:, 0]) ** 2 + (b[:, 3] - b[:, 1]) ** 2)
+
+
+# ----------------------------
+# IoU
+# ----------------------------
+
+def iou(boxA, boxB):
+    """IoU di due box singoli (Python puro, per confronti occasionali). 0.0 se l'unione è <= 0."""
+    xA = max(boxA[0], boxB[0])
+    yA = max(boxA[1], boxB[1])
+    xB = min(boxA[2], boxB[2])
+    yB = min(boxA[3], boxB[3])
+
+    inter_area = max(0, xB - xA) * max(0, yB - yA)
+    boxA_area = (boxA[2] - boxA[0]) * (boxA[3] - boxA[1])
+    boxB_area = (boxB[2] - boxB[0]) * (boxB[3] - boxB[1])
+    union_area = float(boxA_area + boxB_area - inter_area)
+
+    if union_area <= 0:
+        return 0.0
+    return inter_area / union_area
+
+
+def iou_matrix(boxes_a, boxes_b=None):
+    """
+    Matrice (N, M) delle IoU tra ogni box di boxes_a e ogni box di boxes_b
+    (boxes_b=None: tra i box di boxes_a). Stessa formula di iou(): dove l'unione
+    è <= 0 (box degeneri) il risultato è 0.0 invece di una divisione per zero.
+    """
+    a = _wide(boxes_a)
+    b = a if boxes_b is None else _wide(boxes_b)
+
+    inter_w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    inter_h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.maximum(inter_w, 0) * np.maximum(inter_h, 0)
+
+    union = (box_areas(a)[:, None] + box_areas(b)[None, :] - inter).astype(np.float64)
+    out = np.zeros(union.shape, dtype=np.float64)
+    np.divide(inter, union, out=out, where=union > 0)
+    return out
+
+
+# ----------------------------
+# Distanze e contenimento
+# ----------------------------
+
+def center_distance_matrix(boxes_a, boxes_b=None, squared=False):
+    """Distanza (o distanza al quadrato) tra i centri di ogni coppia di box."""
+    ca = box_centers(boxes_a)
+    cb = ca if boxes_b is None else box_centers(boxes_b)
+    dx = ca[:, None, 0] - cb[None, :, 0]
+    dy = ca[:, None, 1] - cb[None, :, 1]
+    dist_sq = dx ** 2 + dy ** 2
+    return dist_sq if squared else np.sqrt(dist_sq)
+
+
+def centers_close_matrix(boxes_a, boxes_b=None, max_distance_factor=0.25):
+    """
+    True dove i centri distano meno di max_distance_factor volte la diagonale
+    del più piccolo dei due box (criterio 'is_center_close' della post-analisi).
+    """
+    dist_sq = center_distance_matrix(boxes_a, boxes_b, squared=True)
+    da = box_diagonals(boxes_a)
+    db = da if boxes_b is None else box_diagonals(boxes_b)
+    max_dist_sq = (np.minimum(da[:, None], db[None, :]) * max_distance_factor) ** 2
+    return dist_sq < max_dist_sq
+
+
+def contains_matrix(outer, inner):
+    """(N, M) True dove il box outer[i] contiene interamente inner[j] (bordi inclusi, box normalizzati)."""
+    o = normalize_boxes(outer)
+    i = normalize_boxes(inner)
+    return ((o[:, None, 0] <= i[None, :, 0]) & (o[:, None, 1] <= i[None, :, 1]) &
+            (o[:, None, 2] >= i[None, :, 2]) & (o[:, None, 3] >= i[None, :, 3]))
+
+
+def boxes_containing_point(boxes, x, y):
+    """Maschera (N,) dei box (normalizzati) che contengono il punto (x, y), bordi inclusi."""
+    b = normalize_boxes(boxes)
+    return (b[:, 0] <= x) & (x <= b[:, 2]) & (b[:, 1] <= y) & (y <= b[:, 3])
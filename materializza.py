@@ -0,0 +1,178 @@
+# materializza.py - MATERIALIZZAZIONE DELLE IMMAGINI NELLE CARTELLE DI OUTPUT
+#
+# Tutte le fasi (estraibindingbox, pipelineEstraiBB, postanalisi*) mettono le immagini
+# nelle cartelle di destinazione passando da qui invece che da shutil.copy2.
+# Modalità:
+#   copy     : copia completa (comportamento storico)
+#   hardlink : stesso file su disco, zero byte in più (solo stesso filesystem)
+#   reflink  : copia copy-on-write (FICLONE su Linux: btrfs, XFS, ...)
+#   symlink  : collegamento simbolico al percorso assoluto del sorgente
+#   virtual  : nessun file, solo una riga in _sorgenti.jsonl nella cartella di destinazione
+#              (una per nome di file: una nuova esecuzione sostituisce le righe vecchie)
+# Se la modalità scelta non è possibile (filesystem diversi, reflink non supportato,
+# symlink senza privilegi) si ripiega sulla copia; il ripiego viene ricordato per
+# coppia (dispositivo sorgente, cartella destinazione) per non ritentare a ogni file.
+# I .json affiancati restano sempre file veri: l'annotatore li riscrive.
+# Ogni modalità crea prima un file temporaneo e poi lo sposta su dst (os.replace): un
+# dst esistente viene sostituito solo a materializzazione riuscita.
+
+import os
+import sys
+import json
+import errno
+import shutil
+
+MODES = ('copy', 'hardlink', 'reflink', 'symlink', 'virtual')
+DEFAULT_MODE = 'copy'
+
+# Nome del file che, in modalità virtual, elenca per ogni immagine il file sorgente
+VIRTUAL_MANIFEST_FILENAME = "_sorgenti.jsonl"
+
+# ioctl FICLONE di Linux (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflink non supportato su questa piattaforma")
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _place(make, src, dst):
+    """
+    Crea dst con make(src, nome_temporaneo) e poi lo sposta su dst con os.replace: un dst
+    esistente (anche link o symlink allo stesso sorgente di un'esecuzione precedente) viene
+    sostituito solo se il nuovo file è stato creato, e copy2 non scrive mai attraverso un
+    symlink né fallisce con SameFileError.
+    """
+    tmp = f"{dst}.materializza.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        make(src, tmp)
+        os.replace(tmp, dst)
+        # Se tmp e dst sono già lo stesso file (hardlink di un'esecuzione precedente)
+        # rename() non fa nulla e tmp resta: va tolto a mano
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+
+def _read_virtual_manifest(path):
+    """Righe già presenti in _sorgenti.jsonl come {file: source}; le righe illeggibili si scartano."""
+    sources = {}
+    if not os.path.exists(path):
+        return sources
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+                name, source = item['file'], item['source']
+            except (ValueError, TypeError, KeyError):
+                continue
+            sources.pop(name, None)
+            sources[name] = source
+    return sources
+
+
+class Materializer(object):
+    """
+    Mette src in dst secondo la modalità scelta e tiene il conto di cosa è stato fatto.
+    stats: numero di file per modalità effettiva, ripieghi sulla copia e byte non copiati.
+    """
+    def __init__(self, mode=DEFAULT_MODE):
+        if mode not in MODES:
+            raise ValueError(f"modalità di materializzazione sconosciuta: {mode} (valide: {', '.join(MODES)})")
+        self.mode = mode
+        self.stats = {'mode': mode, 'files': {m: 0 for m in MODES}, 'fallbacks': 0, 'bytes_saved': 0}
+        self._unsupported = set()     # (st_dev sorgente, cartella destinazione) dove la modalità non va
+        self._virtual_files = {}      # cartella destinazione -> (file _sorgenti.jsonl aperto, {file: source})
+
+    @property
+    def writes_files(self):
+        """False in modalità virtual: a destinazione non compare nessuna immagine."""
+        return self.mode != 'virtual'
+
+    def __call__(self, src, dst):
+        """Materializza src in dst. Restituisce la modalità effettivamente usata."""
+        if self.mode == 'copy':
+            _place(shutil.copy2, src, dst)
+            return self._count('copy', src, saved=False)
+
+        if self.mode == 'virtual':
+            self._write_virtual(src, dst)
+            return self._count('virtual', src, saved=True)
+
+        dst_dir = os.path.dirname(os.path.abspath(dst))
+        key = (os.stat(src).st_dev, dst_dir)
+        if key not in self._unsupported:
+            try:
+                make = {'hardlink': os.link, 'reflink': _reflink, 'symlink': _symlink}[self.mode]
+                _place(make, src, dst)
+                return self._count(self.mode, src, saved=True)
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.EACCES):
+                    raise
+                # EXDEV (filesystem diversi), EOPNOTSUPP/EINVAL (reflink), EPERM (symlink su Windows), ...
+                print(f"    Materializzazione '{self.mode}' non possibile verso {dst_dir} ({e}); uso la copia.")
+                self._unsupported.add(key)
+
+        self.stats['fallbacks'] += 1
+        _place(shutil.copy2, src, dst)
+        return self._count('copy', src, saved=False)
+
+    def _count(self, mode, src, saved):
+        self.stats['files'][mode] += 1
+        if saved:
+            self.stats['bytes_saved'] += os.path.getsize(src)
+        return mode
+
+    def _write_virtual(self, src, dst):
+        dst_dir = os.path.dirname(os.path.abspath(dst))
+        entry = self._virtual_files.get(dst_dir)
+        if entry is None:
+            path = os.path.join(dst_dir, VIRTUAL_MANIFEST_FILENAME)
+            entry = (open(path, 'a', encoding='utf-8'), _read_virtual_manifest(path))
+            self._virtual_files[dst_dir] = entry
+        f, sources = entry
+        name, source = os.path.basename(dst), os.path.abspath(src)
+        sources.pop(name, None)       # l'ultima versione va in fondo, come in append
+        sources[name] = source
+        # La riga si aggiunge subito (un'interruzione non perde nulla); i doppioni
+        # delle esecuzioni precedenti spariscono quando close() riscrive il file
+        f.write(json.dumps({'file': name, 'source': source}, ensure_ascii=False) + "\n")
+
+    def close(self):
+        for dst_dir, (f, sources) in self._virtual_files.items():
+            f.close()
+            path = os.path.join(dst_dir, VIRTUAL_MANIFEST_FILENAME)
+            tmp = f"{path}.materializza.tmp"
+            with open(tmp, 'w', encoding='utf-8') as out:
+                for name, source in sources.items():
+                    out.write(json.dumps({'file': name, 'source': source}, ensure_ascii=False) + "\n")
+            os.replace(tmp, path)
+        self._virtual_files = {}
+
+
+def materialize(src, dst, mode=DEFAULT_MODE):
+    """Scorciatoia per un singolo file (senza statistiche né memoria dei ripieghi)."""
+    materializer = Materializer(mode)
+    try:
+        return materializer(src, dst)
+    finally:
+        materializer.close()
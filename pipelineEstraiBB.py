@@ -2,130 +2,382 @@
 
 import os
 import sys
+import json
+import time
+import argparse
+import contextlib
 import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import tkinter as tk
+from tkinter import filedialog
 
 # Importa le funzioni dagli script, assumendo che siano nello stesso percorso
 try:
-    from estraibindingbox import process_images_in_folder 
-    from postanalisiMotoCompleto import process_images_recursively_moto, show_stats_dialog
+    from estraibindingbox import (detect_and_sort, save_metadata, target_folder_name,
+                                  VEHICLE_CLASS_MAP, MODEL_PATH, BATCH_SIZE, DECODE_WORKERS)
+    from postanalisiMotoCompleto import merge_boxes, show_stats_dialog, process_images_recursively_moto
     from postanalisiAltroCompleto import process_images_recursively_altro
+    from rilevatori import BACKENDS, DEFAULT_BACKEND
+    from materializza import Materializer, MODES as MATERIALIZE_MODES, DEFAULT_MODE as MATERIALIZE_MODE
 except ImportError as e:
     print(f"Errore di importazione: Assicurati che 'estraibindingbox.py', 'postanalisiMotoCompleto.py' e 'postanalisiAltroCompleto.py' siano nella stessa directory.")
     print(f"Dettagli: {e}")
     sys.exit(1)
 
 
-def run_full_pipeline():
+# Parametri di default della post-analisi (sovrascrivibili da riga di comando)
+POST_ANALYSIS_DIRNAME = "post_analisi"
+IOU_THRESH = 0.12
+CENTER_FACTOR = 0.25
+# Classi YOLO la cui cartella passa dalla post-analisi con fusione BB;
+# tutte le altre cartelle di classe vengono scritte senza fusione.
+MERGE_CLASSES = ('motorcycle',)
+# Processi per la post-analisi a cartelle (--post-only): una classe per processo
+POST_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+
+class PostAnalysisSink(object):
     """
-    Esegue la pipeline completa (NON salva immagini annotate).
+    Post-analisi in streaming: riceve da detect_and_sort i BB di ogni immagine appena
+    rilevata e scrive immagine (secondo il Materializer) e .json finale una sola volta in post_analisi/<Classe>
+    (con fusione BB per le cartelle delle MERGE_CLASSES). Sostituisce il giro
+    cartella di classe -> rilettura .json -> seconda copia delle vecchie Fasi 2 e 3.
+    Le immagini senza BB vanno in no_vehicles come prima.
     """
-    
-    # --- FASE 1: Rilevamento Veicoli/Oggetti e Smistamento ---
-    print("--- FASE 1: Rilevamento Veicoli/Oggetti e Smistamento ---")
-    
-    try:
-        # Chiamata senza il parametro save_marked_images
-        main_folder, vehicle_folders = process_images_in_folder()
-    except Exception as e:
-        print(f"Errore durante la Fase 1: {e}")
-        traceback.print_exc()
-        return
-    
-    if not main_folder:
-        print("Pipeline interrotta: Nessuna cartella selezionata o errore nella Fase 1.")
-        return
+    def __init__(self, output_root, class_map, iou_thresh=IOU_THRESH, center_factor=CENTER_FACTOR, materializer=None):
+        self.class_map = class_map
+        self.materializer = materializer or Materializer()
+        self.iou_thresh = iou_thresh
+        self.center_factor = center_factor
+        self.post_root = os.path.join(output_root, POST_ANALYSIS_DIRNAME)
+        self.merge_folders = {class_map[c] for c in MERGE_CLASSES if c in class_map}
+        self.config = {'output': POST_ANALYSIS_DIRNAME, 'merge': sorted(self.merge_folders),
+                       'iou_thresh': iou_thresh, 'center_factor': center_factor}
+
+        no_vehicles_folder = os.path.join(output_root, 'no_vehicles')
+        os.makedirs(self.post_root, exist_ok=True)
+        os.makedirs(no_vehicles_folder, exist_ok=True)
+        # Cartelle da non riscansionare come input (vedi detect_and_sort)
+        self.folders = {POST_ANALYSIS_DIRNAME: self.post_root, 'no_vehicles': no_vehicles_folder}
+        # Statistiche per classe, stesso formato di process_images_recursively_moto/_altro
+        self.class_stats = {}
+
+    def _class_folder(self, class_name):
+        stats = self.class_stats.get(class_name)
+        if stats is None:
+            dest_folder = os.path.join(self.post_root, class_name)
+            os.makedirs(dest_folder, exist_ok=True)
+            stats = {'total_images': 0, 'processed_images': 0, 'merged_boxes': 0, 'output_folder': dest_folder}
+            self.class_stats[class_name] = stats
+        return stats
+
+    def __call__(self, original_image_path, filename, boxes):
+        class_name = target_folder_name(boxes, self.class_map) if boxes else None
+        if class_name is None:
+            # Nessun BB (o nessuna classe mappata): copia in no_vehicles e basta
+            dest_image_path = os.path.join(self.folders['no_vehicles'], filename)
+            self.materializer(original_image_path, dest_image_path)
+            print(f"    Immagine copiata in 'no_vehicles': {filename}")
+            return dest_image_path
+
+        stats = self._class_folder(class_name)
+        stats['total_images'] += 1
+        merged_count = 0
+        if class_name in self.merge_folders:
+            boxes, merged_count = merge_boxes(boxes, self.iou_thresh, self.center_factor)
+            stats['merged_boxes'] += merged_count
+
+        # Unica copia dell'immagine, .json finale scritto direttamente accanto
+        dest_image_path = os.path.join(stats['output_folder'], filename)
+        self.materializer(original_image_path, dest_image_path)
+        save_metadata(dest_image_path, boxes)
+        stats['processed_images'] += 1
+
+        print(f"    Immagine elaborata in {class_name} (fusi: {merged_count}): {filename}")
+        return dest_image_path
+
+    def close(self):
+        self.materializer.close()
+
+
+def run_pipeline(input_folder, output_root=None, model_path=MODEL_PATH, batch_size=BATCH_SIZE,
+                 workers=DECODE_WORKERS, iou_thresh=IOU_THRESH, center_factor=CENTER_FACTOR, class_map=None,
+                 use_manifest=True, force=False, materialize=MATERIALIZE_MODE,
+                 backend=DEFAULT_BACKEND, intra_threads=None, inter_threads=None):
+    """
+    Esegue la pipeline completa (NON salva immagini annotate) senza alcuna interfaccia.
+    Rilevamento e post-analisi avvengono in un solo passaggio: i BB restano in memoria e
+    ogni immagine viene materializzata (materialize: copia, hardlink, reflink, symlink o
+    virtual) una volta sola in post_analisi/<Classe> (o no_vehicles)
+    sotto output_root (default: input_folder).
+    Restituisce un dizionario di statistiche serializzabile in JSON; gli errori sulle
+    singole immagini finiscono in stats['errors'], un errore di caricamento del modello viene sollevato.
+    Con use_manifest le immagini già elaborate in una run precedente vengono saltate (ripresa):
+    le statistiche per classe contano solo le immagini scritte in questa run.
+    """
+    t_start = time.perf_counter()
+    class_map = VEHICLE_CLASS_MAP if class_map is None else class_map
+    output_root = output_root or input_folder
+    sink = PostAnalysisSink(output_root, class_map, iou_thresh, center_factor, Materializer(materialize))
+
+    final_stats = {
+        'input_folder': input_folder,
+        'output_root': output_root,
+        'output_folder': sink.post_root,
+        'total_images': 0,
+        'processed_images': 0,
+        'merged_boxes': 0,
+        'detection': None,
+        'classes': sink.class_stats,
+        'errors': [],
+        'elapsed_s': 0.0,
+    }
+
+    print("--- Rilevamento Veicoli/Oggetti e Post-Analisi (passaggio unico) ---")
+    _, final_stats['detection'] = detect_and_sort(
+        input_folder,
+        output_root=output_root,
+        model_path=model_path,
+        class_map=class_map,
+        batch_size=batch_size,
+        decode_workers=workers,
+        use_manifest=use_manifest,
+        force=force,
+        sink=sink,
+        backend=backend,
+        intra_threads=intra_threads,
+        inter_threads=inter_threads,
+    )
+
+    final_stats['errors'] = final_stats['detection']['errors']
+    for stats_current in sink.class_stats.values():
+        final_stats['total_images'] += stats_current['total_images']
+        final_stats['processed_images'] += stats_current['processed_images']
+        final_stats['merged_boxes'] += stats_current['merged_boxes']
+
+    print("\n--- Pipeline Completata ---\n")
+    final_stats['elapsed_s'] = round(time.perf_counter() - t_start, 3)
+    return final_stats
+
+
+def _stdout_to_stderr():
+    # Inizializzatore dei processi figli quando il JSON delle statistiche va su stdout
+    sys.stdout = sys.stderr
 
-    # --- Creazione Cartella Post-Analisi Principale ---
-    target_post_analysis_root = os.path.join(main_folder, "post_analisi")
+
+def run_post_analysis(class_root, output_root=None, workers=POST_WORKERS, iou_thresh=IOU_THRESH,
+                      center_factor=CENTER_FACTOR, class_map=None, materialize=MATERIALIZE_MODE):
+    """
+    Post-analisi a cartelle (le vecchie Fasi 2 e 3) su cartelle di classe già prodotte da
+    estraibindingbox stand-alone: ogni classe è un job indipendente (cartelle disgiunte)
+    eseguito su un pool di processi; Moto con fusione BB, le altre senza.
+    Ogni classe scrive il suo log_moto.txt/log_altro.txt nella propria cartella.
+    Restituisce statistiche aggregate nello stesso formato di run_pipeline.
+    """
+    t_start = time.perf_counter()
+    class_map = VEHICLE_CLASS_MAP if class_map is None else class_map
+    output_root = output_root or class_root
+    target_post_analysis_root = os.path.join(output_root, POST_ANALYSIS_DIRNAME)
     os.makedirs(target_post_analysis_root, exist_ok=True)
-    print(f"\nCreata cartella radice post-analisi: {target_post_analysis_root}")
+    merge_folders = {class_map[c] for c in MERGE_CLASSES if c in class_map}
 
-    stats_moto = None
-    stats_altro_final = {'total_images': 0, 'processed_images': 0, 'merged_boxes': 0, 'output_folder': target_post_analysis_root}
+    jobs = []
+    for class_name in sorted(set(class_map.values())):
+        source_folder = os.path.join(class_root, class_name)
+        if not os.path.isdir(source_folder):
+            print(f"Cartella '{class_name}' non trovata. Saltata elaborazione.")
+            continue
+        process_fn = process_images_recursively_moto if class_name in merge_folders else process_images_recursively_altro
+        jobs.append((class_name, process_fn, source_folder))
 
-    # --- FASE 2: Post-Analisi Moto (con fusione BB) ---
-    print("\n--- FASE 2: Post-Analisi Moto (con fusione BB) ---")
-    moto_folder = vehicle_folders.get('motorcycle') 
-    
-    if moto_folder and os.path.exists(moto_folder):
-        try:
-            print(f"Elaborazione: Moto")
-            stats_moto = process_images_recursively_moto(
-                source_folder=moto_folder, 
-                target_post_folder=target_post_analysis_root, 
-                class_name='Moto', 
-                # Rimosso: save_marked_images
-                iou_thresh=0.12, 
-                center_factor=0.25
-            )
-            # Aggiorna le statistiche totali per la fase 2
-            stats_altro_final['total_images'] += stats_moto['total_images']
-            stats_altro_final['processed_images'] += stats_moto['processed_images']
-            stats_altro_final['merged_boxes'] += stats_moto['merged_boxes']
-        except Exception as e:
-            print(f"Errore durante la Fase 2 (Moto): {e}")
-            traceback.print_exc()
-            stats_moto = None
-    else:
-        print("Cartella 'Moto' non trovata o vuota. Saltata elaborazione post-analisi Moto.")
-
-
-    # --- FASE 3: Post-Analisi Altri Veicoli/Oggetti (senza fusione BB) ---
-    print("\n--- FASE 3: Post-Analisi Altri Veicoli/Oggetti (senza fusione BB) ---")
-    
-    other_classes_to_process = {k: v for k, v in vehicle_folders.items() if k not in ['motorcycle', 'no_vehicles']}
-    
-    for class_key, source_folder in other_classes_to_process.items():
-        class_name_for_output = os.path.basename(source_folder)
-        
-        if source_folder and os.path.exists(source_folder):
+    final_stats = {
+        'input_folder': class_root,
+        'output_root': output_root,
+        'output_folder': target_post_analysis_root,
+        'total_images': 0,
+        'processed_images': 0,
+        'merged_boxes': 0,
+        'detection': None,
+        'classes': {},
+        'errors': [],
+        'elapsed_s': 0.0,
+    }
+
+    workers = max(1, min(workers, len(jobs) or 1))
+    print(f"--- Post-Analisi a cartelle: {len(jobs)} classi su {workers} processi ---")
+    # Se stdout è già deviato su stderr (CLI con --stats-json -), lo stesso vale per i figli
+    initializer = _stdout_to_stderr if sys.stdout is sys.stderr else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        futures = {
+            executor.submit(process_fn, source_folder=source_folder, target_post_folder=target_post_analysis_root,
+                            class_name=class_name, iou_thresh=iou_thresh, center_factor=center_factor,
+                            materialize=materialize): class_name
+            for class_name, process_fn, source_folder in jobs
+        }
+        for future in as_completed(futures):
+            class_name = futures[future]
             try:
-                print(f"Elaborazione: {class_name_for_output}")
-                stats_current = process_images_recursively_altro(
-                    source_folder=source_folder,
-                    target_post_folder=target_post_analysis_root,
-                    class_name=class_name_for_output,
-                    # Rimosso: save_marked_images
-                    iou_thresh=0.12, 
-                    center_factor=0.25
-                )
-                
-                # Aggiorna le statistiche totali per la fase 3
-                stats_altro_final['total_images'] += stats_current['total_images']
-                stats_altro_final['processed_images'] += stats_current['processed_images']
-                
+                stats_current = future.result()
             except Exception as e:
-                print(f"Errore durante la Fase 3 ({class_name_for_output}): {e}")
-                traceback.print_exc()
-        else:
-            print(f"Cartella '{class_key}' non trovata o vuota. Saltata elaborazione.")
-            
-            
-    print("\n--- Pipeline Completata ---\n")
-    
-    # --- Statistiche Finali ---
-    total_images_all = stats_altro_final['total_images']
-    total_processed_all = stats_altro_final['processed_images']
-    total_merged_boxes = stats_altro_final['merged_boxes']
-
-    if total_images_all > 0:
-        final_stats = {
-            'total_images': total_images_all,
-            'processed_images': total_processed_all,
-            'merged_boxes': total_merged_boxes,
-            'output_folder': target_post_analysis_root 
-        }
-        
+                print(f"Errore durante la post-analisi di {class_name}: {e}")
+                final_stats['errors'].append(f"{class_name}: {e}")
+                continue
+            final_stats['classes'][class_name] = stats_current
+            print(f"Completata: {class_name} ({stats_current['processed_images']} immagini)")
+
+    # Aggregazione in ordine di classe, indipendente dall'ordine di completamento
+    final_stats['classes'] = dict(sorted(final_stats['classes'].items()))
+    for stats_current in final_stats['classes'].values():
+        final_stats['total_images'] += stats_current['total_images']
+        final_stats['processed_images'] += stats_current['processed_images']
+        final_stats['merged_boxes'] += stats_current['merged_boxes']
+
+    print("\n--- Post-Analisi Completata ---\n")
+    final_stats['elapsed_s'] = round(time.perf_counter() - t_start, 3)
+    return final_stats
+
+
+def print_summary(final_stats):
+    if final_stats['total_images'] > 0:
         print(f"Riassunto Generale:")
         print(f"Immagini totali scansionate: {final_stats['total_images']}")
         print(f"Immagini processate (con BB validi): {final_stats['processed_images']}")
         print(f"BB di moto fusi: {final_stats['merged_boxes']}")
         print(f"Output salvato in: {final_stats['output_folder']}")
-        
-        if 'show_stats_dialog' in globals():
-            show_stats_dialog(final_stats)
     else:
         print("Nessuna immagine elaborata in nessuna delle fasi.")
 
+
+def run_full_pipeline():
+    """
+    Versione interattiva: chiede la cartella con Tk, esegue run_pipeline e mostra le statistiche.
+    """
+    root = tk.Tk()
+    root.withdraw()
+    main_folder = filedialog.askdirectory(title="Seleziona la cartella principale con le immagini")
+    root.destroy()
+
+    if not main_folder:
+        print("Pipeline interrotta: Nessuna cartella selezionata.")
+        return
+
+    try:
+        final_stats = run_pipeline(main_folder)
+    except Exception as e:
+        print(f"Errore durante la pipeline: {e}")
+        traceback.print_exc()
+        return
+
+    print_summary(final_stats)
+    if final_stats['total_images'] > 0:
+        show_stats_dialog(final_stats)
+
+
+# ----------------------------
+# Riga di comando (server senza display, cron)
+# ----------------------------
+
+def _load_class_map(value):
+    """--class-map: percorso di un file JSON oppure JSON in linea, {classe_yolo: cartella}."""
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            class_map = json.load(f)
+    else:
+        class_map = json.loads(value)
+    if not isinstance(class_map, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in class_map.items()):
+        raise ValueError("la mappa deve essere un oggetto JSON {classe_yolo: cartella}")
+    return class_map
+
+
+def main(argv=None):
+    """
+    Esempio: python pipelineEstraiBB.py /dati/frame --output-root /dati/out --workers 16 --stats-json stats.json
+    Con --stats-json - (default) il JSON finale va su stdout e i messaggi di avanzamento su stderr.
+    Codici di uscita: 0 ok, 1 errore bloccante (es. modello non caricato), 2 errori su singole immagini.
+    """
+    parser = argparse.ArgumentParser(description="Pipeline estrazione BB: rilevamento, smistamento e post-analisi (senza interfaccia)")
+    parser.add_argument("input_folder", help="cartella con le immagini da analizzare")
+    parser.add_argument("--output-root", default=None, help="dove creare cartelle di classe e post_analisi (default: cartella di input)")
+    parser.add_argument("--model", default=MODEL_PATH, help=f"pesi YOLO (default: {MODEL_PATH})")
+    parser.add_argument("--backend", choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="motore di inferenza: torch (ultralytics) o modello ONNX su onnxruntime (onnx/openvino)")
+    parser.add_argument("--intra-threads", type=int, default=None, help="thread per operatore dell'inferenza")
+    parser.add_argument("--inter-threads", type=int, default=None, help="thread tra operatori dell'inferenza")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DECODE_WORKERS, help="worker di decodifica immagini")
+    parser.add_argument("--iou-thresh", type=float, default=IOU_THRESH)
+    parser.add_argument("--center-factor", type=float, default=CENTER_FACTOR)
+    parser.add_argument("--class-map", default=None, help="file JSON o JSON in linea {classe_yolo: cartella}")
+    parser.add_argument("--post-only", action="store_true",
+                        help="solo post-analisi: input_folder contiene le cartelle di classe di estraibindingbox")
+    parser.add_argument("--post-workers", type=int, default=POST_WORKERS, help="processi per --post-only (una classe ciascuno)")
+    parser.add_argument("--materialize", choices=MATERIALIZE_MODES, default=MATERIALIZE_MODE,
+                        help="come mettere le immagini nelle cartelle di output (hardlink/reflink/symlink/virtual evitano le copie)")
+    parser.add_argument("--no-manifest", action="store_true", help="non usare il manifest di ripresa")
+    parser.add_argument("--force", action="store_true", help="rielabora tutte le immagini anche se già nel manifest")
+    parser.add_argument("--stats-json", default="-", help="file in cui scrivere le statistiche JSON ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_folder):
+        parser.error(f"cartella di input inesistente: {args.input_folder}")
+    if args.batch_size < 1 or args.workers < 1 or args.post_workers < 1:
+        parser.error("--batch-size, --workers e --post-workers devono essere >= 1")
+    try:
+        class_map = _load_class_map(args.class_map) if args.class_map else None
+    except (OSError, ValueError) as e:
+        parser.error(f"--class-map non valida: {e}")
+
+    # Con le statistiche su stdout, tutto il resto va su stderr per non sporcare il JSON
+    progress_stream = sys.stderr if args.stats_json == "-" else sys.stdout
+    exit_code = 0
+    with contextlib.redirect_stdout(progress_stream):
+        try:
+            if args.post_only:
+                final_stats = run_post_analysis(
+                    args.input_folder,
+                    output_root=args.output_root,
+                    workers=args.post_workers,
+                    iou_thresh=args.iou_thresh,
+                    center_factor=args.center_factor,
+                    class_map=class_map,
+                    materialize=args.materialize,
+                )
+            else:
+                final_stats = run_pipeline(
+                    args.input_folder,
+                    output_root=args.output_root,
+                    model_path=args.model,
+                    batch_size=args.batch_size,
+                    workers=args.workers,
+                    iou_thresh=args.iou_thresh,
+                    center_factor=args.center_factor,
+                    class_map=class_map,
+                    use_manifest=not args.no_manifest,
+                    force=args.force,
+                    materialize=args.materialize,
+                    backend=args.backend,
+                    intra_threads=args.intra_threads,
+                    inter_threads=args.inter_threads,
+                )
+            print_summary(final_stats)
+            if final_stats['errors']:
+                exit_code = 2
+        except Exception as e:
+            traceback.print_exc()
+            final_stats = {'input_folder': args.input_folder, 'errors': [str(e)]}
+            exit_code = 1
+
+    payload = json.dumps(final_stats, indent=2, ensure_ascii=False)
+    if args.stats_json == "-":
+        print(payload)
+    else:
+        with open(args.stats_json, 'w', encoding='utf-8') as f:
+            f.write(payload + "\n")
+    return exit_code
+
+
 if __name__ == "__main__":
-    run_full_pipeline()
\ No newline at end of file
+    # Senza argomenti resta il comportamento storico (finestra di dialogo Tk)
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    run_full_pipeline()
@@ -12,26 +12,32 @@ import tkinter as tk
 from tkinter import ttk
 import math
 import json # Importato per la gestione del JSON
+from materializza import Materializer, DEFAULT_MODE as MATERIALIZE_MODE
 
 # ----------------------------
 # Logging Setup
 # ----------------------------
-def setup_logging(folder):
-    """Configura il logging su file e console."""
+def setup_logging(folder, class_name=None):
+    """
+    Configura il logging su file (log_altro.txt nella cartella) e console con un logger
+    dedicato alla classe. Non tocca i gestori del logger radice: più classi elaborate
+    in sequenza o in parallelo (pipelineEstraiBB --post-only) non si sovrascrivono i log.
+    """
     log_file = os.path.join(folder, "log_altro.txt")
-    
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, mode='a'),
-            logging.StreamHandler()
-        ]
-    )
-    return logging.getLogger("postanalisialtro")
+    logger = logging.getLogger("postanalisialtro" + (f".{class_name}" if class_name else ""))
+
+    # Chiamate ripetute sulla stessa classe: via i gestori della volta precedente
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    for handler in (logging.FileHandler(log_file, mode='a'), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
 
 # ----------------------------
 # Metadati Sidecar .json
@@ -141,9 +147,9 @@ def show_stats_dialog(stats_data):
 # ----------------------------
 # Main processing function
 # ----------------------------
-def process_images_recursively_altro(source_folder, target_post_folder, class_name, iou_thresh=0.12, center_factor=0.25):
+def process_images_recursively_altro(source_folder, target_post_folder, class_name, iou_thresh=0.12, center_factor=0.25, materialize=MATERIALIZE_MODE):
     """Copia le immagini e i loro file .json affiancati nella cartella di output (senza fusione)."""
-    logger = setup_logging(source_folder)
+    logger = setup_logging(source_folder, class_name)
     logger.info(f"--- Inizio Post-Analisi per {class_name} (metadati in .json) ---")
     
     dest_folder = os.path.join(target_post_folder, class_name)
@@ -152,6 +158,7 @@ def process_images_recursively_altro(source_folder, target_post_folder, class_na
         logger.info("Creata cartella di output: %s", dest_folder)
         
     stats = {'total_images': 0, 'processed_images': 0, 'merged_boxes': 0, 'output_folder': dest_folder} 
+    materializer = Materializer(materialize)
 
     for subdir, dirs, files in os.walk(source_folder):
         if subdir == dest_folder:
@@ -186,7 +193,7 @@ def process_images_recursively_altro(source_folder, target_post_folder, class_na
                 
                 # 1. Copia l'immagine
                 try:
-                    shutil.copy2(full_in_path, out_clean_path)
+                    materializer(full_in_path, out_clean_path)
                 except Exception as e:
                     logger.error(f"Errore nel salvataggio dell'immagine {out_clean_path}: {str(e)}")
                     continue
@@ -207,6 +214,8 @@ def process_images_recursively_altro(source_folder, target_post_folder, class_na
                 logger.error(traceback.format_exc())
                 continue
 
+    materializer.close()
+    stats['materialization'] = materializer.stats
     logger.info("Completato. Tot immagini: %d, processate: %d", stats['total_images'], stats['processed_images'])
     return stats
 
@@ -245,7 +254,7 @@ if __name__ == "__main__":
                 all_stats.append(stats)
             except Exception as e:
                 messagebox.showerror("Errore di Elaborazione", f"Si è verificato un errore critico per {class_name}: {str(e)}")
-                logging.getLogger("postanalisialtro").error(f"Errore critico nel main per {class_name}: {str(e)}")
+                logging.getLogger(f"postanalisialtro.{class_name}").error(f"Errore critico nel main per {class_name}: {str(e)}")
         else:
             print(f"ATTENZIONE: La cartella {source_folder} non esiste. Saltata.")
 
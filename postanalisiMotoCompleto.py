@@ -12,26 +12,34 @@ import tkinter as tk
 from tkinter import ttk
 import math
 import json # Importato per la gestione del JSON
+from materializza import Materializer, DEFAULT_MODE as MATERIALIZE_MODE
+import numpy as np
+import geometriaBox
 
 # ----------------------------
 # Logging Setup
 # ----------------------------
-def setup_logging(folder):
-    """Configura il logging su file e console."""
+def setup_logging(folder, class_name=None):
+    """
+    Configura il logging su file (log_moto.txt nella cartella) e console con un logger
+    dedicato alla classe. Non tocca i gestori del logger radice: più classi elaborate
+    in sequenza o in parallelo (pipelineEstraiBB --post-only) non si sovrascrivono i log.
+    """
     log_file = os.path.join(folder, "log_moto.txt")
-    
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, mode='a'),
-            logging.StreamHandler()
-        ]
-    )
-    return logging.getLogger("postanalisimotp")
+    logger = logging.getLogger("postanalisimotp" + (f".{class_name}" if class_name else ""))
+
+    # Chiamate ripetute sulla stessa classe: via i gestori della volta precedente
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
+
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    for handler in (logging.FileHandler(log_file, mode='a'), logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
 
 # ----------------------------
 # Metadati Sidecar .json
@@ -90,19 +98,8 @@ def save_updated_metadata_json(dest_path_base, boxes, plate_box=None):
 # ----------------------------
 
 def calculate_iou(boxA, boxB):
-    # Logica omessa...
-    xA = max(boxA[0], boxB[0])
-    yA = max(boxA[1], boxB[1])
-    xB = min(boxA[2], boxB[2])
-    yB = min(boxA[3], boxB[3])
-
-    interArea = max(0, xB - xA) * max(0, yB - yA)
-
-    boxAArea = (boxA[2] - boxA[0]) * (boxA[3] - boxA[1])
-    boxBArea = (boxB[2] - boxB[0]) * (boxB[3] - boxB[1])
-
-    iou = interArea / float(boxAArea + boxBArea - interArea)
-    return iou
+    """IoU di due box (0.0 per box degeneri, niente divisione per zero)."""
+    return geometriaBox.iou(boxA, boxB)
 
 def get_center(box):
     """Calcola il centro di un box [x1, y1, x2, y2]."""
@@ -123,6 +120,39 @@ def is_center_close(boxA, boxB, max_distance_factor):
     
     return dist_sq < max_dist_sq
 
+def cluster_adjacent(adjacent):
+    """
+    Raggruppa gli indici collegati (union-find) dalla matrice booleana (N, N) di adiacenza.
+    Replica l'ordine del vecchio clustering a dizionario: coppie visitate in ordine (i, j),
+    il gruppo più piccolo confluisce nel più grande (a parità vince quello di i) e i gruppi
+    escono ordinati per indice del sopravvissuto.
+    """
+    n = adjacent.shape[0]
+    parent = list(range(n))
+    size = [1] * n
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # path halving
+            x = parent[x]
+        return x
+
+    # np.nonzero scorre la triangolare superiore per righe: stesso ordine del doppio ciclo i < j
+    rows, cols = np.nonzero(np.triu(adjacent, k=1))
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j:
+            continue
+        if size[root_i] < size[root_j]:
+            root_i, root_j = root_j, root_i
+        parent[root_j] = root_i
+        size[root_i] += size[root_j]
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return [groups[root] for root in sorted(groups)]
+
 def merge_boxes(boxes, iou_thresh, center_factor):
     """Fonde i bounding box per le classi specificate che si sovrappongono o sono vicini."""
     if not boxes:
@@ -146,30 +176,16 @@ def merge_boxes(boxes, iou_thresh, center_factor):
         if not current_class_coords:
             continue
             
-        num_coords = len(current_class_coords)
-        groups = {i: [i] for i in range(num_coords)}
-        
-        # Algoritmo di clustering (come prima)
-        for i in range(num_coords):
-            for j in range(i + 1, num_coords):
-                boxA = current_class_coords[i]
-                boxB = current_class_coords[j]
-                
-                iou = calculate_iou(boxA, boxB)
-                center_close = is_center_close(boxA, boxB, center_factor)
-                
-                if iou > iou_thresh or center_close:
-                    group_i = next(k for k, v in groups.items() if i in v)
-                    group_j = next(k for k, v in groups.items() if j in v)
+        # IoU e vicinanza dei centri per tutte le coppie in un colpo solo
+        coords_arr = geometriaBox.as_boxes(current_class_coords)
+        adjacent = (geometriaBox.iou_matrix(coords_arr) > iou_thresh) | \
+                   geometriaBox.centers_close_matrix(coords_arr, max_distance_factor=center_factor)
 
-                    if group_i != group_j:
-                        if len(groups[group_i]) < len(groups[group_j]):
-                            groups[group_j].extend(groups.pop(group_i))
-                        else:
-                            groups[group_i].extend(groups.pop(group_j))
+        # Clustering: componenti connesse del grafo delle coppie vicine
+        groups = cluster_adjacent(adjacent)
 
         # Crea i box finali fusi per questa classe
-        for group in groups.values():
+        for group in groups:
             if len(group) > 1:
                 merged_count += len(group) - 1
             
@@ -263,9 +279,9 @@ def show_stats_dialog(stats_data):
 # ----------------------------
 # Main processing function
 # ----------------------------
-def process_images_recursively_moto(source_folder, target_post_folder, class_name, iou_thresh=0.12, center_factor=0.25):
+def process_images_recursively_moto(source_folder, target_post_folder, class_name, iou_thresh=0.12, center_factor=0.25, materialize=MATERIALIZE_MODE):
     """Esegue la fusione BB per le moto (usando e aggiornando il file .json affiancato)."""
-    logger = setup_logging(source_folder)
+    logger = setup_logging(source_folder, class_name)
     logger.info(f"--- Inizio Post-Analisi per {class_name} (con fusione, metadati in .json) ---")
     
     dest_folder = os.path.join(target_post_folder, class_name)
@@ -274,6 +290,7 @@ def process_images_recursively_moto(source_folder, target_post_folder, class_nam
         logger.info("Creata cartella di output: %s", dest_folder)
         
     stats = {'total_images': 0, 'processed_images': 0, 'merged_boxes': 0, 'output_folder': dest_folder} 
+    materializer = Materializer(materialize)
 
     for subdir, dirs, files in os.walk(source_folder):
         if subdir == dest_folder:
@@ -317,7 +334,7 @@ def process_images_recursively_moto(source_folder, target_post_folder, class_nam
 
                 # 1. Copia l'immagine originale
                 try:
-                    shutil.copy2(full_in_path, out_clean_path)
+                    materializer(full_in_path, out_clean_path)
                 except Exception as e:
                     logger.error(f"Errore nel salvataggio dell'immagine {out_clean_path}: {str(e)}")
                     continue
@@ -333,6 +350,8 @@ def process_images_recursively_moto(source_folder, target_post_folder, class_nam
                 logger.error(traceback.format_exc())
                 continue
 
+    materializer.close()
+    stats['materialization'] = materializer.stats
     logger.info("Completato. Tot immagini: %d, fusioni: %d", stats['total_images'], stats['merged_boxes'])
     return stats
 
@@ -374,7 +393,7 @@ if __name__ == "__main__":
                 all_stats.append(stats) 
             except Exception as e:
                 messagebox.showerror("Errore di Elaborazione", f"Si è verificato un errore critico per {class_name}: {str(e)}")
-                logging.getLogger("postanalisimotp").error(f"Errore critico nel main per {class_name}: {str(e)}")
+                logging.getLogger(f"postanalisimotp.{class_name}").error(f"Errore critico nel main per {class_name}: {str(e)}")
         else:
             messagebox.showinfo("Avviso", f"La cartella {source_folder} non esiste, saltata.")
 
@@ -0,0 +1,252 @@
+# rilevatori.py - BACKEND DI RILEVAMENTO (YOLO) INTERCAMBIABILI
+#
+# Un rilevatore espone:
+#   names                 : dizionario id classe -> nome classe (come model.names di ultralytics)
+#   detect(immagini)      : lista di immagini PIL RGB -> per ogni immagine lista di
+#                           {'class': nome, 'coords': (x1, y1, x2, y2)} con coordinate intere
+# Backend:
+#   torch    : ultralytics YOLO su PyTorch (comportamento storico)
+#   onnx     : modello esportato in ONNX eseguito con ONNX Runtime (CPUExecutionProvider)
+#   openvino : stesso modello ONNX con OpenVINOExecutionProvider (onnxruntime-openvino)
+# Le librerie vengono importate solo quando il backend viene creato: con onnx/openvino
+# non si paga l'import di torch/ultralytics (secondi su macchine senza GPU).
+#
+# Il backend ONNX replica pre e post-elaborazione di ultralytics (letterbox 114,
+# soglia di confidenza 0.25, NMS per classe con IoU 0.7, max 300 rilevamenti).
+# Come ultralytics su PyTorch, se tutte le immagini del batch hanno la stessa forma il
+# letterbox è rettangolare (riempimento solo fino al multiplo di 32 successivo, il modello
+# è esportato con dimensioni dinamiche); con forme diverse si riempie a 640x640.
+# benchRilevatori.py confronta i box dei due backend.
+
+import os
+import ast
+
+import numpy as np
+
+import geometriaBox
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+DEFAULT_BACKEND = 'torch'
+
+# Parametri di inferenza (default di ultralytics)
+IMGSZ = 640
+CONF_THRESH = 0.25
+NMS_IOU = 0.7
+MAX_DET = 300
+# Candidati (per punteggio) ammessi alla NMS, come max_nms di ultralytics
+MAX_NMS = 30000
+LETTERBOX_COLOR = 114
+# Passo massimo del modello: il letterbox rettangolare arriva a un suo multiplo
+STRIDE = 32
+# Scostamento per classe nella NMS (stesso trucco di ultralytics: box di classi diverse non si toccano)
+NMS_CLASS_OFFSET = 7680
+
+
+def onnx_path_for(model_path):
+    """Percorso del modello ONNX accanto ai pesi .pt (yolov8n.pt -> yolov8n.onnx)."""
+    if model_path.lower().endswith('.onnx'):
+        return model_path
+    return os.path.splitext(model_path)[0] + '.onnx'
+
+
+def export_onnx(model_path, imgsz=IMGSZ):
+    """Esporta i pesi .pt in ONNX con batch dinamico (serve ultralytics). Restituisce il percorso."""
+    from ultralytics import YOLO
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True)
+    return str(exported)
+
+
+# ----------------------------
+# PyTorch (ultralytics)
+# ----------------------------
+
+class TorchDetector(object):
+    """ultralytics YOLO: un'unica chiamata model(lista_immagini) per batch."""
+    backend = 'torch'
+
+    def __init__(self, model_path, intra_threads=None, inter_threads=None):
+        if intra_threads or inter_threads:
+            import torch
+            if intra_threads:
+                torch.set_num_threads(intra_threads)
+            if inter_threads:
+                torch.set_num_interop_threads(inter_threads)
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+        self.names = self.model.names
+
+    def detect(self, images):
+        results = self.model(list(images), verbose=False)
+        detections = []
+        for result in results:
+            boxes = []
+            for box in result.boxes:
+                class_id = int(box.cls[0].item())
+                x1, y1, x2, y2 = [int(x.item()) for x in box.xyxy[0]]
+                boxes.append({'class': self.names[class_id], 'coords': (x1, y1, x2, y2)})
+            detections.append(boxes)
+        return detections
+
+
+# ----------------------------
+# ONNX Runtime (CPU / OpenVINO)
+# ----------------------------
+
+def letterbox(image_rgb, imgsz=IMGSZ, auto=False, stride=STRIDE):
+    """
+    Ridimensiona mantenendo le proporzioni e riempie con grigio 114 (stessi arrotondamenti
+    di ultralytics.data.augment.LetterBox): a imgsz x imgsz, oppure con auto=True solo fino
+    al multiplo di stride successivo (letterbox rettangolare).
+    Restituisce (array HxWx3 uint8, gain, (pad_x, pad_y)); gain e pad sono ricavati dalle
+    dimensioni finali come in ultralytics.utils.ops.scale_boxes.
+    """
+    import cv2
+    h, w = image_rgb.shape[:2]
+    ratio = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    dw, dh = imgsz - new_w, imgsz - new_h
+    if auto:
+        dw, dh = dw % stride, dh % stride
+    dw, dh = dw / 2, dh / 2
+    if (w, h) != (new_w, new_h):
+        image_rgb = cv2.resize(image_rgb, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    padded = cv2.copyMakeBorder(image_rgb, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                value=(LETTERBOX_COLOR,) * 3)
+    out_h, out_w = padded.shape[:2]
+    gain = min(out_h / h, out_w / w)
+    pad = (round((out_w - w * gain) / 2 - 0.1), round((out_h - h * gain) / 2 - 0.1))
+    return padded, gain, pad
+
+
+def _iou_row(box, others):
+    """
+    IoU di box contro others nel dtype dei box (float32 per l'uscita del modello), con le
+    stesse operazioni di torchvision.ops.nms: geometriaBox lavora in float64 e con lo
+    scostamento per classe (centinaia di migliaia di pixel) i casi al limite della soglia
+    verrebbero decisi diversamente da ultralytics.
+    """
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    w = np.maximum(np.minimum(box[2], others[:, 2]) - np.maximum(box[0], others[:, 0]), 0)
+    h = np.maximum(np.minimum(box[3], others[:, 3]) - np.maximum(box[1], others[:, 1]), 0)
+    inter = w * h
+    return inter / (area + areas - inter)
+
+
+def nms(boxes, scores, iou_thresh=NMS_IOU, max_det=MAX_DET, max_nms=MAX_NMS):
+    """
+    NMS greedy: indici dei box tenuti, in ordine di punteggio decrescente.
+    Una riga di IoU alla volta (box tenuto contro i candidati rimasti), quindi memoria
+    lineare nel numero di candidati anche su frame affollati con soglia bassa.
+    """
+    order = np.argsort(-scores, kind='stable')[:max_nms]
+    keep = []
+    while len(order) and len(keep) < max_det:
+        best, order = order[0], order[1:]
+        keep.append(best)
+        if len(order):
+            ious = _iou_row(boxes[best], boxes[order])
+            order = order[ious.astype(np.float64) <= iou_thresh]
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(prediction, gain, pad, orig_shape, conf_thresh=CONF_THRESH, iou_thresh=NMS_IOU, max_det=MAX_DET):
+    """
+    Uscita grezza YOLOv8 (4 + n_classi, n_ancore) di una immagine -> lista di
+    (class_id, [x1, y1, x2, y2]) nelle coordinate dell'immagine originale.
+    """
+    pred = prediction.T                               # (n_ancore, 4 + n_classi)
+    class_scores = pred[:, 4:]
+    class_ids = class_scores.argmax(1)
+    scores = class_scores[np.arange(len(pred)), class_ids]
+    mask = scores > conf_thresh
+    if not mask.any():
+        return []
+    pred, class_ids, scores = pred[mask], class_ids[mask], scores[mask]
+
+    # xywh (centro) -> xyxy. Tutto resta nel float32 del modello, come in ultralytics:
+    # NMS e troncamento finale a intero decidono i casi al limite allo stesso modo
+    cx, cy, w, h = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    offsets = (class_ids * NMS_CLASS_OFFSET).astype(boxes.dtype)[:, None]
+    keep = nms(boxes + offsets, scores, iou_thresh, max_det)
+    boxes, class_ids = boxes[keep], class_ids[keep]
+
+    # Dal letterbox all'immagine originale
+    boxes[:, [0, 2]] -= boxes.dtype.type(pad[0])
+    boxes[:, [1, 3]] -= boxes.dtype.type(pad[1])
+    boxes /= boxes.dtype.type(gain)
+    boxes = geometriaBox.clip_boxes(boxes, orig_shape[1], orig_shape[0])
+    return list(zip(class_ids.tolist(), boxes.tolist()))
+
+
+class OnnxDetector(object):
+    """Modello YOLOv8 esportato in ONNX (batch dinamico) su ONNX Runtime."""
+    backend = 'onnx'
+
+    def __init__(self, model_path, intra_threads=None, inter_threads=None, provider='CPUExecutionProvider'):
+        import onnxruntime as ort
+        onnx_path = onnx_path_for(model_path)
+        if not os.path.exists(onnx_path):
+            print(f"Modello ONNX {onnx_path} non trovato: esporto da {model_path}...")
+            onnx_path = export_onnx(model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_threads:
+            options.intra_op_num_threads = intra_threads
+        if inter_threads:
+            options.inter_op_num_threads = inter_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        if provider not in ort.get_available_providers():
+            raise RuntimeError(f"{provider} non disponibile in onnxruntime (disponibili: {ort.get_available_providers()})")
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=[provider])
+        self.input_name = self.session.get_inputs()[0].name
+
+        # ultralytics salva i nomi delle classi nei metadati del modello esportato
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        self.imgsz = IMGSZ
+        if 'imgsz' in metadata:
+            self.imgsz = ast.literal_eval(metadata['imgsz'])[0]
+        self.stride = int(metadata['stride']) if 'stride' in metadata else STRIDE
+        # Con dimensioni fisse nel grafo si può solo riempire al quadrato
+        height, width = self.session.get_inputs()[0].shape[2:]
+        self.dynamic = not (isinstance(height, int) and isinstance(width, int))
+
+    def detect(self, images):
+        rgbs = [np.asarray(image) for image in images]
+        # Come il predictor di ultralytics: rettangolare solo se il batch ha un'unica forma
+        auto = self.dynamic and len({rgb.shape for rgb in rgbs}) == 1
+        arrays, metas = [], []
+        for rgb in rgbs:
+            padded, gain, pad = letterbox(rgb, self.imgsz, auto, self.stride)
+            arrays.append(padded)
+            metas.append((gain, pad, rgb.shape[:2]))
+        batch = np.stack(arrays).transpose(0, 3, 1, 2).astype(np.float32) / 255.0   # NCHW, RGB, 0-1
+        outputs = self.session.run(None, {self.input_name: np.ascontiguousarray(batch)})[0]
+
+        detections = []
+        for prediction, (gain, pad, orig_shape) in zip(outputs, metas):
+            boxes = []
+            for class_id, coords in postprocess(prediction, gain, pad, orig_shape):
+                boxes.append({'class': self.names.get(class_id, str(class_id)),
+                              'coords': tuple(int(c) for c in coords)})
+            detections.append(boxes)
+        return detections
+
+
+def create_detector(backend=DEFAULT_BACKEND, model_path='yolov8n.pt', intra_threads=None, inter_threads=None):
+    """Crea il rilevatore del backend scelto (vedi BACKENDS)."""
+    if backend == 'torch':
+        return TorchDetector(model_path, intra_threads, inter_threads)
+    if backend == 'onnx':
+        return OnnxDetector(model_path, intra_threads, inter_threads)
+    if backend == 'openvino':
+        detector = OnnxDetector(model_path, intra_threads, inter_threads, provider='OpenVINOExecutionProvider')
+        detector.backend = 'openvino'
+        return detector
+    raise ValueError(f"backend di rilevamento sconosciuto: {backend} (validi: {', '.join(BACKENDS)})")